@@ -1,7 +1,10 @@
 #!/bin/sh
 
-python manage.py migrate
-python manage.py collectstatic --no-input --clear 
+# Seconds since the epoch, for the workers to report their time to the first request
+export CONTAINER_STARTED_AT=$(date +%s.%N)
 
-exec "$@"
+# Applies new migrations and collects changed static files, in a single boot of Django that skips both when
+# there's nothing to do
+python manage.py startup
 
+exec "$@"
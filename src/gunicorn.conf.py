@@ -0,0 +1,13 @@
+import os
+
+# "wsgi" runs viberr.wsgi with sync workers, one request per process at a time.
+# "asgi" runs viberr.asgi with uvicorn workers, whose event loop takes care of reading requests and writing
+# responses, so that slow clients only hold a connection rather than a whole worker. Streaming responses, such as
+# library and album exports, are iterated on a thread so that reading and zipping files doesn't block that loop.
+SERVER_MODE = os.environ.get("SERVER_MODE", "wsgi")
+
+# The number of workers comes from WEB_CONCURRENCY, as usual
+bind = "0.0.0.0:8000"
+worker_class = "uvicorn.workers.UvicornWorker" if SERVER_MODE == "asgi" else "sync"
+# Load Django once in the master rather than in every worker, so that workers start serving straight away
+preload_app = True
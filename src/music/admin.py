@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Album, Song
+from .models import Album, Playlist, Song
 
 admin.site.register(Album)
 admin.site.register(Song)
+admin.site.register(Playlist)
@@ -0,0 +1,256 @@
+import json
+
+from django.forms.models import model_to_dict
+from django.http import Http404, HttpResponse, JsonResponse, QueryDict
+from django.http.multipartparser import MultiPartParserError
+from django.views.decorators.http import require_http_methods
+
+from .forms import AlbumForm, SongForm
+from .models import Album, Song
+from .pagination import paginate_keyset
+from .search import search
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class Resource(object):
+    """
+    Describes how a model is shown in the API. Each field lists the columns it needs, so that a request for
+    some of the fields ("?fields=id,title") only selects those, and a function that turns an object into its value.
+    """
+    model = None
+    fields = {}
+    default_fields = ()
+    form_class = None
+    orderings = {'id': ('id',), 'favourites': ('-is_favourite', 'id')}
+
+    def get_fields(self, request):
+        """
+        Returns the fields asked for by the "fields" parameter, or the default ones.
+        Raises ValueError for unknown fields.
+        """
+        fields = request.GET.get('fields')
+        if not fields:
+            return list(self.default_fields)
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = set(fields) - set(self.fields)
+        if unknown:
+            raise ValueError("Unknown field(s): %s." % ', '.join(sorted(unknown)))
+        return fields
+
+    def get_queryset(self, request, fields, ordering=()):
+        """
+        The user's objects, selecting only the columns that the fields and the ordering need.
+        """
+        columns = {'id'}
+        for field in fields:
+            columns.update(self.fields[field][0])
+        columns.update(field.lstrip('-') for field in ordering if field.lstrip('-') != 'rank')
+        return self.model.objects.owned_by(request.user).only(*columns)
+
+    def serialize(self, request, obj, fields):
+        return {field: self.fields[field][1](request, obj) for field in fields}
+
+
+def file_url(field_file):
+    return field_file.url if field_file else None
+
+
+class AlbumResource(Resource):
+    model = Album
+    form_class = AlbumForm
+    fields = {
+        'id': (['id'], lambda request, album: album.pk),
+        'artist': (['artist'], lambda request, album: album.artist),
+        'title': (['title'], lambda request, album: album.title),
+        'genre': (['genre'], lambda request, album: album.genre),
+        'logo': (['logo'], lambda request, album: file_url(album.logo)),
+        'is_favourite': (['is_favourite'], lambda request, album: album.is_favourite),
+        'song_count': (['song_count'], lambda request, album: album.song_count),
+    }
+    default_fields = ('id', 'artist', 'title', 'genre', 'logo', 'is_favourite', 'song_count')
+
+
+def embed_album(request, song):
+    album = song.album
+    return {'id': album.pk, 'artist': album.artist, 'title': album.title, 'genre': album.genre}
+
+
+class SongResource(Resource):
+    model = Song
+    form_class = SongForm
+    fields = {
+        'id': (['id'], lambda request, song: song.pk),
+        'title': (['title'], lambda request, song: song.title),
+        'is_favourite': (['is_favourite'], lambda request, song: song.is_favourite),
+        'stream': (['audio_file'], lambda request, song: song.get_stream_url()),
+        'duration': (['duration'], lambda request, song: song.duration),
+        'sample_rate': (['sample_rate'], lambda request, song: song.sample_rate),
+        'bitrate': (['bitrate'], lambda request, song: song.bitrate),
+        'channels': (['channels'], lambda request, song: song.channels),
+        'tags': (['tags'], lambda request, song: song.tags),
+        # Embedded with select_related(), in the same query as the songs
+        'album': (['album', 'album__artist', 'album__title', 'album__genre'], embed_album),
+    }
+    default_fields = ('id', 'title', 'is_favourite', 'stream', 'duration', 'album')
+
+    def get_queryset(self, request, fields, ordering=()):
+        queryset = super(SongResource, self).get_queryset(request, fields, ordering)
+        if 'album' in fields:
+            queryset = queryset.select_related('album')
+        return queryset
+
+
+def error(message, status=400, **extra):
+    return JsonResponse(dict(extra, error=message), status=status)
+
+
+class UnsupportedMediaType(ValueError):
+    pass
+
+
+def read_data(request):
+    """
+    Returns the submitted fields and files, from either a JSON body or a (multipart) form.
+    Raises UnsupportedMediaType for any other body, rather than treating it as empty.
+    """
+    if request.content_type == 'application/json':
+        data = json.loads(request.body.decode() or '{}')
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object.")
+        return data, {}
+    if request.content_type not in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        raise UnsupportedMediaType("Expected JSON or form data.")
+    if request.method == 'POST':
+        return request.POST, request.FILES
+    # Django only parses the forms of POST requests
+    if request.content_type == 'multipart/form-data':
+        try:
+            return request.parse_file_upload(request.META, request)
+        except MultiPartParserError as e:
+            raise ValueError(str(e))
+    return QueryDict(request.body, encoding=request.encoding), {}
+
+
+def login_required_json(view):
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return error("Please log in.", status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def list_view(resource):
+    """
+    GET lists the user's objects a page at a time, following the "cursor" of the previous page.
+    "order" picks one of the resource's orderings and "q" searches instead, best matches first.
+    POST creates an object.
+    """
+    @require_http_methods(["GET", "POST"])
+    @login_required_json
+    def view(request):
+        if request.method == "POST":
+            return create(request, resource)
+        try:
+            fields = resource.get_fields(request)
+        except ValueError as e:
+            return error(str(e))
+        try:
+            per_page = min(max(int(request.GET.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            return error("Invalid limit.")
+
+        query = request.GET.get('q')
+        if query:
+            ordering = ('-rank', 'id')
+        else:
+            ordering = resource.orderings.get(request.GET.get('order', 'id'))
+            if ordering is None:
+                return error("Unknown order, expected one of: %s." % ', '.join(sorted(resource.orderings)))
+        queryset = resource.get_queryset(request, fields, ordering)
+        if query:
+            queryset = search(queryset, query)
+
+        try:
+            page = paginate_keyset(queryset, ordering, request.GET.get('cursor'), per_page)
+            results = [resource.serialize(request, obj, fields) for obj in page]
+        except ValueError:
+            return error("Invalid cursor.")
+        next_url = None
+        if page.has_next():
+            params = request.GET.copy()
+            params['cursor'] = page.next_cursor
+            next_url = request.path + '?' + params.urlencode()
+        return JsonResponse({'results': results, 'next': next_url})
+    return view
+
+
+def detail_view(resource):
+    """
+    GET returns one of the user's objects, PATCH changes some of its fields and DELETE deletes it.
+    """
+    @require_http_methods(["GET", "PATCH", "DELETE"])
+    @login_required_json
+    def view(request, pk):
+        try:
+            fields = resource.get_fields(request)
+        except ValueError as e:
+            return error(str(e))
+        # Changes need the whole object, reads only the requested fields
+        if request.method == "GET":
+            queryset = resource.get_queryset(request, fields)
+        else:
+            queryset = resource.model.objects.owned_by(request.user)
+        try:
+            obj = queryset.get(pk=pk)
+        except (resource.model.DoesNotExist, ValueError):
+            raise Http404("Not found.")
+
+        if request.method == "DELETE":
+            obj.delete()
+            return HttpResponse(status=204)
+        if request.method == "PATCH":
+            return update(request, resource, obj, fields)
+        return JsonResponse(resource.serialize(request, obj, fields))
+    return view
+
+
+def create(request, resource):
+    try:
+        data, files = read_data(request)
+    except UnsupportedMediaType as e:
+        return error(str(e), status=415)
+    except ValueError as e:
+        return error(str(e))
+    form = resource.form_class(data, files, user=request.user)
+    if not form.is_valid():
+        return error("Invalid data.", errors=form.errors)
+    obj = form.save()
+    return JsonResponse(resource.serialize(request, obj, resource.default_fields), status=201)
+
+
+def update(request, resource, obj, fields):
+    """
+    Changes only the fields that were sent, keeping the current file unless a new one is uploaded.
+    """
+    try:
+        data, files = read_data(request)
+    except UnsupportedMediaType as e:
+        return error(str(e), status=415)
+    except ValueError as e:
+        return error(str(e))
+    current = model_to_dict(obj, fields=resource.form_class._meta.fields)
+    # items(), as updating a dict with a QueryDict would copy its lists of values
+    current.update(data.items())
+    form = resource.form_class(current, files, instance=obj, user=request.user)
+    if not form.is_valid():
+        return error("Invalid data.", errors=form.errors)
+    obj = form.save()
+    return JsonResponse(resource.serialize(request, obj, fields))
+
+
+album_list = list_view(AlbumResource())
+album_detail = detail_view(AlbumResource())
+song_list = list_view(SongResource())
+song_detail = detail_view(SongResource())
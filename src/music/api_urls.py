@@ -0,0 +1,19 @@
+from django.urls import path
+
+from . import api
+
+app_name = 'api'
+
+urlpatterns = [
+    # /api/v1/albums/
+    path('albums/', api.album_list, name='album-list'),
+
+    # /api/v1/albums/<album_id>/
+    path('albums/<int:pk>/', api.album_detail, name='album-detail'),
+
+    # /api/v1/songs/
+    path('songs/', api.song_list, name='song-list'),
+
+    # /api/v1/songs/<song_id>/
+    path('songs/<int:pk>/', api.song_detail, name='song-detail'),
+]
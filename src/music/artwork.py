@@ -0,0 +1,68 @@
+import os
+import tempfile
+
+from PIL import Image
+
+# Widths (and heights) of the square boxes that album artwork is shrunk to fit, in pixels.
+# Each is made in every format of FORMATS, so that pages can pick the smallest one that looks sharp.
+SIZES = (40, 80, 250, 500)
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}), 'jpg': ('JPEG', {'quality': 85, 'optimize': True})}
+# Thumbnails live under this directory of MEDIA_ROOT, in a directory named after the original
+ROOT = 'thumbs'
+
+
+def thumbnail_directory(name):
+    """
+    Returns the directory of a logo's thumbnails, e.g. "thumbs/sha256/9f/86/9f86d0...15b0".
+    Logos are content-addressed, so albums with identical artwork share their thumbnails too.
+    """
+    return ROOT + '/' + os.path.splitext(name)[0]
+
+
+def thumbnail_name(name, size, extension):
+    return '%s/%d.%s' % (thumbnail_directory(name), size, extension)
+
+
+def save_image(image, path, extension):
+    """
+    Writes the image to a temporary file next to path and renames it into place, so a half-written
+    thumbnail is never served.
+    """
+    image_format, options = FORMATS[extension]
+    fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, image_format, **options)
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def make_thumbnails(path, directory):
+    """
+    Shrinks the image at path to every size and format, writing them into directory (an absolute path).
+    Images smaller than a size are not enlarged. Returns False if the file isn't an image Pillow can read.
+    """
+    try:
+        with Image.open(path) as original:
+            original.load()
+            image = original.convert('RGBA') if original.mode in ('P', 'LA', 'RGBA') else original.convert('RGB')
+    except (OSError, ValueError):
+        return False
+
+    os.makedirs(directory, exist_ok=True)
+    # Shrink from the largest size down, each from the one before, which is much faster than starting from
+    # the original every time and looks the same
+    for size in sorted(SIZES, reverse=True):
+        image.thumbnail((size, size), Image.LANCZOS)
+        flattened = image
+        if image.mode == 'RGBA':
+            # JPEG has no transparency, so put transparent artwork on white
+            flattened = Image.new('RGB', image.size, (255, 255, 255))
+            flattened.paste(image, mask=image.getchannel('A'))
+        for extension in FORMATS:
+            save_image(image if extension == 'webp' else flattened, os.path.join(directory, '%d.%s' % (size, extension)),
+                       extension)
+    return True
@@ -0,0 +1,46 @@
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    Django's ASGI handler, except that streaming responses are iterated on a thread rather than on the event loop.
+    Django 3.0 iterates them on the loop itself, so an export that reads and zips files as it's sent would block
+    every other request on the worker until it finished.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super(StreamingASGIHandler, self).send_response(response, send)
+
+        headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        # Not thread sensitive: the main thread runs sync views, which an export mustn't hold up either
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=False)
+        while True:
+            part = await next_part(parts, None)
+            if part is None:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        response.close()
+
+
+def get_asgi_application():
+    """
+    django.core.asgi.get_asgi_application(), with streaming responses iterated on a thread.
+    """
+    django.setup(set_prefix=False)
+    return StreamingASGIHandler()
@@ -0,0 +1,351 @@
+import os
+import struct
+import wave
+
+# Enough of the start of a file to recognise its type
+HEADER_SIZE = 16
+# How far into an MP3, after any ID3 tag, to look for the first frame
+MP3_SYNC_WINDOW = 64 * 1024
+# How far from the end of an Ogg file to look for its last page
+OGG_TAIL_SIZE = 64 * 1024
+
+AUDIO_TYPES = {'wav', 'mp3', 'ogg'}
+IMAGE_TYPES = {'png', 'jpeg'}
+
+# Bitrates in kbit/s by (MPEG version 1 or 2, layer), where MPEG 2.5 uses the MPEG 2 tables
+MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = [44100, 48000, 32000]
+# MPEG version bits to the divisor of MP3_SAMPLE_RATES (MPEG 1, 2 and 2.5)
+MP3_VERSIONS = {3: 1, 2: 2, 0: 4}
+
+# Tag names used by each format, mapped to the keys stored on Song.tags
+ID3_TAGS = {
+    'TIT2': 'title', 'TPE1': 'artist', 'TALB': 'album', 'TCON': 'genre', 'TRCK': 'track', 'TYER': 'year',
+    'TDRC': 'year', 'TT2': 'title', 'TP1': 'artist', 'TAL': 'album', 'TCO': 'genre', 'TRK': 'track', 'TYE': 'year',
+}
+RIFF_TAGS = {b'INAM': 'title', b'IART': 'artist', b'IPRD': 'album', b'IGNR': 'genre', b'ITRK': 'track', b'ICRD': 'year'}
+VORBIS_TAGS = {
+    'TITLE': 'title', 'ARTIST': 'artist', 'ALBUM': 'album', 'GENRE': 'genre', 'TRACKNUMBER': 'track', 'DATE': 'year',
+}
+
+
+def sniff(header):
+    """
+    Returns the real type of a file ("wav", "mp3", "ogg", "png" or "jpeg") from its first bytes, whatever it's called.
+    Returns None for anything else.
+    """
+    if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        return 'wav'
+    if header[:4] == b'OggS':
+        return 'ogg'
+    if header[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if header[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if header[:3] == b'ID3' or parse_mp3_frame(header) is not None:
+        return 'mp3'
+    return None
+
+
+def sniff_file(f):
+    """
+    Sniffs an open (e.g. uploaded) file, leaving its position where it was.
+    """
+    position = f.tell()
+    f.seek(0)
+    header = f.read(HEADER_SIZE)
+    f.seek(position)
+    return sniff(header)
+
+
+def read_metadata(path):
+    """
+    Returns the duration (seconds), sample rate (Hz), bitrate (bit/s), channels and tags of an audio file,
+    reading only its headers. Raises ValueError if it isn't a WAV, MP3 or Ogg file that can be understood.
+    """
+    with open(path, 'rb') as f:
+        kind = sniff(f.read(HEADER_SIZE))
+        f.seek(0)
+        size = os.fstat(f.fileno()).st_size
+        try:
+            if kind == 'wav':
+                return read_wav(f)
+            if kind == 'mp3':
+                return read_mp3(f, size)
+            if kind == 'ogg':
+                return read_ogg(f, size)
+        except struct.error as e:
+            # A header cut short, by a truncated or corrupt file, is too short to unpack
+            raise ValueError("Truncated %s file: %s" % (kind.upper(), e))
+    raise ValueError("Not a supported audio file.")
+
+
+def metadata(duration, sample_rate, bitrate, channels, tags):
+    # Postgres can't store NUL characters in text or JSONB, and tags often use them as separators or padding
+    tags = {key: value.replace('\x00', ' ').strip() for key, value in tags.items()}
+    return {
+        'duration': duration,
+        'sample_rate': sample_rate,
+        'bitrate': int(bitrate) if bitrate else None,
+        'channels': channels,
+        'tags': {key: value for key, value in tags.items() if value},
+    }
+
+
+def read_wav(f):
+    try:
+        with wave.open(f) as w:
+            channels, sample_width, rate, frames = w.getnchannels(), w.getsampwidth(), w.getframerate(), w.getnframes()
+    except (wave.Error, EOFError) as e:
+        raise ValueError("Unreadable WAV file: %s" % e)
+    if not rate:
+        raise ValueError("Unreadable WAV file: no sample rate.")
+    f.seek(12)
+    return metadata(frames / rate, rate, rate * channels * sample_width * 8, channels, read_riff_info(f))
+
+
+def read_riff_info(f):
+    """
+    Reads the tags in a RIFF file's LIST/INFO chunk, f being positioned at its first chunk.
+    """
+    tags = {}
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return tags
+        chunk_id, size = struct.unpack('<4sI', header)
+        if chunk_id == b'LIST' and f.read(4) == b'INFO':
+            data = f.read(size - 4)
+            offset = 0
+            while offset + 8 <= len(data):
+                tag_id, tag_size = struct.unpack_from('<4sI', data, offset)
+                if tag_id in RIFF_TAGS:
+                    tags[RIFF_TAGS[tag_id]] = decode_text(data[offset + 8:offset + 8 + tag_size])
+                offset += 8 + tag_size + tag_size % 2
+            return tags
+        # Chunks are padded to an even size
+        f.seek(f.tell() + size + size % 2 - (4 if chunk_id == b'LIST' else 0))
+
+
+def decode_text(data, encoding='latin-1'):
+    return data.decode(encoding, 'replace').strip('\x00').strip()
+
+
+def syncsafe(data):
+    """
+    Decodes an ID3v2 "syncsafe" integer, which only uses the low 7 bits of each byte.
+    """
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7f)
+    return value
+
+
+def read_id3v2(f):
+    """
+    Reads the text tags of an ID3v2 tag at the start of the file. Returns the tags and the size of the whole tag.
+    """
+    header = f.read(10)
+    if header[:3] != b'ID3' or len(header) < 10:
+        return {}, 0
+    version, flags = header[3], header[5]
+    size = 10 + syncsafe(header[6:10]) + (10 if flags & 0x10 else 0)
+    data = f.read(size - 10)
+    tags = {}
+    offset = 0
+    frame_header_size = 6 if version == 2 else 10
+    while offset + frame_header_size <= len(data):
+        if version == 2:
+            frame_id = data[offset:offset + 3]
+            frame_size = int.from_bytes(data[offset + 3:offset + 6], 'big')
+        else:
+            frame_id = data[offset:offset + 4]
+            frame_bytes = data[offset + 4:offset + 8]
+            frame_size = syncsafe(frame_bytes) if version == 4 else int.from_bytes(frame_bytes, 'big')
+        if not frame_id.strip(b'\x00') or frame_size <= 0:
+            # Padding
+            break
+        key = ID3_TAGS.get(frame_id.decode('latin-1'))
+        if key:
+            tags.setdefault(key, decode_id3_text(data[offset + frame_header_size:offset + frame_header_size + frame_size]))
+        offset += frame_header_size + frame_size
+    return tags, size
+
+
+def decode_id3_text(data):
+    """
+    Decodes a text frame, whose first byte says how the rest is encoded.
+    """
+    if not data:
+        return ''
+    encoding = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}.get(data[0], 'latin-1')
+    return decode_text(data[1:], encoding).split('\x00')[0]
+
+
+def read_id3v1(f, size):
+    """
+    Reads the fixed-size ID3v1 tag at the end of the file, if there is one.
+    """
+    if size < 128:
+        return {}
+    f.seek(size - 128)
+    data = f.read(128)
+    if data[:3] != b'TAG':
+        return {}
+    return {
+        'title': decode_text(data[3:33]), 'artist': decode_text(data[33:63]),
+        'album': decode_text(data[63:93]), 'year': decode_text(data[93:97]),
+    }
+
+
+def parse_mp3_frame(header):
+    """
+    Parses a 4 byte MPEG audio frame header. Returns a dict of its fields, or None if it isn't a valid header.
+    """
+    if len(header) < 4 or header[0] != 0xff or header[1] & 0xe0 != 0xe0:
+        return None
+    version_bits, layer_bits = (header[1] >> 3) & 3, (header[1] >> 1) & 3
+    bitrate_index, rate_index = header[2] >> 4, (header[2] >> 2) & 3
+    if version_bits not in MP3_VERSIONS or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    divisor = MP3_VERSIONS[version_bits]
+    version = 1 if divisor == 1 else 2
+    layer = 4 - layer_bits
+    bitrate = MP3_BITRATES[(version, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[rate_index] // divisor
+    padding = (header[2] >> 1) & 1
+    if layer == 1:
+        samples, length = 384, (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 576 if layer == 3 and version == 2 else 1152
+        length = samples // 8 * bitrate // sample_rate + padding
+    return {
+        'version': version, 'layer': layer, 'bitrate': bitrate, 'sample_rate': sample_rate,
+        'channels': 1 if header[3] >> 6 == 3 else 2, 'samples': samples, 'length': length,
+    }
+
+
+def find_mp3_frame(data):
+    """
+    Returns the offset and fields of the first frame header that is followed by another one, so that
+    stray 0xFF bytes aren't mistaken for the start of the audio.
+    """
+    offset = data.find(b'\xff')
+    while 0 <= offset < len(data) - 4:
+        frame = parse_mp3_frame(data[offset:offset + 4])
+        if frame is not None:
+            following = data[offset + frame['length']:offset + frame['length'] + 4]
+            if len(following) < 4 or parse_mp3_frame(following) is not None:
+                return offset, frame
+        offset = data.find(b'\xff', offset + 1)
+    raise ValueError("No MP3 frames found.")
+
+
+def read_mp3(f, size):
+    tags, start = read_id3v2(f)
+    id3v1 = read_id3v1(f, size)
+    tags = tags or id3v1
+    end = size - 128 if id3v1 else size
+    f.seek(start)
+    data = f.read(MP3_SYNC_WINDOW)
+    offset, frame = find_mp3_frame(data)
+
+    # A Xing/Info (or VBRI) header in the first frame gives the number of frames of a variable bitrate file
+    frames = None
+    side_info = (32 if frame['channels'] == 2 else 17) if frame['version'] == 1 else (17 if frame['channels'] == 2 else 9)
+    xing = data[offset + 4 + side_info:offset + 4 + side_info + 12]
+    vbri = data[offset + 36:offset + 36 + 18]
+    if xing[:4] in (b'Xing', b'Info') and struct.unpack('>I', xing[4:8])[0] & 1:
+        frames = struct.unpack('>I', xing[8:12])[0]
+    elif vbri[:4] == b'VBRI':
+        frames = struct.unpack('>I', vbri[14:18])[0]
+
+    audio_size = end - start - offset
+    if frames:
+        duration = frames * frame['samples'] / frame['sample_rate']
+        bitrate = audio_size * 8 / duration if duration else None
+    else:
+        duration = audio_size * 8 / frame['bitrate']
+        bitrate = frame['bitrate']
+    return metadata(duration, frame['sample_rate'], bitrate, frame['channels'], tags)
+
+
+def read_ogg_packets(f, count):
+    """
+    Reassembles the first packets of the first logical stream in an Ogg file from its pages.
+    """
+    packets, packet = [], b''
+    while len(packets) < count:
+        header = f.read(27)
+        if len(header) < 27 or header[:4] != b'OggS':
+            raise ValueError("Truncated Ogg file.")
+        lacing = f.read(header[26])
+        data = f.read(sum(lacing))
+        position = 0
+        for segment in lacing:
+            packet += data[position:position + segment]
+            position += segment
+            # A segment shorter than 255 bytes ends the packet
+            if segment < 255:
+                packets.append(packet)
+                packet = b''
+    return packets
+
+
+def read_vorbis_comments(data):
+    """
+    Reads a Vorbis comment block (also used by Opus): a vendor string, then "KEY=value" strings.
+    """
+    tags = {}
+    try:
+        vendor_length, = struct.unpack_from('<I', data, 0)
+        offset = 4 + vendor_length
+        count, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        for _ in range(count):
+            length, = struct.unpack_from('<I', data, offset)
+            key, _, value = data[offset + 4:offset + 4 + length].decode('utf-8', 'replace').partition('=')
+            if key.upper() in VORBIS_TAGS:
+                tags.setdefault(VORBIS_TAGS[key.upper()], value.strip())
+            offset += 4 + length
+    except struct.error:
+        pass
+    return tags
+
+
+def read_ogg(f, size):
+    identification, comments = read_ogg_packets(f, 2)
+    if identification[:7] == b'\x01vorbis':
+        channels, sample_rate, _, nominal_bitrate = struct.unpack_from('<BIiI', identification, 11)
+        tags = read_vorbis_comments(comments[7:]) if comments[:7] == b'\x03vorbis' else {}
+        # Vorbis granule positions count samples
+        granule_rate, skip = sample_rate, 0
+    elif identification[:8] == b'OpusHead':
+        channels, skip, sample_rate = struct.unpack_from('<BHI', identification, 9)
+        nominal_bitrate = None
+        tags = read_vorbis_comments(comments[8:]) if comments[:8] == b'OpusTags' else {}
+        # Opus granule positions are always at 48kHz, whatever the original sample rate was
+        granule_rate = 48000
+        sample_rate = sample_rate or granule_rate
+    else:
+        raise ValueError("Unsupported Ogg codec.")
+    if not granule_rate:
+        raise ValueError("Unreadable Ogg file: no sample rate.")
+
+    # The granule position of the last page is the number of samples in the stream
+    f.seek(max(size - OGG_TAIL_SIZE, 0))
+    tail = f.read()
+    last_page = tail.rfind(b'OggS')
+    if last_page < 0 or last_page + 14 > len(tail):
+        raise ValueError("Truncated Ogg file.")
+    granule, = struct.unpack_from('<q', tail, last_page + 6)
+    duration = max(granule - skip, 0) / granule_rate
+    bitrate = size * 8 / duration if duration else nominal_bitrate
+    return metadata(duration, sample_rate, bitrate, channels, tags)
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+
+USER_KEY = 'auth-user:%s'
+# The session engine and backends that viberr/settings.py uses with a shared cache. Within one process, even a
+# local memory cache is shared, so the query counts of tests and benchmarks are measured with these.
+CACHED_AUTH_SETTINGS = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+    'AUTHENTICATION_BACKENDS': ['music.auth.CachedModelBackend', 'django.contrib.auth.backends.ModelBackend'],
+}
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    Django's own backend, except that the logged in user is read from the cache rather than the database on
+    every request. Saving or deleting a user forgets them (see music/signals.py), so a new password or a
+    deactivated account takes effect on the next request, as it would without the cache.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super(CachedModelBackend, self).authenticate(request, username, password, **kwargs)
+        if user is None:
+            # Stop ModelBackend, which follows for the sessions it logged in, hashing the same password again
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        key = USER_KEY % user_id
+        user = cache.get(key)
+        if user is None:
+            user = super(CachedModelBackend, self).get_user(user_id)
+            if user is not None:
+                cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user
+
+
+def forget_user(user_id):
+    """
+    Drops the user from the cache now, and again once the current transaction commits, in case a request
+    cached the old row in the meantime.
+    """
+    key = USER_KEY % user_id
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
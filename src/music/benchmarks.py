@@ -0,0 +1,244 @@
+import random
+import statistics
+import time
+import wave
+from collections import namedtuple
+from contextlib import ExitStack
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .auth import CACHED_AUTH_SETTINGS
+from .caching import bump_library_version
+from .models import Album, Playlist, PlaylistEntry, Song, Upload
+from .storage import content_storage
+
+WORDS = [
+    'love', 'night', 'dragon', 'moon', 'fire', 'heart', 'dream', 'river', 'light', 'storm', 'gold', 'ghost',
+    'summer', 'echo', 'wild', 'city', 'ocean', 'shadow', 'silver', 'radio', 'sky', 'rose', 'velvet', 'neon',
+    'thunder', 'winter', 'paper', 'glass', 'honey', 'electric', 'midnight', 'desert', 'garden', 'mirror',
+]
+GENRES = ['Rock', 'Pop', 'Jazz', 'Hip Hop', 'Classical', 'Electronic', 'Folk', 'Metal', 'Blues', 'Indie']
+USERNAME = 'benchmark-views-%d'
+BATCH_SIZE = 5000
+
+Size = namedtuple('Size', 'users albums songs')
+
+
+def parse_size(text):
+    """
+    Parses "USERSxALBUMSxSONGS", e.g. "10x100x10" for 10 users with 100 albums of 10 songs each.
+    """
+    try:
+        users, albums, songs = (int(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise ValueError("Expected USERSxALBUMSxSONGS, e.g. 10x100x10, not %r." % text)
+    if min(users, albums, songs) < 1:
+        raise ValueError("Every part of %r must be at least 1." % text)
+    return Size(users, albums, songs)
+
+
+def format_size(size):
+    return '%dx%dx%d' % size
+
+
+def silent_wav():
+    f = BytesIO()
+    with wave.open(f, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(8000)
+        w.writeframes(b'\0' * 160)
+    return f.getvalue()
+
+
+def generate_library(size, seed=0):
+    """
+    Creates size.users users, each with size.albums albums of size.songs songs, the same for the same seed.
+    Songs share one tiny audio file and albums one logo. Returns the users.
+    """
+    rng = random.Random(seed)
+    audio_file = content_storage.save('benchmark.wav', ContentFile(silent_wav()))
+    # A few artists per user, so that album pages have other albums by the same artist to show
+    artists = [' '.join(rng.sample(WORDS, 2)).title() for _ in range(max(size.albums // 5, 1))]
+    users = User.objects.bulk_create(User(username=USERNAME % i) for i in range(size.users))
+
+    for user in users:
+        albums = Album.objects.bulk_create((
+            Album(user=user, artist=rng.choice(artists), title=' '.join(rng.sample(WORDS, 2)).title(),
+                  genre=rng.choice(GENRES), logo='benchmark.png', is_favourite=rng.random() < 0.2)
+            for _ in range(size.albums)), batch_size=BATCH_SIZE)
+        batch = []
+        for album in albums:
+            for _ in range(size.songs):
+                batch.append(Song(album=album, title=' '.join(rng.sample(WORDS, 3)).title(), audio_file=audio_file,
+                                  is_favourite=rng.random() < 0.1))
+                if len(batch) == BATCH_SIZE:
+                    Song.objects.bulk_create(batch)
+                    batch = []
+        if batch:
+            Song.objects.bulk_create(batch)
+    return users
+
+
+def delete_library(users):
+    """
+    Deletes the generated users and their libraries with plain SQL, avoiding a post_delete signal for every row.
+    """
+    user_ids = [user.pk for user in users]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM %s WHERE playlist_id IN (SELECT id FROM %s WHERE user_id = ANY(%%s))"
+            % (PlaylistEntry._meta.db_table, Playlist._meta.db_table), [user_ids])
+        cursor.execute("DELETE FROM %s WHERE user_id = ANY(%%s)" % Playlist._meta.db_table, [user_ids])
+        cursor.execute(
+            "DELETE FROM %s WHERE album_id IN (SELECT id FROM %s WHERE user_id = ANY(%%s))"
+            % (Song._meta.db_table, Album._meta.db_table), [user_ids])
+        cursor.execute("DELETE FROM %s WHERE user_id = ANY(%%s)" % Upload._meta.db_table, [user_ids])
+        cursor.execute("DELETE FROM %s WHERE user_id = ANY(%%s)" % Album._meta.db_table, [user_ids])
+    User.objects.filter(pk__in=user_ids).delete()
+
+
+# A page to request: its URL name, how to build its URL's arguments from the fixtures, the HTTP method, the form
+# data to send and the most queries it may take, whatever the size of the library. A page whose queries grow with
+# the library runs a query per row somewhere.
+Route = namedtuple('Route', 'name kwargs method data max_queries')
+
+# Sessions are read from the cache, as they are with a shared cache, but every page a user is logged in to reads
+# the user once after they log in, as each measurement does. Atomic blocks add two queries for their savepoint
+# when run inside a test case.
+ROUTES = [
+    Route('index', lambda f: {}, 'get', None, 4),
+    Route('login', lambda f: {}, 'get', None, 3),
+    Route('register', lambda f: {}, 'get', None, 3),
+    Route('favourite-many', lambda f: {}, 'post',
+          lambda f: {'type': 'song', 'is_favourite': 'true', 'id': f['song_ids']}, 5),
+    Route('library-export', lambda f: {}, 'get', None, 3),
+    # Staff only, so redirects to the admin's login page
+    Route('profiles', lambda f: {}, 'get', None, 3),
+    Route('profile-download', lambda f: {'filename': '20200101T000000000000-00000000.prof'}, 'get', None, 3),
+    Route('queue', lambda f: {}, 'get', None, 2),
+    Route('playlists', lambda f: {}, 'get', None, 2),
+    Route('playlist', lambda f: {'playlist_id': f['playlist'].pk}, 'get', None, 3),
+    Route('playlist-add', lambda f: {'playlist_id': f['playlist'].pk}, 'post', lambda f: {'id': [f['song'].pk]}, 8),
+    Route('playlist-move', lambda f: {'entry_id': f['entry'].pk}, 'post', lambda f: {'after': ''}, 7),
+    Route('playlist-remove', lambda f: {'entry_id': f['spare_entry']().pk}, 'post', None, 3),
+    Route('service-worker', lambda f: {}, 'get', None, 1),
+    Route('offline-sync', lambda f: {}, 'post', lambda f: {'url': [f['song'].get_stream_url()]}, 3),
+    Route('detail', lambda f: {'pk': f['album'].pk}, 'get', None, 5),
+    Route('album-add', lambda f: {}, 'get', None, 2),
+    Route('album-update', lambda f: {'pk': f['album'].pk}, 'get', None, 3),
+    Route('album-delete', lambda f: {'pk': f['spare_album']().pk}, 'post', None, 10),
+    Route('album-favourite', lambda f: {'album_id': f['album'].pk}, 'post', None, 7),
+    Route('album-export', lambda f: {'album_id': f['album'].pk}, 'get', None, 4),
+    Route('favourite-song', lambda f: {'song_id': f['song'].pk}, 'post', None, 7),
+    Route('song-stream', lambda f: {'song_id': f['song'].pk}, 'get', None, 3),
+    Route('album-search', lambda f: {}, 'get', lambda f: {'q': 'love'}, 4),
+    Route('song-add', lambda f: {'album_id': f['album'].pk}, 'get', None, 2),
+    Route('upload-start', lambda f: {'album_id': f['album'].pk}, 'post',
+          lambda f: {'title': "Song", 'filename': "song.mp3", 'size': 100}, 4),
+    Route('upload-chunk', lambda f: {'upload_id': f['upload'].pk}, 'get', None, 3),
+    Route('upload-finish', lambda f: {'upload_id': f['upload'].pk}, 'post', None, 3),
+    Route('song-update', lambda f: {'album_id': f['album'].pk, 'pk': f['song'].pk}, 'get', None, 3),
+    Route('song-delete', lambda f: {'pk': f['spare_song']().pk}, 'post', None, 7),
+    Route('songs', lambda f: {}, 'get', None, 4),
+    Route('user-edit', lambda f: {'pk': f['user'].pk}, 'get', None, 3),
+    Route('logout', lambda f: {}, 'get', None, 4),
+]
+
+
+def fixtures(user):
+    """
+    The objects the routes' URLs refer to: the user's first album, its first song, an unfinished upload and a
+    playlist with that song, and functions that make a new album, song or playlist entry to delete.
+    Deleting an album sends post_delete for each of its songs, so spare albums have as many songs as the first
+    album, for a per-song query to show up as a difference between library sizes.
+    """
+    album = Album.objects.owned_by(user).order_by('pk').first()
+    songs = list(Song.objects.filter(album=album).order_by('pk'))
+    upload, _ = Upload.objects.get_or_create(user=user, album=album, title="Song", filename="song.mp3", size=100)
+    playlist, _ = Playlist.objects.get_or_create(user=user, name="Playlist")
+    entry = playlist.entries.first() or playlist.append([songs[0]])[0]
+
+    def spare_album():
+        # Bulk created, so that no signals make thumbnails or read metadata
+        spare = Album.objects.bulk_create([Album(user=user, artist="Spare", title="Spare", genre="", logo='x.png')])[0]
+        Song.objects.bulk_create([Song(album=spare, title="Spare") for _ in songs])
+        return spare
+
+    def spare_song():
+        return Song.objects.bulk_create([Song(album=album, title="Spare")])[0]
+
+    def spare_entry():
+        return playlist.append([songs[0]])[0]
+
+    return {'user': user, 'album': album, 'song': songs[0], 'song_ids': [song.pk for song in songs],
+            'upload': upload, 'playlist': playlist, 'entry': entry, 'spare_album': spare_album,
+            'spare_song': spare_song, 'spare_entry': spare_entry}
+
+
+def measure(client, user, route, fixture, repeat):
+    """
+    Requests the route repeat times with nothing cached, and returns its status, its most queries, its median
+    and fastest wall time in milliseconds, and the size of its response in bytes.
+    """
+    data = route.data(fixture) if route.data else None
+    timings, queries = [], 0
+    for _ in range(repeat):
+        url = reverse('music:' + route.name, kwargs=route.kwargs(fixture))
+        # Start from a cold cache, as the first view after a change would
+        bump_library_version(user.pk)
+        client.force_login(user)
+        # Every database, in case reads go to a replica
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(db)) for db in connections.all()]
+            start = time.perf_counter()
+            response = getattr(client, route.method)(url, data)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            timings.append((time.perf_counter() - start) * 1000)
+        queries = max(queries, sum(len(context) for context in captured))
+    return {
+        'status': response.status_code,
+        'queries': queries,
+        'ms': round(statistics.median(timings), 3),
+        'ms_min': round(min(timings), 3),
+        'bytes': len(content),
+    }
+
+
+@override_settings(**CACHED_AUTH_SETTINGS)
+def run_benchmarks(sizes, repeat=3, seed=0, routes=ROUTES, progress=None):
+    """
+    Generates a library of each size in turn, measures every route against it, and deletes it again.
+    Sessions and users are cached as they are in production, whatever cache this process has.
+    Returns the results, one per route and size, and the failures: routes over their query ceiling, or whose
+    query count changed with the size of the library.
+    """
+    results, failures, counts = [], [], {}
+    for size in sizes:
+        users = generate_library(size, seed)
+        try:
+            user = users[0]
+            fixture = fixtures(user)
+            client = Client()
+            for route in routes:
+                result = dict(measure(client, user, route, fixture, repeat), route=route.name,
+                              size=format_size(size), max_queries=route.max_queries)
+                results.append(result)
+                if progress:
+                    progress(result)
+                if result['queries'] > route.max_queries:
+                    failures.append("%s at %s: %d queries, at most %d expected." % (
+                        route.name, result['size'], result['queries'], route.max_queries))
+                previous = counts.setdefault(route.name, (result['size'], result['queries']))
+                if previous[1] != result['queries']:
+                    failures.append("%s: %d queries at %s but %d at %s." % (
+                        route.name, previous[1], previous[0], result['queries'], result['size']))
+        finally:
+            delete_library(users)
+    return results, failures
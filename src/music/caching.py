@@ -0,0 +1,129 @@
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .routers import pin_to_primary
+
+# Cache keys. The version of a user's library changes whenever anything shown on their pages does,
+# which leaves every fragment rendered from the old version to expire unused.
+VERSION_KEY = 'library-version:%s'
+FRAGMENT_KEY = 'library-fragment:%s'
+HITS_KEY = 'library-cache:hits'
+MISSES_KEY = 'library-cache:misses'
+
+
+def library_version(user_id):
+    """
+    Returns the current version of the user's library, starting a new one if the cache doesn't have it.
+    """
+    key = VERSION_KEY % user_id
+    version = cache.get(key)
+    if version is None:
+        # Another request may be starting one at the same time, in which case theirs is used
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_library_version(*user_ids):
+    """
+    Marks every fragment cached for these users as out of date.
+    A random version, rather than a counter, can't collide with fragments of an evicted earlier version.
+    """
+    cache.set_many({VERSION_KEY % user_id: uuid.uuid4().hex for user_id in user_ids if user_id is not None}, None)
+
+
+def library_changed(user_ids):
+    """
+    Bumps the users' library versions once the current transaction commits, so that a page rendered from
+    the old data in the meantime can't be cached under the new version. Their pages are read from the primary
+    until the replica has the change too.
+    """
+    user_ids = set(user_ids)
+
+    def changed():
+        pin_to_primary(user_ids)
+        bump_library_version(*user_ids)
+    transaction.on_commit(changed)
+
+
+def fragment_key(request, name, *vary_on):
+    """
+    Builds the key of a fragment of a page for the user's current library. The key varies on the URL,
+    including its query string, and the session, whose CSRF token is rendered into the fragment's forms.
+    """
+    parts = [name, request.user.pk, library_version(request.user.pk), request.session.session_key,
+             request.get_full_path()] + list(vary_on)
+    return FRAGMENT_KEY % hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # incr() doesn't create missing keys
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_or_render(request, name, render, vary_on=()):
+    """
+    Returns the cached fragment, or calls render() and caches what it returns.
+    """
+    key = fragment_key(request, name, *vary_on)
+    html = cache.get(key)
+    if html is None:
+        count(MISSES_KEY)
+        html = render()
+        cache.set(key, html, settings.LIBRARY_CACHE_TIMEOUT)
+    else:
+        count(HITS_KEY)
+    return html
+
+
+def cache_stats():
+    """
+    Returns the number of fragment cache hits and misses since the counters were last reset.
+    """
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    return counters.get(HITS_KEY, 0), counters.get(MISSES_KEY, 0)
+
+
+def reset_cache_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def library_etag(request, *args, **kwargs):
+    """
+    Builds a page's ETag from the user's library version, without running any of the page's queries.
+    The session is part of it too, as the page's forms carry a CSRF token that is rotated whenever the session is,
+    on login. The CSRF cookie itself is left out, since it's first set by the page's own response.
+    Anonymous users get no ETag, so they are redirected to log in as usual.
+    """
+    if not request.user.is_authenticated:
+        return None
+    parts = [request.user.pk, library_version(request.user.pk), request.session.session_key, request.get_full_path()]
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def library_condition(view):
+    """
+    Answers conditional GETs of a page that only shows the user's library with 304 Not Modified, until the
+    library changes. Browsers are told to check with the server every time rather than reuse the page blindly.
+    """
+    conditional_view = condition(etag_func=library_etag)(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        if response.has_header('ETag'):
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ['Cookie'])
+        return response
+    return wrapper
@@ -0,0 +1,39 @@
+import os
+
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from django.template import engines
+
+from .staticfiles import unhashed_assets
+
+
+def project_templates():
+    """
+    Yields the paths of the project's own templates, leaving out those of installed packages.
+    """
+    for engine in engines.all():
+        for directory in engine.template_dirs:
+            if not os.path.abspath(directory).startswith(os.path.abspath(settings.BASE_DIR) + os.sep):
+                continue
+            for root, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    if filename.endswith('.html'):
+                        yield os.path.join(root, filename)
+
+
+@register(Tags.templates)
+def check_static_references(app_configs, **kwargs):
+    """
+    Static files are only cacheable under their hashed names, which {% static %} looks up. A template that
+    links to a plain name would get a file that browsers must keep checking, or none at all.
+    """
+    errors = []
+    for path in project_templates():
+        with open(path, encoding='utf-8') as f:
+            for asset in unhashed_assets(f.read()):
+                errors.append(Error(
+                    "%s refers to %s without {%% static %%}." % (os.path.relpath(path, settings.BASE_DIR), asset),
+                    hint="Use {% static '...' %} so that the hashed name is used.",
+                    id='music.E001',
+                ))
+    return errors
@@ -0,0 +1,124 @@
+import csv
+import io
+import os
+import time
+import zipfile
+
+from django.utils.text import get_valid_filename
+
+from .streaming import CHUNK_SIZE
+
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_HEADER = ['file', 'artist', 'album', 'genre', 'album favourite', 'title', 'favourite', 'duration']
+# Audio is already compressed, so it's stored as it is. Deflating it would only cost CPU.
+STORED_EXTENSIONS = {'.mp3', '.ogg', '.wav'}
+
+
+class StreamBuffer(object):
+    """
+    A write-only file for ZipFile, whose contents are taken out bit by bit as the archive is built.
+    Having no seek() makes ZipFile write sizes after each member's data rather than going back to fill them in.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def archive_name(artist, album, title, extension, used):
+    """
+    Returns a unique path within the archive for a song, e.g. "Artist - Album/Title.mp3".
+    """
+    directory = get_valid_filename('%s - %s' % (artist, album)) or 'album'
+    base = '%s/%s' % (directory, get_valid_filename(title) or 'song')
+    name, count = base + extension, 1
+    while name in used:
+        count += 1
+        name = '%s (%d)%s' % (base, count, extension)
+    used.add(name)
+    return name
+
+
+def library_entries(rows, storage):
+    """
+    Turns rows of (artist, album, genre, album favourite, title, favourite, duration, file name) into the manifest
+    rows and the (archive name, path) of every file that's present.
+    """
+    used, manifest, files = set(), [], []
+    for artist, album, genre, album_favourite, title, favourite, duration, name in rows:
+        path = storage.path(name) if name else None
+        if path and os.path.exists(path):
+            arcname = archive_name(artist, album, title, os.path.splitext(name)[1].lower(), used)
+            files.append((arcname, path))
+        else:
+            arcname = ''
+        manifest.append([arcname, artist, album, genre, album_favourite, title, favourite, duration or ''])
+    return manifest, files
+
+
+def write_member(archive, buffer, arcname, chunks, size=None):
+    """
+    Writes one member into the archive from an iterable of bytes, yielding the archive's bytes as they're made.
+    """
+    info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+    stored = os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS
+    info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+    # Members over 2 GiB need ZIP64 sizes, which have to be reserved before the data
+    with archive.open(info, 'w', force_zip64=size is None or size > zipfile.ZIP64_LIMIT) as f:
+        for chunk in chunks:
+            f.write(chunk)
+            data = buffer.take()
+            if data:
+                yield data
+    yield buffer.take()
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            yield chunk
+
+
+def manifest_lines(manifest):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    for row in [MANIFEST_HEADER] + manifest:
+        writer.writerow(row)
+        yield text.getvalue().encode()
+        text.seek(0)
+        text.truncate()
+
+
+def zip_library(manifest, files):
+    """
+    Yields a ZIP of the manifest and the files, a chunk at a time, without ever holding more than a chunk of any
+    file in memory or writing the archive anywhere. Reading and compressing block, so under ASGI the generator is
+    run on a thread (see asgi.StreamingASGIHandler).
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as archive:
+        yield from write_member(archive, buffer, MANIFEST_NAME, manifest_lines(manifest))
+        for arcname, path in files:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            yield from write_member(archive, buffer, arcname, read_file(path), size)
+    # The central directory, written on close
+    yield buffer.take()
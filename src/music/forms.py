@@ -1,6 +1,9 @@
 from django.contrib.auth.models import User
 from django import forms
 
+from .audio import AUDIO_TYPES, IMAGE_TYPES, sniff_file
+from .models import Album, Song
+
 
 class UserForm(forms.ModelForm):
 
@@ -15,4 +18,47 @@ class LogInForm(forms.ModelForm):
 
     class Meta:
         model = User
-        fields = ['username', 'password']
\ No newline at end of file
+        fields = ['username', 'password']
+
+
+class AlbumForm(forms.ModelForm):
+    """
+    An album of the given user, whose logo must really be an image.
+    """
+
+    class Meta:
+        model = Album
+        fields = ['artist', 'title', 'genre', 'logo']
+
+    def __init__(self, *args, user=None, **kwargs):
+        super(AlbumForm, self).__init__(*args, **kwargs)
+        if user is not None:
+            self.instance.user = user
+
+    def clean_logo(self):
+        logo = self.cleaned_data['logo']
+        if logo and logo != self.initial.get('logo') and sniff_file(logo) not in IMAGE_TYPES:
+            raise forms.ValidationError("Invalid file type. Please try again.")
+        return logo
+
+
+class SongForm(forms.ModelForm):
+    """
+    A song on one of the given user's albums, whose file must really be audio.
+    """
+
+    class Meta:
+        model = Song
+        fields = ['album', 'title', 'audio_file']
+
+    def __init__(self, *args, user=None, **kwargs):
+        super(SongForm, self).__init__(*args, **kwargs)
+        self.fields['audio_file'].required = True
+        if user is not None:
+            self.fields['album'].queryset = Album.objects.owned_by(user)
+
+    def clean_audio_file(self):
+        audio_file = self.cleaned_data['audio_file']
+        if audio_file and audio_file != self.initial.get('audio_file') and sniff_file(audio_file) not in AUDIO_TYPES:
+            raise forms.ValidationError("Invalid file type. Please try again.")
+        return audio_file
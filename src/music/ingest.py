@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+from .artwork import make_thumbnails, thumbnail_directory
+from .audio import AUDIO_TYPES, HEADER_SIZE, IMAGE_TYPES, read_metadata, sniff
+from .models import Album, Song
+from .storage import store_file
+
+logger = logging.getLogger(__name__)
+
+# Started on first use, so that only processes which ingest files pay for the workers.
+# Under ASGI, views run on a thread pool, so two requests could try to start it at once.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=settings.INGEST_WORKERS)
+    return _executor
+
+
+def run_in_background(function, args, save):
+    """
+    Calls function(*args) in a worker process, then save() with its result, without waiting for either.
+    function must be picklable, i.e. defined at the top level of a module. With INGEST_WORKERS set to 0,
+    both are called straight away instead.
+    """
+    if not settings.INGEST_WORKERS:
+        save(function(*args))
+        return
+
+    def done(future):
+        # Runs on the executor's own thread, which must not keep a database connection open
+        try:
+            save(future.result())
+        except Exception:
+            logger.exception("Couldn't save the result of %s%r", function.__name__, args)
+        finally:
+            connection.close()
+
+    get_executor().submit(function, *args).add_done_callback(done)
+
+
+def safe_read_metadata(path):
+    """
+    read_metadata() for the worker processes, returning None rather than raising for files that can't be read.
+    """
+    try:
+        return read_metadata(path)
+    except (OSError, ValueError) as e:
+        logger.warning("Couldn't read the metadata of %s: %s", path, e)
+        return None
+
+
+def save_metadata(song_id, name, metadata):
+    """
+    Stores a song's audio metadata, unless its file has been replaced since the metadata was read.
+    Songs whose files can't be read are given empty metadata, rather than keeping that of a previous file.
+    """
+    metadata = metadata or {'duration': None, 'sample_rate': None, 'bitrate': None, 'channels': None, 'tags': {}}
+    return Song.objects.filter(pk=song_id, audio_file=name).update(**metadata)
+
+
+def extract_metadata(song):
+    """
+    Reads the song's audio metadata in a worker process and stores it once it's done.
+    """
+    song_id, name = song.pk, song.audio_file.name
+    run_in_background(safe_read_metadata, [song.audio_file.path],
+                      lambda metadata: save_metadata(song_id, name, metadata))
+
+
+def thumbnail_paths(name):
+    """
+    Returns the absolute paths of a logo and of its thumbnail directory, as make_thumbnails() takes them.
+    """
+    storage = Album.logo.field.storage
+    return storage.path(name), os.path.join(settings.MEDIA_ROOT, *thumbnail_directory(name).split('/'))
+
+
+def save_thumbnails(name, made):
+    """
+    Marks every album with this logo as having thumbnails, or not if the logo couldn't be read.
+    """
+    return Album.objects.filter(logo=name).update(has_thumbnails=made)
+
+
+def generate_thumbnails(album):
+    """
+    Makes the thumbnails of the album's logo in a worker process, and marks the album once they're ready.
+    """
+    name = album.logo.name
+    run_in_background(make_thumbnails, thumbnail_paths(name), lambda made: save_thumbnails(name, made))
+
+
+def import_file(path):
+    """
+    Copies a file found by "manage.py import_library" into storage and, if it's audio, reads its metadata.
+    Returns its type (see audio.sniff()), its name in storage and its metadata, or Nones if it's neither audio
+    nor an image, or can't be read or copied. Errors are logged rather than raised, so that one bad file doesn't
+    stop an import.
+    """
+    try:
+        with open(path, 'rb') as f:
+            kind = sniff(f.read(HEADER_SIZE))
+        if kind not in AUDIO_TYPES | IMAGE_TYPES:
+            return None, None, None
+        name = store_file(path)
+    except OSError as e:
+        logger.warning("Couldn't import %s: %s", path, e)
+        return None, None, None
+    except Exception:
+        logger.exception("Couldn't import %s", path)
+        return None, None, None
+    # Like an upload, audio whose headers or tags can't be parsed is still imported, with empty metadata
+    return kind, name, safe_read_metadata(path) if kind in AUDIO_TYPES else None
@@ -0,0 +1,129 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from music.benchmarks import GENRES, WORDS
+from music.models import Album, Song
+from music.search import search
+
+USERNAME = 'benchmark-search'
+
+
+def typo(word, rng):
+    """
+    Swaps two neighbouring letters, the kind of mistake trigram matching is there to forgive.
+    """
+    i = rng.randrange(len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def timed(function, queries):
+    """
+    Returns the sorted wall times, in milliseconds, of calling the function with each query.
+    """
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        function(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)
+
+
+class Command(BaseCommand):
+    help = "Compares search latency of the full text/trigram search with the original LIKE queries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=1000000, help="Number of songs to generate.")
+        parser.add_argument('--songs-per-album', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=20, help="Number of different search terms to time.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help="Keep the generated library for the next run.")
+        parser.add_argument('--skip-legacy-songs', action='store_true',
+                            help="Skip the original song search, which runs one query per album.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        user, created = User.objects.get_or_create(username=USERNAME)
+        if created or not Album.objects.filter(user=user).exists():
+            self.generate(user, rng, options['songs'], options['songs_per_album'])
+        else:
+            self.stdout.write("Reusing the existing benchmark library.")
+
+        terms = [rng.choice(WORDS) for _ in range(options['queries'])]
+        queries = terms + [typo(term, rng) for term in terms]
+        results = [
+            ('albums', 'legacy', lambda query: list(self.legacy_search_albums(user, query))),
+            ('albums', 'search', lambda query: list(search(Album.objects.owned_by(user), query).order_by('-rank', 'id'))),
+            ('songs', 'search', lambda query: list(
+                search(Song.objects.owned_by(user).select_related('album'), query).order_by('-rank', 'id')[:50]
+            )),
+        ]
+        if not options['skip_legacy_songs']:
+            results.insert(2, ('songs', 'legacy', lambda query: list(self.legacy_search_songs(user, query))))
+
+        self.stdout.write("%-8s %-8s %10s %10s" % ('table', 'engine', 'median ms', 'p95 ms'))
+        for table, engine, function in results:
+            timings = timed(function, queries)
+            self.stdout.write("%-8s %-8s %10.1f %10.1f" % (
+                table, engine, statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+            ))
+
+        if not options['keep']:
+            self.delete(user)
+
+    def generate(self, user, rng, song_total, songs_per_album):
+        """
+        Creates a deterministic library of albums and songs for the benchmark user.
+        """
+        album_total = max(song_total // songs_per_album, 1)
+        self.stdout.write("Generating %d albums and %d songs..." % (album_total, song_total))
+        albums = Album.objects.bulk_create(
+            Album(
+                user=user,
+                title=' '.join(rng.sample(WORDS, 2)).title(),
+                artist=' '.join(rng.sample(WORDS, 2)).title(),
+                genre=rng.choice(GENRES),
+                logo='benchmark.png',
+            )
+            for _ in range(album_total)
+        )
+        batch = []
+        for i in range(song_total):
+            batch.append(Song(album=albums[i % album_total], title=' '.join(rng.sample(WORDS, 3)).title()))
+            if len(batch) == 5000:
+                Song.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Song.objects.bulk_create(batch)
+
+    def legacy_search_albums(self, user, query):
+        """
+        search_albums() before full text search.
+        """
+        return Album.objects.filter(user=user).filter(title__contains=query)
+
+    def legacy_search_songs(self, user, query):
+        """
+        SongView.get_queryset() before full text search.
+        """
+        song_ids = []
+        for album in Album.objects.filter(user=user):
+            for song in album.song_set.all():
+                song_ids.append(song.pk)
+        return Song.objects.filter(pk__in=song_ids).filter(title__icontains=query).order_by('-is_favourite', 'id')
+
+    def delete(self, user):
+        """
+        Deletes the generated library with plain SQL, avoiding a post_delete signal for every song.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM %s WHERE album_id IN (SELECT id FROM %s WHERE user_id = %%s)"
+                % (Song._meta.db_table, Album._meta.db_table),
+                [user.pk]
+            )
+        user.delete()
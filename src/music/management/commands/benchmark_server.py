@@ -0,0 +1,143 @@
+import asyncio
+import statistics
+import time
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+USERNAME = 'benchmark-server'
+
+
+def login(user):
+    """
+    Starts a session for the user, as logging in would.
+    """
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return session
+
+
+def request_lines(host, path, cookie):
+    return [
+        'GET %s HTTP/1.1' % path,
+        'Host: %s' % host,
+        'Cookie: %s' % cookie,
+        'Connection: close',
+    ]
+
+
+async def slow_client(host, port, path, cookie, interval, deadline):
+    """
+    Sends a request one header line at a time, interval seconds apart, like a client on a very poor connection,
+    then starts again until the deadline.
+    """
+    while time.perf_counter() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            await asyncio.sleep(interval)
+            continue
+        try:
+            lines = request_lines(host, path, cookie) + ['X-Padding-%d: x' % i for i in range(1000)]
+            for line in lines:
+                if time.perf_counter() >= deadline:
+                    break
+                writer.write((line + '\r\n').encode())
+                await writer.drain()
+                await asyncio.sleep(interval)
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+
+async def fast_client(host, port, path, cookie, deadline, timings, errors):
+    """
+    Sends whole requests back to back until the deadline, recording how long each response took.
+    """
+    request = ('\r\n'.join(request_lines(host, path, cookie)) + '\r\n\r\n').encode()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            await writer.drain()
+            status = await asyncio.wait_for(reader.readline(), max(deadline - start, 0.1))
+            await asyncio.wait_for(reader.read(), max(deadline - time.perf_counter(), 0.1))
+            writer.close()
+        except (OSError, asyncio.TimeoutError):
+            errors.append(path)
+            continue
+        if status.split()[1:2] not in ([b'200'], [b'304']):
+            errors.append(path)
+            continue
+        timings.append((time.perf_counter() - start) * 1000)
+
+
+async def run(host, port, paths, cookie, options):
+    deadline = time.perf_counter() + options['duration']
+    timings, errors = [], []
+    clients = [
+        slow_client(host, port, paths[i % len(paths)], cookie, options['slow_interval'], deadline)
+        for i in range(options['slow_clients'])
+    ]
+    # Let the slow clients take their connections before measuring
+    tasks = [asyncio.ensure_future(client) for client in clients]
+    await asyncio.sleep(min(1, options['duration'] / 10))
+    tasks += [
+        asyncio.ensure_future(fast_client(host, port, paths[i % len(paths)], cookie, deadline, timings, errors))
+        for i in range(options['clients'])
+    ]
+    await asyncio.gather(*tasks)
+    return sorted(timings), errors
+
+
+class Command(BaseCommand):
+    help = ("Measures the throughput of a running server while many slow clients are connected to it. "
+            "Run it once against each SERVER_MODE to compare them. Point it at gunicorn directly, as nginx "
+            "buffers slow clients itself.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help="Where the server is listening.")
+        parser.add_argument('--path', action='append', dest='paths',
+                            help="Page to request, can be repeated. Defaults to the album index and songs pages.")
+        parser.add_argument('--clients', type=int, default=10, help="Number of clients sending whole requests.")
+        parser.add_argument('--slow-clients', type=int, default=50, help="Number of clients trickling requests.")
+        parser.add_argument('--slow-interval', type=float, default=1.0,
+                            help="Seconds between each header line of a slow client.")
+        parser.add_argument('--duration', type=float, default=30.0, help="Seconds to run for.")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError("Only http:// URLs are supported.")
+        paths = options['paths'] or ['/music/', '/music/songs']
+
+        user, _ = User.objects.get_or_create(username=USERNAME)
+        session = login(user)
+        cookie = '%s=%s' % (settings.SESSION_COOKIE_NAME, session.session_key)
+        try:
+            loop = asyncio.new_event_loop()
+            timings, errors = loop.run_until_complete(run(url.hostname, url.port or 80, paths, cookie, options))
+            loop.close()
+        finally:
+            session.delete()
+            user.delete()
+
+        self.stdout.write("%d slow client(s), %d client(s), %.0fs" % (
+            options['slow_clients'], options['clients'], options['duration']))
+        if not timings:
+            self.stdout.write(self.style.ERROR("No requests completed, %d failed." % len(errors)))
+            return
+        self.stdout.write("%10s %10s %10s %10s" % ('req/s', 'median ms', 'p95 ms', 'errors'))
+        self.stdout.write("%10.1f %10.1f %10.1f %10d" % (
+            len(timings) / options['duration'], statistics.median(timings),
+            timings[max(int(len(timings) * 0.95) - 1, 0)], len(errors),
+        ))
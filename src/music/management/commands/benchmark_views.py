@@ -0,0 +1,68 @@
+import json
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from music.benchmarks import ROUTES, format_size, parse_size, run_benchmarks
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Requests every page against generated libraries of several sizes, recording each page's queries, time "
+            "and response size. Fails if a page takes more queries than its ceiling in music/benchmarks.py, or if "
+            "its queries change with the size of the library. Write the results to a file to compare commits.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', action='append', dest='sizes', metavar='USERSxALBUMSxSONGS',
+                            help="Library size to generate, can be repeated. Defaults to 1x10x10, 10x100x10 and "
+                                 "100x100x100 (a million songs).")
+        parser.add_argument('--repeat', type=int, default=3, help="Number of times to request each page.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--skip', action='append', default=[], metavar='ROUTE',
+                            help="URL name of a page not to request, e.g. library-export, can be repeated.")
+        parser.add_argument('--output', help="File to write the results to, as JSON.")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [parse_size(size) for size in options['sizes'] or ['1x10x10', '10x100x10', '100x100x100']]
+        except ValueError as e:
+            raise CommandError(e)
+        routes = [route for route in ROUTES if route.name not in options['skip']]
+
+        self.stdout.write("%-16s %-12s %6s %8s %10s %10s %10s" % (
+            'route', 'size', 'status', 'queries', 'median ms', 'min ms', 'bytes'))
+
+        def progress(result):
+            self.stdout.write("%-16s %-12s %6d %8s %10.1f %10.1f %10d" % (
+                result['route'], result['size'], result['status'],
+                '%d/%d' % (result['queries'], result['max_queries']), result['ms'], result['ms_min'], result['bytes']))
+
+        # The test client's requests come from "testserver"
+        with override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+            results, failures = run_benchmarks(sorted(sizes), options['repeat'], options['seed'], routes, progress)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'commit': current_commit(),
+                    'sizes': [format_size(size) for size in sorted(sizes)],
+                    'repeat': options['repeat'],
+                    'seed': options['seed'],
+                    'results': results,
+                    'failures': failures,
+                }, f, indent=2)
+            self.stdout.write("Wrote %s." % options['output'])
+
+        if failures:
+            for failure in failures:
+                self.stderr.write(failure)
+            raise CommandError("%d page(s) failed their query checks." % len(failures))
+        self.stdout.write(self.style.SUCCESS("Every page kept to its queries."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from music.caching import cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Reports how often library pages have been rendered from the cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Start counting again afterwards.")
+
+    def handle(self, *args, **options):
+        hits, misses = cache_stats()
+        total = hits + misses
+        self.stdout.write("Hits: %d, misses: %d, hit rate: %.1f%%" % (hits, misses, 100.0 * hits / total if total else 0))
+        if options['reset']:
+            reset_cache_stats()
+            self.stdout.write(self.style.SUCCESS("Reset the counters."))
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from music.models import Upload
+from music.uploads import discard_upload
+
+
+class Command(BaseCommand):
+    help = "Deletes chunked uploads that were started but never finished, along with their partial files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help="Age after which an unfinished upload is abandoned.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        uploads = Upload.objects.filter(created__lt=cutoff)
+        count = 0
+        for upload in uploads.iterator():
+            discard_upload(upload)
+            count += 1
+        self.stdout.write(self.style.SUCCESS("Deleted %d abandoned upload(s)." % count))
@@ -0,0 +1,29 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from music.ingest import safe_read_metadata, save_metadata
+from music.models import Song
+
+
+class Command(BaseCommand):
+    help = "Reads the duration, sample rate, bitrate, channels and tags of songs that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Number of files to read at once.")
+        parser.add_argument('--all', action='store_true', help="Read every song again, not just those without metadata.")
+
+    def handle(self, *args, **options):
+        songs = Song.objects.exclude(audio_file='')
+        if not options['all']:
+            songs = songs.filter(duration__isnull=True)
+        songs = list(songs.order_by('pk').values_list('pk', 'audio_file'))
+        paths = [Song.audio_file.field.storage.path(name) for _, name in songs]
+
+        read = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            # Files are read by the workers, the database is only touched from this process
+            for (song_id, name), metadata in zip(songs, executor.map(safe_read_metadata, paths, chunksize=16)):
+                save_metadata(song_id, name, metadata)
+                read += metadata is not None
+        self.stdout.write(self.style.SUCCESS("Read the metadata of %d of %d song(s)." % (read, len(songs))))
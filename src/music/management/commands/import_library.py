@@ -0,0 +1,164 @@
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from music.audio import AUDIO_TYPES, IMAGE_TYPES
+from music.ingest import import_file
+from music.models import Album, Song
+from music.storage import keep_files
+
+# Images with these names (case insensitively, without extension) are preferred as an album's cover
+COVER_NAMES = ('cover', 'folder', 'front', 'album')
+# Track numbers at the start of file names, e.g. "01 - ", "1. " or "01_"
+TRACK_NUMBER = re.compile(r'^\d{1,3}(\s*[-._]\s*|\s+)')
+UNKNOWN_ARTIST = "Unknown Artist"
+UNKNOWN_ALBUM = "Unknown Album"
+
+
+def scan(root):
+    """
+    Returns the paths of the files under root, sorted by directory and with images first, so that a directory's
+    cover is imported before its tracks.
+    """
+    paths = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        filenames.sort(key=lambda filename: (not is_cover(filename), filename))
+        paths.extend(os.path.join(directory, filename) for filename in filenames if not filename.startswith('.'))
+    return paths
+
+
+def is_cover(filename):
+    return os.path.splitext(filename)[0].lower() in COVER_NAMES
+
+
+def directory_album(root, path):
+    """
+    Returns the artist and the title of the album a file belongs to in an artist/album/track layout.
+    """
+    parts = os.path.relpath(os.path.dirname(path), root).split(os.sep)
+    parts = [part for part in parts if part != '.']
+    artist = parts[-2] if len(parts) >= 2 else UNKNOWN_ARTIST
+    return artist, parts[-1] if parts else UNKNOWN_ALBUM
+
+
+def song_title(path, tags):
+    return tags.get('title') or TRACK_NUMBER.sub('', os.path.splitext(os.path.basename(path))[0]) or "Untitled"
+
+
+class Command(BaseCommand):
+    help = ("Imports a directory of music into a user's library, one album per directory of an artist/album/track "
+            "tree, or grouped by the files' tags. Files are hashed and copied into storage by a pool of processes, "
+            "and songs are inserted in batches. Run it again after an interruption to import the rest.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help="The user whose library to import into.")
+        parser.add_argument('directory', help="The directory to import.")
+        parser.add_argument('--layout', choices=['directories', 'tags'], default='directories',
+                            help="Group songs into albums by their directories, or by their artist and album tags "
+                                 "(falling back on their directories).")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of files to copy at once. 0 copies them in this process.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of songs to insert at once.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError("No such user: %s" % options['username'])
+        root = os.path.abspath(options['directory'])
+        if not os.path.isdir(root):
+            raise CommandError("Not a directory: %s" % root)
+
+        paths = scan(root)
+        total_bytes = sum(os.path.getsize(path) for path in paths)
+        self.stdout.write("%d file(s), %.1f MB to import." % (len(paths), total_bytes / 1e6))
+
+        # Albums and songs that are already there, which a resumed import reuses and skips
+        self.albums = {(album.artist, album.title): album for album in Album.objects.owned_by(user)}
+        self.existing = set(Song.objects.owned_by(user).values_list('album_id', 'audio_file'))
+        self.user, self.options, self.root = user, options, root
+        self.covers, self.pending = {}, []
+        # The path each stored file was copied from, to copy it again if it's deleted before a row refers to it
+        self.sources = {}
+        self.created = self.skipped = self.ignored = 0
+
+        self.start = time.perf_counter()
+        if options['workers'] == 0:
+            self.import_all(paths, map(import_file, paths))
+        else:
+            with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                # Files are copied and read by the workers, the database is only touched from this process
+                self.import_all(paths, executor.map(import_file, paths, chunksize=8))
+
+        self.flush()
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %d song(s) and skipped %d already imported and %d other file(s) in %.1fs "
+            "(%.1f files/s, %.1f MB/s)." % (self.created, self.skipped, self.ignored, elapsed,
+                                            len(paths) / max(elapsed, 1e-6), total_bytes / 1e6 / max(elapsed, 1e-6))))
+
+    def import_all(self, paths, results):
+        done_bytes = 0
+        for count, (path, (kind, name, metadata)) in enumerate(zip(paths, results), 1):
+            done_bytes += os.path.getsize(path)
+            if name:
+                self.sources[name] = path
+            if kind in IMAGE_TYPES:
+                # The first image of a directory, covers first, becomes the cover of its albums
+                self.covers.setdefault(os.path.dirname(path), name)
+            elif kind in AUDIO_TYPES:
+                self.add_song(path, name, metadata)
+            else:
+                # Neither audio nor an image, or unreadable
+                self.ignored += 1
+            if len(self.pending) >= self.options['batch_size']:
+                self.flush()
+                elapsed = time.perf_counter() - self.start
+                self.stdout.write("%d/%d file(s), %.1f files/s, %.1f MB/s" % (
+                    count, len(paths), count / elapsed, done_bytes / 1e6 / elapsed))
+
+    def add_song(self, path, name, metadata):
+        metadata = metadata or {'duration': None, 'sample_rate': None, 'bitrate': None, 'channels': None, 'tags': {}}
+        tags = metadata['tags']
+        artist, title = directory_album(self.root, path)
+        if self.options['layout'] == 'tags':
+            artist, title = tags.get('artist') or artist, tags.get('album') or title
+        album = self.get_album(artist, title, tags.get('genre', ''), self.covers.get(os.path.dirname(path), ''))
+
+        if (album.pk, name) in self.existing:
+            self.skipped += 1
+            return
+        self.existing.add((album.pk, name))
+        self.pending.append(Song(album=album, title=song_title(path, tags)[:250], audio_file=name, **metadata))
+
+    def get_album(self, artist, title, genre, logo):
+        """
+        Returns the user's album with this artist and title, creating it the first time it's needed.
+        Albums are saved one at a time, so that their signals make thumbnails and search vectors.
+        """
+        artist, title = artist[:250], title[:100]
+        album = self.albums.get((artist, title))
+        if album is None:
+            with transaction.atomic():
+                if logo:
+                    keep_files({logo: self.sources[logo]})
+                album = Album.objects.create(user=self.user, artist=artist, title=title, genre=genre[:100], logo=logo)
+            self.albums[artist, title] = album
+        return album
+
+    def flush(self):
+        """
+        Inserts the pending songs in one transaction, so that an interrupted import keeps every finished batch.
+        """
+        if self.pending:
+            with transaction.atomic():
+                keep_files({song.audio_file.name: self.sources[song.audio_file.name] for song in self.pending})
+                Song.objects.bulk_create(self.pending)
+            self.created += len(self.pending)
+            self.pending = []
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from music.models import Album, Song
+
+
+class Command(BaseCommand):
+    help = "Finds albums whose stored song count has drifted from their real number of songs, and repairs them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of albums to repair per UPDATE.")
+        parser.add_argument('--dry-run', action='store_true', help="Report the drift without repairing it.")
+
+    def handle(self, *args, **options):
+        song_counts = Song.objects.filter(album=OuterRef('pk')).order_by().values('album').annotate(
+            count=Count('pk')).values('count')
+        drifted = Album.objects.annotate(
+            actual_count=Coalesce(Subquery(song_counts), 0)
+        ).exclude(song_count=F('actual_count')).order_by('pk')
+        album_ids = list(drifted.values_list('pk', flat=True))
+
+        self.stdout.write("%d album(s) have an incorrect song count." % len(album_ids))
+        if options['dry_run'] or not album_ids:
+            return
+
+        batch_size = options['batch_size']
+        for i in range(0, len(album_ids), batch_size):
+            Album.objects.filter(pk__in=album_ids[i:i + batch_size]).recount_songs()
+        self.stdout.write(self.style.SUCCESS("Repaired %d album(s)." % len(album_ids)))
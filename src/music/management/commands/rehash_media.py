@@ -0,0 +1,66 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from music.models import Album, Song
+from music.storage import content_name, content_storage, hash_file, is_content_name
+
+# Every field whose files are kept in content storage
+FIELDS = [(Album, 'logo'), (Song, 'audio_file')]
+
+
+def link(name):
+    """
+    Hashes a legacy file and hard links it to its content-addressed name, which is returned.
+    Returns None if the file is missing.
+    """
+    path = content_storage.path(name)
+    if not os.path.exists(path):
+        return None
+    new_name = content_name(hash_file(path), name)
+    new_path = content_storage.path(new_name)
+    if not os.path.exists(new_path):
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        try:
+            os.link(path, new_path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # MEDIA_ROOT spans more than one filesystem
+            shutil.copy2(path, new_path)
+    return new_name
+
+
+class Command(BaseCommand):
+    help = "Moves media uploaded before content-addressed storage under the SHA-256 of its contents."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of files to hash at once.")
+        parser.add_argument('--dry-run', action='store_true', help="Report the files to move without moving them.")
+
+    def handle(self, *args, **options):
+        names = set()
+        for model, field in FIELDS:
+            names.update(model.objects.exclude(**{field: ''}).values_list(field, flat=True).distinct())
+        names = sorted(name for name in names if not is_content_name(name))
+
+        self.stdout.write("%d file(s) to rehash." % len(names))
+        if options['dry_run'] or not names:
+            return
+
+        moved = missing = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            # Hashing is done by the workers, the database is only touched from this thread
+            for name, new_name in zip(names, executor.map(link, names)):
+                if new_name is None:
+                    self.stderr.write("Missing: %s" % name)
+                    missing += 1
+                    continue
+                for model, field in FIELDS:
+                    model.objects.filter(**{field: name}).update(**{field: new_name})
+                content_storage.delete(name)
+                moved += 1
+
+        self.stdout.write(self.style.SUCCESS("Rehashed %d file(s), %d missing." % (moved, missing)))
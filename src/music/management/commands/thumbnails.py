@@ -0,0 +1,31 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from music.artwork import make_thumbnails
+from music.ingest import save_thumbnails, thumbnail_paths
+from music.models import Album
+
+
+class Command(BaseCommand):
+    help = "Makes the artwork thumbnails of albums that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Number of logos to shrink at once.")
+        parser.add_argument('--all', action='store_true', help="Make every album's thumbnails again.")
+
+    def handle(self, *args, **options):
+        albums = Album.objects.exclude(logo='')
+        if not options['all']:
+            albums = albums.filter(has_thumbnails=False)
+        # Albums with identical artwork share one logo, which only needs shrinking once
+        names = sorted(set(albums.values_list('logo', flat=True)))
+        logos, directories = zip(*[thumbnail_paths(name) for name in names]) if names else ([], [])
+
+        made = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            # Images are shrunk by the workers, the database is only touched from this process
+            for name, ok in zip(names, executor.map(make_thumbnails, logos, directories)):
+                save_thumbnails(name, ok)
+                made += ok
+        self.stdout.write(self.style.SUCCESS("Made the thumbnails of %d of %d logo(s)." % (made, len(names))))
@@ -0,0 +1,170 @@
+import cProfile
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .profiling import format_params, profile_requested, save_profile
+
+logger = logging.getLogger(__name__)
+
+# Lists of placeholders, e.g. "IN (%s, %s, %s)", which vary with the number of values rather than the query
+PLACEHOLDER_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def query_shape(sql):
+    """
+    Returns the query with any list of placeholders collapsed, so that queries that differ only in their
+    values have the same shape. Django keeps the values out of the SQL, so they're already gone.
+    """
+    return PLACEHOLDER_LIST_RE.sub('IN (%s...)', sql)
+
+
+def repeated_queries(queries, threshold):
+    """
+    Returns the shapes run at least threshold times, and how many times, most first: the mark of a query
+    being run once per row of another.
+    """
+    counts = Counter(query_shape(sql) for sql, _ in queries)
+    return [(shape, count) for shape, count in counts.most_common() if count >= threshold]
+
+
+def view_name(view_func):
+    view_class = getattr(view_func, 'view_class', view_func)
+    return '%s.%s' % (view_class.__module__, view_class.__qualname__)
+
+
+class RequestTimingMiddleware(object):
+    """
+    Times each request, its queries and its template rendering, and sends them back in a Server-Timing header
+    for the browser's developer tools. Requests slower than REQUEST_TIMING_SLOW_MS, or that run the same query
+    over and over, are logged as JSON. Only installed when REQUEST_TIMING is on, so it costs nothing otherwise.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._timing = timing = {'queries': [], 'render': 0.0, 'view': None}
+
+        def record(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                timing['queries'].append((sql, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(record))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        db = sum(duration for _, duration in timing['queries'])
+        response['Server-Timing'] = ', '.join([
+            'db;dur=%.1f;desc="%d queries"' % (db * 1000, len(timing['queries'])),
+            'render;dur=%.1f' % (timing['render'] * 1000),
+            'total;dur=%.1f' % (total * 1000),
+        ])
+
+        repeated = repeated_queries(timing['queries'], settings.REQUEST_TIMING_REPEATED_QUERIES)
+        if total * 1000 >= settings.REQUEST_TIMING_SLOW_MS or repeated:
+            logger.warning(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': timing['view'],
+                'status': response.status_code,
+                'user': getattr(getattr(request, 'user', None), 'pk', None),
+                'total_ms': round(total * 1000, 1),
+                'db_ms': round(db * 1000, 1),
+                'render_ms': round(timing['render'] * 1000, 1),
+                'queries': len(timing['queries']),
+                'repeated': [{'sql': shape, 'count': count} for shape, count in repeated],
+            }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._timing['view'] = view_name(view_func)
+
+    def process_template_response(self, request, response):
+        """
+        Times the rendering of template responses, which happens once every middleware has seen them.
+        Views that render their templates themselves count it as their own time.
+        """
+        render = response.render
+        timing = request._timing
+
+        def timed_render():
+            start = time.perf_counter()
+            try:
+                return render()
+            finally:
+                timing['render'] += time.perf_counter() - start
+        response.render = timed_render
+        return response
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles a single request of a staff user who asks for it with an "X-Profile" header or a "_profile" query
+    parameter, recording cProfile stats and every query, and saves them with the latest PROFILE_KEEP others
+    (see music/profiling.py). The profile's name is sent back in an X-Profile-Name header. Anyone else's
+    requests go straight through, without the user even being looked up.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_KEEP:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profile_requested(request) or not request.user.is_staff:
+            return self.get_response(request)
+
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append({
+                    'db': context['connection'].alias,
+                    'sql': sql,
+                    'params': format_params(params),
+                    'many': many,
+                    'ms': round((time.perf_counter() - start) * 1000, 3),
+                })
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(record))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        total = time.perf_counter() - start
+
+        response['X-Profile-Name'] = save_profile(profiler, {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user': request.user.get_username(),
+            'status': response.status_code,
+            'started': time.time() - total,
+            'total_ms': round(total * 1000, 1),
+            'db_ms': round(sum(query['ms'] for query in queries), 1),
+            'queries': queries,
+        })
+        return response
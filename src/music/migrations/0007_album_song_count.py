@@ -0,0 +1,29 @@
+# Generated by Django 3.0.5 on 2026-10-18 20:09
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_songs(apps, schema_editor):
+    Album = apps.get_model('music', 'Album')
+    Song = apps.get_model('music', 'Song')
+    song_counts = Song.objects.filter(album=OuterRef('pk')).order_by().values('album').annotate(
+        count=Count('pk')).values('count')
+    Album.objects.update(song_count=Coalesce(Subquery(song_counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0006_auto_20190822_1531'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='song_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_songs, migrations.RunPython.noop),
+    ]
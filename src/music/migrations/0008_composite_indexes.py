@@ -0,0 +1,28 @@
+# Generated by Django 3.0.5 on 2026-10-18 20:10
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('music', '0007_album_song_count'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='album',
+            index=models.Index(fields=['user', '-is_favourite', 'id'], name='album_user_favourite_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='album',
+            index=models.Index(fields=['user', 'artist'], name='album_user_artist_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='song',
+            index=models.Index(fields=['album', '-is_favourite', 'id'], name='song_album_favourite_idx'),
+        ),
+    ]
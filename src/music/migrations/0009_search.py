@@ -0,0 +1,83 @@
+# Generated by Django 3.0.5 on 2026-10-18 20:12
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import Max, OuterRef, Subquery
+
+BATCH_SIZE = 10000
+
+
+def batches(queryset):
+    """
+    Splits a table into primary key ranges, so that no single UPDATE holds row locks for long.
+    """
+    last_pk = queryset.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+    for start in range(0, last_pk, BATCH_SIZE):
+        yield queryset.filter(pk__gt=start, pk__lte=start + BATCH_SIZE)
+
+
+def build_search_vectors(apps, schema_editor):
+    Album = apps.get_model('music', 'Album')
+    Song = apps.get_model('music', 'Song')
+
+    song_titles = Song.objects.filter(album=OuterRef('pk')).order_by().values('album').annotate(
+        titles=StringAgg('title', ' ')).values('titles')
+    for albums in batches(Album.objects.all()):
+        albums.update(search_vector=(
+            SearchVector('title', 'artist', weight='A', config='simple') +
+            SearchVector('genre', weight='B', config='simple') +
+            SearchVector(Subquery(song_titles), weight='C', config='simple')
+        ))
+
+    album = Album.objects.filter(pk=OuterRef('album_id'))
+    for songs in batches(Song.objects.all()):
+        songs.update(search_vector=(
+            SearchVector('title', weight='A', config='simple') +
+            SearchVector(Subquery(album.values('artist')), weight='B', config='simple') +
+            SearchVector(Subquery(album.values('title')), Subquery(album.values('genre')),
+                         weight='C', config='simple')
+        ))
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('music', '0008_composite_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='album',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(build_search_vectors, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='album',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='album_search_vector_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='album',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='album_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        AddIndexConcurrently(
+            model_name='song',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='song_search_vector_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='song',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='song_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
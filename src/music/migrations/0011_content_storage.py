@@ -0,0 +1,24 @@
+# Generated by Django 3.0.5 on 2026-10-18 20:40
+
+from django.db import migrations, models
+import music.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0010_upload'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='album',
+            name='logo',
+            field=models.FileField(storage=music.storage.ContentAddressedStorage(), upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='song',
+            name='audio_file',
+            field=models.FileField(default='', storage=music.storage.ContentAddressedStorage(), upload_to=''),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 21:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0012_song_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='has_thumbnails',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.0.5 on 2026-10-18 22:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('music', '0013_album_has_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Playlist',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=250)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlaylistEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.BigIntegerField()),
+                ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='music.Playlist')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music.Song')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='playlistentry',
+            index=models.Index(fields=['playlist', 'position', 'id'], name='playlist_entry_position_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.5 on 2026-10-18 23:40
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('music', '0014_playlist'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='album',
+            index=models.Index(fields=['logo'], name='album_logo_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='song',
+            index=models.Index(fields=['audio_file'], name='song_audio_file_idx'),
+        ),
+    ]
@@ -1,34 +1,390 @@
+import hashlib
+import uuid
+
 from django.contrib.auth.models import Permission, User
-from django.db import models
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import models, router, transaction
+from django.db.models import BooleanField, Count, Func, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 
+from .caching import library_changed
+from .storage import content_storage
+
+# Text search configuration for search vectors and queries. "simple" avoids stemming and stop words,
+# which suit names of songs and artists ("The The") better than any one language's dictionary.
+SEARCH_CONFIG = 'simple'
+# Space left between the positions of neighbouring playlist entries, so that an entry can be moved between two
+# others by changing its own position alone. Only once 16 moves in a row have used up a gap is the playlist
+# renumbered.
+POSITION_GAP = 1 << 16
+
+
+class Not(Func):
+    """
+    SQL NOT, for flipping a boolean column in place.
+    """
+    template = 'NOT %(expressions)s'
+    output_field = BooleanField()
+
+
+class FavouriteQuerySet(models.QuerySet):
+
+    def toggle_favourite(self, pk):
+        """
+        Flips the favourite flag of the row in the queryset with a single UPDATE, so that concurrent clicks
+        can't undo each other. Returns the new value, or None if the row isn't in the queryset.
+        """
+        with transaction.atomic(using=self.db):
+            if not self.filter(pk=pk).update(is_favourite=Not('is_favourite')):
+                return None
+            # The UPDATE keeps the row locked until the transaction ends, so this reads the value it wrote
+            rows = self.model._default_manager.using(self.db).filter(pk=pk)
+            return rows.values_list('is_favourite', flat=True).get()
+
+
+class AlbumQuerySet(FavouriteQuerySet):
+
+    def owned_by(self, user):
+        """
+        Limits the queryset to the user's albums, so that ownership is checked by the same query that fetches them.
+        """
+        return self.filter(user=user)
+
+    def recount_songs(self):
+        """
+        Recalculates the stored song count of every album in the queryset with a single UPDATE.
+        """
+        song_counts = Song.objects.filter(album=OuterRef('pk')).order_by().values('album').annotate(
+            count=Count('pk')).values('count')
+        return self.update(song_count=Coalesce(Subquery(song_counts), 0))
+
+    def update_search_vectors(self):
+        """
+        Rebuilds the search vector of every album in the queryset from its title, artist, genre and song titles.
+        """
+        song_titles = Song.objects.filter(album=OuterRef('pk')).order_by().values('album').annotate(
+            titles=StringAgg('title', ' ')).values('titles')
+        return self.update(search_vector=(
+            SearchVector('title', 'artist', weight='A', config=SEARCH_CONFIG) +
+            SearchVector('genre', weight='B', config=SEARCH_CONFIG) +
+            SearchVector(Subquery(song_titles), weight='C', config=SEARCH_CONFIG)
+        ))
+
+    def update(self, **kwargs):
+        """
+        Marks the owners' cached pages as out of date. Song counts and search vectors are left out, since they only
+        change along with songs, which do that themselves.
+        """
+        if set(kwargs) - {'search_vector', 'song_count'}:
+            library_changed(self.order_by().values_list('user_id', flat=True).distinct())
+        return super(AlbumQuerySet, self).update(**kwargs)
+
+
+class StoredFilesModel(models.Model):
+    """
+    Saves the row in the same transaction as its files. Content storage locks a file that it reuses until the end
+    of the transaction (see storage.lock_file()), so a concurrent delete can't remove it before this row refers to it.
+    """
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super(StoredFilesModel, self).save(*args, **kwargs)
 
-class Album(models.Model):
+
+class Album(StoredFilesModel):
     user = models.ForeignKey(User, default=1, on_delete=models.CASCADE)
     artist = models.CharField(max_length=250)
     title = models.CharField(max_length=100)
     genre = models.CharField(max_length=100)
-    logo = models.FileField()
+    logo = models.FileField(storage=content_storage)
     is_favourite = models.BooleanField(default=False)
+    # Kept up to date by the signals in signals.py, repair with "manage.py recount_songs"
+    song_count = models.PositiveIntegerField(default=0, editable=False)
+    # Kept up to date by the signals in signals.py, searched by search.py
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Set by ingest.py once the logo's thumbnails (see artwork.py) have been made, fill in with "manage.py thumbnails"
+    has_thumbnails = models.BooleanField(default=False, editable=False)
+
+    objects = AlbumQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # IndexView: the user's albums, favourites first
+            models.Index(fields=['user', '-is_favourite', 'id'], name='album_user_favourite_idx'),
+            # DetailView: other albums by the same artist
+            models.Index(fields=['user', 'artist'], name='album_user_artist_idx'),
+            # Search
+            GinIndex(fields=['search_vector'], name='album_search_vector_idx'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='album_title_trgm_idx'),
+            # Content storage: the rows that still refer to a file, counted before deleting it
+            models.Index(fields=['logo'], name='album_logo_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers which logo the album was loaded with, so that replacing it can be detected on save.
+        """
+        instance = super(Album, cls).from_db(db, field_names, values)
+        instance._loaded_logo = instance.__dict__.get('logo')
+        return instance
 
     def get_absolute_url(self):
         return reverse('music:detail', kwargs={'pk': self.pk})
 
     def get_number_of_songs(self):
-        return self.song_set.count()
+        return self.song_count
 
     def __str__(self):
         return self.title + ' - ' + self.artist
 
 
-class Song(models.Model):
+class SongQuerySet(FavouriteQuerySet):
+
+    def owned_by(self, user):
+        """
+        Limits the queryset to songs on the user's albums.
+        """
+        return self.filter(album__user=user)
+
+    def update_search_vectors(self):
+        """
+        Rebuilds the search vector of every song in the queryset from its title and its album's details.
+        """
+        album = Album.objects.filter(pk=OuterRef('album_id'))
+        return self.update(search_vector=(
+            SearchVector('title', weight='A', config=SEARCH_CONFIG) +
+            SearchVector(Subquery(album.values('artist')), weight='B', config=SEARCH_CONFIG) +
+            SearchVector(Subquery(album.values('title')), Subquery(album.values('genre')),
+                         weight='C', config=SEARCH_CONFIG)
+        ))
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        bulk_create() does not send post_save, so recount and reindex the affected albums afterwards.
+        """
+        with transaction.atomic(using=self.db):
+            objs = super(SongQuerySet, self).bulk_create(objs, *args, **kwargs)
+            albums = Album.objects.filter(pk__in={song.album_id for song in objs})
+            albums.recount_songs()
+            albums.update_search_vectors()
+            Song.objects.filter(pk__in=[song.pk for song in objs]).update_search_vectors()
+            library_changed(albums.values_list('user_id', flat=True))
+        return objs
+
+    def update(self, **kwargs):
+        """
+        Moving or renaming songs in bulk recounts and reindexes both the old and the new albums.
+        Any other change just marks their owners' cached pages as out of date.
+        """
+        if not {'album', 'album_id', 'title'} & set(kwargs):
+            # Search vectors aren't shown on any page
+            if set(kwargs) != {'search_vector'}:
+                library_changed(self.order_by().values_list('album__user_id', flat=True).distinct())
+            return super(SongQuerySet, self).update(**kwargs)
+        with transaction.atomic(using=self.db):
+            album_ids = set(self.order_by().values_list('album_id', flat=True).distinct())
+            rows = super(SongQuerySet, self).update(**kwargs)
+            moved = 'album' in kwargs or 'album_id' in kwargs
+            if moved:
+                new_album = kwargs.get('album', kwargs.get('album_id'))
+                album_ids.add(getattr(new_album, 'pk', new_album))
+
+            albums = Album.objects.filter(pk__in=album_ids)
+            if moved:
+                albums.recount_songs()
+            albums.update_search_vectors()
+            Song.objects.filter(album_id__in=album_ids).update_search_vectors()
+            library_changed(albums.values_list('user_id', flat=True))
+        return rows
+
+
+def audio_version(audio_file):
+    return hashlib.sha1(str(audio_file).encode()).hexdigest()[:12]
+
+
+def stream_url(song_id, audio_file):
+    """
+    Returns the URL the player streams a song from. It includes a version of the song's audio file, so that the
+    browser's offline cache (see service-worker.js) never plays an old file for a song whose file was replaced.
+    """
+    return '%s?v=%s' % (reverse('music:song-stream', kwargs={'song_id': song_id}), audio_version(audio_file))
+
+
+class Song(StoredFilesModel):
     album = models.ForeignKey(Album, on_delete=models.CASCADE)
-    audio_file = models.FileField(default='')
+    audio_file = models.FileField(default='', storage=content_storage)
     title = models.CharField(max_length=250)
     is_favourite = models.BooleanField(default=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Read from the audio file in the background by ingest.py, fill in with "manage.py extract_metadata"
+    duration = models.FloatField(null=True, editable=False)
+    sample_rate = models.PositiveIntegerField(null=True, editable=False)
+    bitrate = models.PositiveIntegerField(null=True, editable=False)
+    channels = models.PositiveSmallIntegerField(null=True, editable=False)
+    tags = JSONField(default=dict, editable=False)
+
+    objects = SongQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Song lists, favourites first
+            models.Index(fields=['album', '-is_favourite', 'id'], name='song_album_favourite_idx'),
+            # Search
+            GinIndex(fields=['search_vector'], name='song_search_vector_idx'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='song_title_trgm_idx'),
+            # Content storage: the rows that still refer to a file, counted before deleting it
+            models.Index(fields=['audio_file'], name='song_audio_file_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers which album and file the song was loaded with, so that moving it or replacing the file can be
+        detected on save.
+        """
+        instance = super(Song, cls).from_db(db, field_names, values)
+        instance._loaded_album_id = instance.__dict__.get('album_id')
+        instance._loaded_audio_file = instance.__dict__.get('audio_file')
+        return instance
+
+    def get_length(self):
+        """
+        Returns the duration as "m:ss", or an empty string if it hasn't been read yet.
+        """
+        if self.duration is None:
+            return ''
+        minutes, seconds = divmod(int(round(self.duration)), 60)
+        return '%d:%02d' % (minutes, seconds)
 
     def get_absolute_url(self):
         return reverse('music:detail', kwargs={'pk': self.album.pk})
 
+    def get_stream_url(self):
+        return stream_url(self.pk, self.audio_file.name)
+
     def __str__(self):
         return self.title + ' - ' + self.album.artist
+
+
+class Upload(models.Model):
+    """
+    A song being uploaded in chunks, see uploads.py. The row is replaced by a Song once the upload is finalised.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    album = models.ForeignKey(Album, on_delete=models.CASCADE)
+    title = models.CharField(max_length=250)
+    filename = models.CharField(max_length=250)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.filename + ' (' + str(self.offset) + '/' + str(self.size) + ')'
+
+
+class PlaylistQuerySet(models.QuerySet):
+
+    def owned_by(self, user):
+        return self.filter(user=user)
+
+
+class Playlist(models.Model):
+    """
+    An ordered list of the user's songs, which may include a song more than once.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    name = models.CharField(max_length=250)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = PlaylistQuerySet.as_manager()
+
+    def lock(self):
+        """
+        Locks the playlist until the end of the transaction, so that entries appended or moved at the same time
+        can't be given the same positions.
+        """
+        Playlist.objects.select_for_update().only('id').get(pk=self.pk)
+
+    def append(self, songs):
+        """
+        Adds the songs to the end of the playlist, in the order given, and returns their entries.
+        """
+        with transaction.atomic():
+            self.lock()
+            last = self.entries.aggregate(last=Max('position'))['last'] or 0
+            return PlaylistEntry.objects.bulk_create(
+                PlaylistEntry(playlist=self, song=song, position=last + POSITION_GAP * i)
+                for i, song in enumerate(songs, 1))
+
+    def move(self, entry, after=None):
+        """
+        Moves the entry to just after another entry of the playlist, or to the start if that's None, by giving it
+        a position between its new neighbours'. Only if there's no room between them is the playlist renumbered.
+        """
+        if after is not None and after.pk == entry.pk:
+            return
+        with transaction.atomic():
+            self.lock()
+            # Not self.entries, which would load the deferred playlist_id of every entry to attach this playlist
+            others = PlaylistEntry.objects.filter(playlist=self).exclude(pk=entry.pk).order_by('position', 'id')
+            if after is not None:
+                after.refresh_from_db(fields=['position'])
+                others = others.filter(Q(position__gt=after.position) | Q(position=after.position, id__gt=after.pk))
+            following = others.only('position').first()
+
+            if after is None:
+                position = following.position - POSITION_GAP if following else 0
+            elif following is None:
+                position = after.position + POSITION_GAP
+            elif following.position - after.position > 1:
+                position = (after.position + following.position) // 2
+            else:
+                self.renumber()
+                return self.move(entry, after)
+            PlaylistEntry.objects.filter(pk=entry.pk).update(position=position)
+            entry.position = position
+
+    def renumber(self):
+        """
+        Spreads the entries' positions out again by POSITION_GAP, keeping their order.
+        """
+        entries = list(PlaylistEntry.objects.filter(playlist=self).order_by('position', 'id').only('position'))
+        for i, entry in enumerate(entries, 1):
+            entry.position = POSITION_GAP * i
+        PlaylistEntry.objects.bulk_update(entries, ['position'], batch_size=1000)
+
+    def __str__(self):
+        return self.name
+
+
+class PlaylistEntryQuerySet(models.QuerySet):
+
+    def owned_by(self, user):
+        return self.filter(playlist__user=user)
+
+
+class PlaylistEntry(models.Model):
+    playlist = models.ForeignKey(Playlist, related_name='entries', on_delete=models.CASCADE)
+    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    # Entries play in order of position, then ID. Positions are spaced out, see POSITION_GAP.
+    position = models.BigIntegerField()
+
+    objects = PlaylistEntryQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['playlist', 'position', 'id'], name='playlist_entry_position_idx'),
+        ]
+
+    def __str__(self):
+        return '%s: %s' % (self.playlist, self.song.title)
@@ -0,0 +1,125 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+class KeysetPage(object):
+    """
+    A single page of a keyset-paginated queryset.
+    Unlike Django's Page, there is no total count or page number, only a cursor pointing at the next page.
+    The rows are only fetched when the page is first used, so a page that is rendered from the cache costs nothing.
+    """
+
+    def __init__(self, queryset, ordering, per_page, cursor=None):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.per_page = per_page
+        self.cursor = cursor
+
+    @cached_property
+    def _rows(self):
+        # Fetch one extra row to find out whether there is another page, without a COUNT(*)
+        object_list = list(self.queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(object_list) > self.per_page:
+            object_list = object_list[:self.per_page]
+            last = object_list[-1]
+            next_cursor = encode_cursor([getattr(last, field.lstrip('-')) for field in self.ordering])
+        return object_list, next_cursor
+
+    @property
+    def object_list(self):
+        return self._rows[0]
+
+    @property
+    def next_cursor(self):
+        return self._rows[1]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def is_paginated(self):
+        return self.has_next() or self.has_previous()
+
+
+def encode_cursor(values):
+    """
+    Turns a list of ordering values into an opaque, URL-safe string.
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, length):
+    """
+    Reverses encode_cursor(), raising ValueError if the cursor has been tampered with.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (TypeError, UnicodeError, json.JSONDecodeError, binascii.Error):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid cursor.")
+    return values
+
+
+def keyset_filter(ordering, values):
+    """
+    Builds the "comes after this row" condition for a lexicographic ordering, e.g. for ('-is_favourite', 'id'):
+    is_favourite < f OR (is_favourite = f AND id > i)
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = '__lt' if field.startswith('-') else '__gt'
+        condition |= equal & Q(**{name + lookup: value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def paginate_keyset(queryset, ordering, cursor=None, per_page=50):
+    """
+    Returns the page of the queryset that follows the cursor.
+    The ordering must end in a unique field (usually "id") so that every row has a distinct position.
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(keyset_filter(ordering, decode_cursor(cursor, len(ordering))))
+    return KeysetPage(queryset, ordering, per_page, cursor)
+
+
+class KeysetPaginationMixin(object):
+    """
+    ListView mixin that replaces offset pagination with keyset (cursor) pagination, so the cost of a page
+    does not depend on how far into the list it is.
+    """
+    keyset_ordering = ('id',)
+    cursor_kwarg = 'cursor'
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Returns the same (paginator, page, object_list, is_paginated) tuple as MultipleObjectMixin, except that
+        the page is fetched lazily and is_paginated is a method, which templates call for themselves.
+        """
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        try:
+            page = paginate_keyset(queryset, self.get_keyset_ordering(), cursor, page_size)
+        except ValueError:
+            raise Http404("Invalid cursor.")
+        return None, page, page, page.is_paginated
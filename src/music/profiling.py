@@ -0,0 +1,98 @@
+import json
+import os
+import re
+import time
+import uuid
+
+from django.conf import settings
+
+# "20200412T181502123456-3fa2b1c0.prof" and its SQL trace, "20200412T181502123456-3fa2b1c0.json", named after
+# the time to the microsecond, so that they sort oldest first
+PROFILE_NAME_RE = re.compile(r'^\d{8}T\d{12}-[0-9a-f]{8}\.(prof|json)$')
+# Query parameters are kept for reproducing a query, but not whole uploads
+MAX_PARAM_LENGTH = 200
+
+
+def profile_requested(request):
+    """
+    Whether the request asks to be profiled, with an "X-Profile" header or a "_profile" query parameter.
+    Only looks at the request itself, so it costs next to nothing when it doesn't.
+    """
+    return 'HTTP_X_PROFILE' in request.META or '_profile' in request.GET
+
+
+def format_params(params):
+    text = repr(params)
+    if len(text) > MAX_PARAM_LENGTH:
+        text = text[:MAX_PARAM_LENGTH] + '...'
+    return text
+
+
+def write_file(path, write):
+    """
+    Writes a file under a temporary name first, so that the list of profiles never shows a partial one.
+    """
+    write(path + '.part')
+    os.replace(path + '.part', path)
+
+
+def save_profile(profiler, trace):
+    """
+    Saves a request's cProfile stats and its SQL trace to PROFILE_ROOT under a new name, which is returned, and
+    deletes all but the latest PROFILE_KEEP profiles.
+    """
+    os.makedirs(settings.PROFILE_ROOT, exist_ok=True)
+    now = time.time()
+    name = '%s%06d-%s' % (time.strftime('%Y%m%dT%H%M%S', time.gmtime(now)), now % 1 * 1000000,
+                          uuid.uuid4().hex[:8])
+    path = os.path.join(settings.PROFILE_ROOT, name)
+
+    def write_trace(path):
+        with open(path, 'w') as f:
+            json.dump(trace, f, indent=1)
+    write_file(path + '.prof', profiler.dump_stats)
+    write_file(path + '.json', write_trace)
+    prune_profiles(settings.PROFILE_KEEP)
+    return name
+
+
+def profile_names():
+    """
+    Returns the names of the saved profiles, newest first.
+    """
+    try:
+        filenames = os.listdir(settings.PROFILE_ROOT)
+    except FileNotFoundError:
+        return []
+    return sorted((filename[:-len('.json')] for filename in filenames
+                   if PROFILE_NAME_RE.match(filename) and filename.endswith('.json')), reverse=True)
+
+
+def prune_profiles(keep):
+    for name in profile_names()[keep:]:
+        for extension in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(settings.PROFILE_ROOT, name + extension))
+            except FileNotFoundError:
+                # Another worker pruned it first
+                pass
+
+
+def load_trace(name):
+    """
+    Returns a saved profile's SQL trace, or None if it's been pruned since it was listed.
+    """
+    try:
+        with open(os.path.join(settings.PROFILE_ROOT, name + '.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def profile_path(filename):
+    """
+    Returns the path of a saved profile's file, or None if the filename isn't one.
+    """
+    if not PROFILE_NAME_RE.match(filename):
+        return None
+    return os.path.join(settings.PROFILE_ROOT, filename)
@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.local import Local
+from django.conf import settings
+from django.core.cache import cache
+from django.template.response import SimpleTemplateResponse
+
+# Alias of the read replica in settings.DATABASES, which is optional
+REPLICA = 'replica'
+PIN_KEY = 'primary-pin:%s'
+
+# Whether the current request's reads may go to the replica. asgiref's Local, like Django's own
+# connections, keeps requests apart under ASGI as well as between threads.
+_state = Local()
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+class ReplicaRouter(object):
+    """
+    Sends the reads of views wrapped in read_from_replica() to the replica, and everything else to the primary.
+    The replica is a copy of the primary, so objects from either can be related and only the primary is migrated.
+    """
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'use_replica', False):
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+@contextmanager
+def replica_reads():
+    previous = getattr(_state, 'use_replica', False)
+    _state.use_replica = True
+    try:
+        yield
+    finally:
+        _state.use_replica = previous
+
+
+def pin_to_primary(user_ids):
+    """
+    Keeps the users' reads on the primary for the next REPLICA_PIN_SECONDS, until the replica has caught up
+    with their changes. Without it, a page loaded straight after a change could miss it, and be cached as if
+    it didn't.
+    """
+    if replica_configured():
+        cache.set_many({PIN_KEY % user_id: True for user_id in user_ids if user_id is not None},
+                       settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    return cache.get(PIN_KEY % user.pk, False)
+
+
+def read_from_replica(view):
+    """
+    Runs the queries of a read-only view on the replica, if there is one, unless the user has recently changed
+    their library. The user and their session are always read from the primary: a replica that hasn't yet seen
+    a new session would log the user out. Checking that the user is logged in reads both.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (not replica_configured() or request.method not in ('GET', 'HEAD') or
+                not request.user.is_authenticated or is_pinned(request.user)):
+            return view(request, *args, **kwargs)
+        with replica_reads():
+            response = view(request, *args, **kwargs)
+            # Template responses run their templates' queries once rendered, which must happen here too
+            if isinstance(response, SimpleTemplateResponse) and not response.is_rendered:
+                response.render()
+        return response
+    return wrapper
@@ -0,0 +1,39 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast, Greatest
+
+from .models import SEARCH_CONFIG
+
+
+def search_query(query):
+    """
+    Turns what the user typed into a prefix-matching tsquery, so "imag drag" finds "Imagine Dragons".
+    Returns None if the query has no words in it.
+    """
+    terms = re.findall(r'\w+', query.lower())
+    if not terms:
+        return None
+    return SearchQuery(' & '.join(term + ':*' for term in terms), config=SEARCH_CONFIG, search_type='raw')
+
+
+def search(queryset, query):
+    """
+    Searches a queryset of albums or songs, annotating each match with a "rank" from 0 to 1.
+    Matches either the full text search vector or, for typos, a title with a similar set of trigrams.
+    The rank is cast from real to double precision, so that a keyset cursor holding it as a Python float
+    compares equal to the row it came from.
+    """
+    tsquery = search_query(query)
+    if tsquery is None:
+        return queryset.none()
+    return queryset.filter(
+        Q(search_vector=tsquery) | Q(title__trigram_similar=query)
+    ).annotate(
+        rank=Cast(Greatest(
+            SearchRank(F('search_vector'), tsquery),
+            TrigramSimilarity('title', query),
+            output_field=FloatField()
+        ), FloatField())
+    )
@@ -0,0 +1,166 @@
+import logging
+import os
+import time
+
+from asgiref.local import Local
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.signals import request_finished, request_started
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .auth import forget_user
+from .caching import library_changed
+from .ingest import extract_metadata, generate_thumbnails
+from .models import Album, Song
+
+logger = logging.getLogger(__name__)
+
+# Album fields that make up the album's and its songs' search vectors
+ALBUM_SEARCH_FIELDS = {'title', 'artist', 'genre'}
+
+# The albums being deleted by the current thread or request, whose songs go with them (see song_deleted)
+_deleting = Local()
+
+
+def deleting_albums():
+    if not hasattr(_deleting, 'album_ids'):
+        _deleting.album_ids = set()
+    return _deleting.album_ids
+
+
+def adjust_song_count(song, album_id, delta):
+    """
+    Atomically adds delta to the album's stored song count, and to the song's cached album if it is that one.
+    """
+    Album.objects.filter(pk=album_id).update(song_count=F('song_count') + delta)
+    if Song.album.is_cached(song) and song.album.pk == album_id:
+        song.album.song_count += delta
+
+
+def album_owners(song, album_ids):
+    """
+    Returns the IDs of the users whose libraries a change to the song's albums shows up in.
+    """
+    if Song.album.is_cached(song) and album_ids == {song.album.pk}:
+        return [song.album.user_id]
+    return list(Album.objects.filter(pk__in=album_ids).values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=Album)
+def album_saved(sender, instance, created, raw, update_fields, **kwargs):
+    """
+    Makes thumbnails of new logos, then reindexes the album and its songs, unless the save could not have
+    changed any searchable field.
+    """
+    if raw:
+        return
+    library_changed([instance.user_id])
+    name = instance.logo.name
+    if name and (created or getattr(instance, '_loaded_logo', None) != name):
+        if not created:
+            Album.objects.filter(pk=instance.pk).update(has_thumbnails=False)
+            instance.has_thumbnails = False
+        transaction.on_commit(lambda: generate_thumbnails(instance))
+    instance._loaded_logo = name
+
+    if update_fields and not ALBUM_SEARCH_FIELDS & set(update_fields):
+        return
+    Album.objects.filter(pk=instance.pk).update_search_vectors()
+    Song.objects.filter(album=instance).update_search_vectors()
+
+
+@receiver(post_save, sender=Song)
+def song_saved(sender, instance, created, raw, **kwargs):
+    """
+    Counts new songs, and songs that have been moved from one album to another, then reindexes them.
+    Songs with new audio files have their metadata extracted.
+    """
+    if raw:
+        return
+    album_ids = {instance.album_id}
+    loaded_album_id = getattr(instance, '_loaded_album_id', None)
+    if created:
+        adjust_song_count(instance, instance.album_id, 1)
+    elif loaded_album_id is not None and loaded_album_id != instance.album_id:
+        adjust_song_count(instance, loaded_album_id, -1)
+        adjust_song_count(instance, instance.album_id, 1)
+        album_ids.add(loaded_album_id)
+    instance._loaded_album_id = instance.album_id
+
+    # Read the metadata of new files, once the song is committed so that the worker's update can find it
+    name = instance.audio_file.name
+    if name and (created or getattr(instance, '_loaded_audio_file', None) != name):
+        transaction.on_commit(lambda: extract_metadata(instance))
+    instance._loaded_audio_file = name
+
+    Song.objects.filter(pk=instance.pk).update_search_vectors()
+    Album.objects.filter(pk__in=album_ids).update_search_vectors()
+    library_changed(album_owners(instance, album_ids))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, raw, **kwargs):
+    """
+    Library pages greet the user by name, and the cached user must have their new details and password.
+    """
+    if not raw:
+        forget_user(instance.pk)
+        library_changed([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver(pre_delete, sender=Album)
+def album_deleting(sender, instance, **kwargs):
+    # Sent before any row is deleted, so before the post_delete of the album's songs
+    deleting_albums().add(instance.pk)
+
+
+@receiver(post_delete, sender=Album)
+def album_deleted(sender, instance, **kwargs):
+    deleting_albums().discard(instance.pk)
+    library_changed([instance.user_id])
+
+
+@receiver(post_delete, sender=Song)
+def song_deleted(sender, instance, **kwargs):
+    """
+    Uncounts deleted songs, including those removed by QuerySet.delete(). Songs deleted along with their album
+    are left alone, as there is no count or search vector left to update, and album_deleted bumps the library.
+    """
+    if instance.album_id in deleting_albums():
+        return
+    adjust_song_count(instance, instance.album_id, -1)
+    Album.objects.filter(pk=instance.album_id).update_search_vectors()
+    library_changed(album_owners(instance, {instance.album_id}))
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    """
+    Closes persistent connections that have stopped working, e.g. since a database restart or failover, so that
+    the request reopens them rather than failing. Costs a "SELECT 1" per open connection and request.
+    """
+    if not settings.DB_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.in_atomic_block and not connection.is_usable():
+            connection.close()
+
+
+@receiver(request_finished)
+def report_first_request(**kwargs):
+    """
+    Logs how long after the container started this worker finished its first request, to keep track of how
+    quickly new containers can take traffic. Only listens for that one request.
+    """
+    request_finished.disconnect(report_first_request)
+    if settings.CONTAINER_STARTED_AT:
+        logger.info("Worker %d served its first request %.2fs after the container started.",
+                    os.getpid(), time.time() - settings.CONTAINER_STARTED_AT)
@@ -0,0 +1,73 @@
+const FAVOURITE_ICONS = "https://cdn4.iconfinder.com/data/icons/small-n-flat/24/";
+const NOT_FAVOURITE_ICONS = "https://cdn3.iconfinder.com/data/icons/linecons-free-vector-icons-pack/32/";
+
+/**
+ * Send a form post with the CSRF token and return its JSON body, throwing if it fails.
+ * @param url       Endpoint (string)
+ * @param body      Form fields (URLSearchParams)
+ */
+function postFavourite(url, body) {
+    return fetch(url, {
+        method: "POST",
+        credentials: "same-origin",
+        headers: {"X-CSRFToken": document.cookie.replace(/(?:^|.*;\s*)csrftoken=([^;]*).*$/, "$1")},
+        body: body
+    }).then(function (response) {
+        if (!response.ok) {
+            throw new Error(response.statusText);
+        }
+        return response.json();
+    });
+}
+
+/**
+ * Show a favourite link's star as filled or empty, keeping its size.
+ * @param link          Favourite link with a star image inside (element)
+ * @param isFavourite   New state (boolean)
+ */
+function showFavourite(link, isFavourite) {
+    const star = link.querySelector("img");
+    star.src = (isFavourite ? FAVOURITE_ICONS : NOT_FAVOURITE_ICONS) + star.src.split("/").pop();
+    star.alt = isFavourite ? "favourite" : "not-favourite";
+}
+
+/**
+ * Favourite or unfavourite an album or song in place (used by index.html, detail.html and songs.html).
+ * Without fetch, or if the request fails, the link is followed instead, which reloads the page.
+ * @param link      Favourite link, whose href is the toggle endpoint (element)
+ */
+function toggleFavourite(link) {
+    if (!window.fetch) {
+        return true;
+    }
+    postFavourite(link.href, new URLSearchParams()).then(function (result) {
+        showFavourite(link, result.is_favourite);
+    }).catch(function () {
+        window.location = link.href;
+    });
+    return false;
+}
+
+/**
+ * Favourite or unfavourite every ticked song on the page with one request (used by songs.html).
+ * @param url           Bulk favourite endpoint (string)
+ * @param isFavourite   Whether to favourite or unfavourite them (boolean)
+ */
+function favouriteSelected(url, isFavourite) {
+    const boxes = Array.from(document.querySelectorAll("input.song-select:checked"));
+    if (!boxes.length) {
+        return;
+    }
+    const body = new URLSearchParams({type: "song", is_favourite: String(isFavourite)});
+    boxes.forEach(function (box) {
+        body.append("id", box.value);
+    });
+    postFavourite(url, body).then(function () {
+        boxes.forEach(function (box) {
+            showFavourite(box.closest("tr").querySelector("a.favourite"), isFavourite);
+            box.checked = false;
+        });
+    }).catch(function (error) {
+        alert("Couldn't update the favourites: " + error.message);
+    });
+}
@@ -0,0 +1,20 @@
+/**
+ * Register the service worker that keeps played and favourite songs for playing offline, and have it catch up
+ * with changes made elsewhere (used by base.html).
+ * @param url       URL of the service worker (string)
+ */
+function registerOfflineCache(url) {
+    if (!("serviceWorker" in navigator) || !window.caches) {
+        return;
+    }
+    navigator.serviceWorker.register(url).then(function () {
+        return navigator.serviceWorker.ready;
+    }).then(function (registration) {
+        registration.active.postMessage({
+            type: "sync",
+            csrfToken: document.cookie.replace(/(?:^|.*;\s*)csrftoken=([^;]*).*$/, "$1")
+        });
+    }).catch(function () {
+        // Songs are streamed as usual
+    });
+}
@@ -1,12 +1,168 @@
 /**
- * Play a selected song on the music player (embedded on base template).
+ * The music player (embedded on base template) plays a queue of songs, each {url, title, artist}.
+ * It has two audio elements: one plays the current song while the other loads the next, so that changing
+ * songs doesn't wait for a download, and the next song starts as soon as the current one ends.
+ */
+const player = {
+    queue: [],
+    index: -1,
+    current: null,
+    next: null
+};
+
+/**
+ * Play a selected song on its own.
  * @param song      URL of the song (string)
  * @param name      Name of the song (string)
  * @param artist    Artist of the song (string)
  */
 function playMusic(song, name, artist) {
-    document.getElementById("text").innerText = "You're listening to " + name + " by " + artist;
-    const audio = document.getElementById("audio");
-    audio.src = song;
-    audio.play();
+    playSongs([{url: song, title: name, artist: artist}], 0);
+}
+
+/**
+ * Replace the queue with the songs from a queue endpoint and start playing them (used by detail.html and
+ * songs.html).
+ * @param url       Queue or playlist endpoint, returning {songs: [...]} (string)
+ * @param shuffle   Whether to play the songs in a random order (boolean)
+ */
+function playQueue(url, shuffle) {
+    fetch(url, {credentials: "same-origin"}).then(function (response) {
+        if (!response.ok) {
+            throw new Error(response.statusText);
+        }
+        return response.json();
+    }).then(function (result) {
+        if (shuffle) {
+            shuffleSongs(result.songs, 0);
+        }
+        playSongs(result.songs, 0);
+    }).catch(function (error) {
+        alert("Couldn't load the songs: " + error.message);
+    });
+}
+
+/**
+ * Replace the queue and play one of its songs.
+ * @param songs     Songs to queue (array)
+ * @param index     Position of the song to play first (number)
+ */
+function playSongs(songs, index) {
+    player.queue = songs;
+    playAt(index);
+}
+
+/**
+ * Shuffle the songs from a position onwards in place (Fisher-Yates).
+ * @param songs     Songs (array)
+ * @param start     Position of the first song to shuffle (number)
+ */
+function shuffleSongs(songs, start) {
+    for (let i = songs.length - 1; i > start; i--) {
+        const j = start + Math.floor(Math.random() * (i - start + 1));
+        [songs[i], songs[j]] = [songs[j], songs[i]];
+    }
+}
+
+/**
+ * Shuffle the songs after the one playing, which keeps playing.
+ */
+function shuffleQueue() {
+    shuffleSongs(player.queue, player.index + 1);
+    preloadNext();
+}
+
+function nextSong() {
+    if (player.index + 1 < player.queue.length) {
+        playAt(player.index + 1);
+    }
+}
+
+/**
+ * Go back to the start of the song playing, or to the previous song if it has only just started.
+ */
+function previousSong() {
+    if (player.current.currentTime > 3 || player.index === 0) {
+        player.current.currentTime = 0;
+    } else if (player.index > 0) {
+        playAt(player.index - 1);
+    }
+}
+
+/**
+ * Play the song at a position of the queue, with the preloaded element if it holds that song already.
+ * @param index     Position in the queue (number)
+ */
+function playAt(index) {
+    const song = player.queue[index];
+    if (!song) {
+        return;
+    }
+    player.current.pause();
+    if (player.next.dataset.url === song.url) {
+        swapPlayers();
+    } else {
+        load(player.current, song.url);
+    }
+    player.index = index;
+    document.getElementById("text").innerText = "You're listening to " + song.title + " by " + song.artist;
+    player.current.play();
+    preloadNext();
+}
+
+/**
+ * Make the preloaded element the one that plays and shows its controls, and the other the one that preloads.
+ */
+function swapPlayers() {
+    [player.current, player.next] = [player.next, player.current];
+    player.current.hidden = false;
+    player.next.hidden = true;
+    player.current.volume = player.next.volume;
+    player.current.muted = player.next.muted;
+}
+
+/**
+ * Start downloading the song after the current one into the other element, once the current one has
+ * downloaded enough to play through, so that they don't share the bandwidth while the current one starts.
+ */
+function preloadNext() {
+    const song = player.queue[player.index + 1];
+    if (!song || player.next.dataset.url === song.url) {
+        return;
+    }
+    const current = player.current;
+    const start = function () {
+        if (current === player.current && player.queue[player.index + 1] === song) {
+            load(player.next, song.url);
+        }
+    };
+    if (current.readyState >= HTMLMediaElement.HAVE_ENOUGH_DATA) {
+        start();
+    } else {
+        current.addEventListener("canplaythrough", start, {once: true});
+    }
+}
+
+/**
+ * Point an audio element at a song and start loading it.
+ * @param audio     Audio element (element)
+ * @param url       URL of the song (string)
+ */
+function load(audio, url) {
+    audio.dataset.url = url;
+    audio.src = url;
+    audio.preload = "auto";
+    audio.load();
 }
+
+document.addEventListener("DOMContentLoaded", function () {
+    player.current = document.getElementById("audio");
+    player.next = document.getElementById("audio-next");
+    [player.current, player.next].forEach(function (audio) {
+        audio.addEventListener("ended", function () {
+            if (audio === player.current) {
+                nextSong();
+            }
+        });
+    });
+});
@@ -0,0 +1,152 @@
+/**
+ * Upload a song in chunks, resuming where a previous attempt left off (used by song_form.html).
+ * Falls back to the normal form post in browsers without fetch or crypto.subtle.
+ * @param form      Song form with title and audio_file inputs, and data-upload-url set (element)
+ */
+function enableChunkedUpload(form) {
+    if (!window.fetch || !window.crypto || !window.crypto.subtle) {
+        return;
+    }
+    form.addEventListener("submit", function (event) {
+        const file = form.elements["audio_file"].files[0];
+        if (!file) {
+            return;
+        }
+        event.preventDefault();
+        uploadSong(form, file).then(function (song) {
+            localStorage.removeItem(uploadKey(file));
+            window.location = song.url;
+        }).catch(function (error) {
+            document.getElementById("upload-status").innerText = error.message + " Submit again to resume.";
+        });
+    });
+}
+
+/**
+ * Key under which an unfinished upload of this file is remembered.
+ * @param file      Selected file (File)
+ */
+function uploadKey(file) {
+    return "upload:" + file.name + ":" + file.size + ":" + file.lastModified;
+}
+
+/**
+ * Send a request with the CSRF token and return its JSON body, throwing its error message on failure.
+ * The error has the response's status, so that callers can tell a discarded upload (404) from other failures.
+ * @param url       URL to request (string)
+ * @param options   fetch() options (object)
+ */
+function requestJson(url, options) {
+    options.headers = Object.assign({"X-CSRFToken": document.cookie.replace(/(?:^|.*;\s*)csrftoken=([^;]*).*$/, "$1")},
+                                    options.headers || {});
+    options.credentials = "same-origin";
+    return fetch(url, options).then(function (response) {
+        return response.json().then(function (body) {
+            if (!response.ok && response.status !== 409) {
+                const error = new Error(body.error || "Upload failed.");
+                error.status = response.status;
+                throw error;
+            }
+            return body;
+        });
+    });
+}
+
+/**
+ * Wait before trying again.
+ * @param ms        Milliseconds to wait (number)
+ */
+function sleep(ms) {
+    return new Promise(function (resolve) {
+        setTimeout(resolve, ms);
+    });
+}
+
+/**
+ * Hex SHA-256 of the whole file, which the server checks the finished upload against.
+ * SubtleCrypto can't hash a stream, so the file is read into memory once, at the end.
+ * @param file      Selected file (File)
+ */
+async function fileSha256(file) {
+    const digest = new Uint8Array(await crypto.subtle.digest("SHA-256", await file.arrayBuffer()));
+    return Array.from(digest, function (byte) {
+        return byte.toString(16).padStart(2, "0");
+    }).join("");
+}
+
+/**
+ * Start (or resume) the upload, send the remaining chunks with their SHA-256 and finish it.
+ * An upload the server has discarded, e.g. an abandoned one cleaned up by clean_uploads, is started again.
+ * @param form      Song form (element)
+ * @param file      Selected file (File)
+ */
+async function uploadSong(form, file) {
+    try {
+        return await sendUpload(form, file);
+    } catch (error) {
+        if (error.status !== 404) {
+            throw error;
+        }
+        // Resuming an upload the server no longer has can never work, so forget it and start again
+        localStorage.removeItem(uploadKey(file));
+        return sendUpload(form, file);
+    }
+}
+
+/**
+ * Does the work of uploadSong(), throwing an error with a status of 404 if the upload has been discarded.
+ * @param form      Song form (element)
+ * @param file      Selected file (File)
+ */
+async function sendUpload(form, file) {
+    const status = document.getElementById("upload-status");
+    let upload = JSON.parse(localStorage.getItem(uploadKey(file)) || "null");
+
+    if (upload) {
+        upload.offset = (await requestJson(upload.url, {method: "GET"})).offset;
+    } else {
+        const data = new FormData();
+        data.append("title", form.elements["title"].value);
+        data.append("filename", file.name);
+        data.append("size", file.size);
+        upload = await requestJson(form.dataset.uploadUrl, {method: "POST", body: data});
+        localStorage.setItem(uploadKey(file), JSON.stringify(upload));
+    }
+
+    let backoff = 500;
+    while (upload.offset < file.size) {
+        const chunk = await file.slice(upload.offset, upload.offset + upload.chunk_size).arrayBuffer();
+        const digest = await crypto.subtle.digest("SHA-256", chunk);
+        const result = await requestJson(upload.url, {
+            method: "PUT",
+            body: chunk,
+            headers: {
+                "Upload-Offset": String(upload.offset),
+                "Upload-Checksum": "sha256 " + btoa(String.fromCharCode.apply(null, new Uint8Array(digest))),
+            },
+        });
+        if (result.offset === upload.offset) {
+            // A 409 without progress: another request, e.g. from another tab, is still sending a chunk
+            await sleep(backoff);
+            backoff = Math.min(backoff * 2, 30000);
+            continue;
+        }
+        // A 409 tells us the offset the server actually has, so carry on from there
+        upload.offset = result.offset;
+        backoff = 500;
+        status.innerText = "Uploaded " + Math.floor(100 * upload.offset / file.size) + "%";
+    }
+
+    status.innerText = "Checking the upload...";
+    const data = new FormData();
+    data.append("sha256", await fileSha256(file));
+    try {
+        return await requestJson(upload.url + "finish/", {method: "POST", body: data});
+    } catch (error) {
+        if (error.status === 400) {
+            // The server discards an upload whose file it rejects, so the next attempt starts again
+            localStorage.removeItem(uploadKey(file));
+        }
+        throw error;
+    }
+}
@@ -0,0 +1,59 @@
+import gzip
+import os
+import re
+
+import brotli
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+# Files worth compressing. Images and fonts are compressed already.
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.json', '.map', '.svg', '.txt', '.xml', '.html', '.ico'}
+# References to local assets that don't go through {% static %}, e.g. src="/static/music/style.css"
+UNHASHED_ASSET_RE = re.compile(
+    r'''(?:src|href)\s*=\s*["'](?!https?:|//|data:|\{)([^"'#?]+\.(?:css|js|png|jpe?g|gif|svg|ico|webp|woff2?))["']''',
+    re.IGNORECASE)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Collects static files under names that include a hash of their contents, e.g. "music/style.5f2b1c0e9a7d.css",
+    so that they can be cached forever, and writes gzip and brotli copies next to the ones worth compressing,
+    for nginx to send without compressing them on every request.
+    """
+
+    def post_process(self, *args, **kwargs):
+        yield from super(CompressedManifestStaticFilesStorage, self).post_process(*args, **kwargs)
+        if not kwargs.get('dry_run'):
+            for name in set(self.hashed_files.values()):
+                if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                    self.compress(name)
+
+    def compress(self, name):
+        """
+        Writes name.gz and name.br, unless they would be no smaller. A hashed name's contents never change, so
+        copies that already exist are kept.
+        """
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        for extension, function in [('.gz', lambda data: gzip.compress(data, 9, mtime=0)),
+                                    ('.br', lambda data: brotli.compress(data, quality=11))]:
+            if os.path.exists(path + extension):
+                continue
+            compressed = function(data)
+            if len(compressed) < len(data):
+                with open(path + extension + '.part', 'wb') as f:
+                    f.write(compressed)
+                os.replace(path + extension + '.part', path + extension)
+
+    def stored_name(self, name):
+        # Until static files are first collected, e.g. while testing, there are no hashed names to use
+        if not self.hashed_files:
+            return name
+        return super(CompressedManifestStaticFilesStorage, self).stored_name(name)
+
+
+def unhashed_assets(template):
+    """
+    Returns the local assets that a template's source refers to by their plain names.
+    """
+    return UNHASHED_ASSET_RE.findall(template)
@@ -0,0 +1,143 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+from django.db.models import FileField
+
+BUFFER_SIZE = 64 * 1024
+# Content-addressed files live under this directory of MEDIA_ROOT
+ROOT = 'sha256'
+
+
+def content_name(digest, filename):
+    """
+    Builds the name of a blob from its hex digest, e.g. "sha256/9f/86/9f86d0...15b0.mp3".
+    Two levels of sharding keep every directory small, even with millions of files.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    return '/'.join([ROOT, digest[:2], digest[2:4], digest + extension])
+
+
+def is_content_name(name):
+    return name.startswith(ROOT + '/')
+
+
+def hash_file(path):
+    """
+    Returns the hex SHA-256 digest of a file on disk.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(BUFFER_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def lock_key(name):
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], 'big', signed=True)
+
+
+def lock_file(name, shared=False):
+    """
+    Takes a Postgres advisory lock on a stored file's name until the end of the current transaction. Saves that reuse
+    a file hold it shared and deletes hold it exclusively, so a delete that has found no references can't remove a
+    file that a save has just picked up. Models save in the same transaction as their files (see
+    models.StoredFilesModel), so the lock is held until the row that refers to the file is committed.
+    """
+    function = 'pg_advisory_xact_lock_shared' if shared else 'pg_advisory_xact_lock'
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT %s(%%s)' % function, [lock_key(name)])
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores files under the SHA-256 of their contents, so identical uploads share a single file on disk.
+    A file is only deleted once no row of any model using this storage refers to it any more.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Identical names mean identical contents, so there is never a need to pick a different one.
+        # If another process wrote the same blob while this one was saving it, stop FileSystemStorage retrying.
+        if is_content_name(name) and self.exists(name):
+            raise FileExistsError(name)
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        name = content_name(digest.hexdigest(), name)
+        if self.exists(name):
+            # It may be being deleted, in which case it's written again once the delete is done
+            lock_file(name, shared=True)
+            if self.exists(name):
+                return name
+        try:
+            return super(ContentAddressedStorage, self)._save(name, content)
+        except FileExistsError:
+            return name
+
+    def references(self, name):
+        """
+        Counts the rows, across every model that stores files here, that refer to the file.
+        """
+        count = 0
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage):
+                    count += model._default_manager.filter(**{field.name: name}).count()
+        return count
+
+    def delete(self, name):
+        # Counted under the lock, so that no save can start reusing the file between the count and the unlink
+        with transaction.atomic():
+            lock_file(name)
+            if self.references(name) == 0:
+                super(ContentAddressedStorage, self).delete(name)
+
+
+content_storage = ContentAddressedStorage()
+
+
+def store_file(path):
+    """
+    Copies a file on disk into content storage, unless identical contents are already there, and returns its name.
+    The copy is renamed into place once it's complete, so an interrupted copy never leaves a partial blob behind.
+    """
+    name = content_name(hash_file(path), os.path.basename(path))
+    destination = content_storage.path(name)
+    if not os.path.exists(destination):
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(destination), suffix='.part')
+        os.close(fd)
+        try:
+            shutil.copyfile(path, temporary_path)
+            os.chmod(temporary_path, 0o644)
+            os.replace(temporary_path, destination)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+    return name
+
+
+def keep_files(files):
+    """
+    Holds shared locks on stored files, given as a dict of their names to the paths they were copied from, until the
+    end of the current transaction, and copies back any that a delete has removed since. For files that were stored
+    outside of a transaction, e.g. by import_library's workers, before the rows that refer to them are inserted.
+    """
+    if not files:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock_shared(key) FROM unnest(%s::bigint[]) AS key',
+                       [[lock_key(name) for name in files]])
+    for name, path in files.items():
+        if not content_storage.exists(name):
+            store_file(path)
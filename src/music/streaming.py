@@ -0,0 +1,107 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """
+    Returns the (start, end) byte offsets, inclusive, of a single "Range: bytes=..." header.
+    Returns None if the whole file should be sent instead (no header, or several ranges) and
+    raises ValueError if the range can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # "bytes=-500" is the last 500 bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError("Unsatisfiable range.")
+    return start, end
+
+
+def read_range(path, start, end):
+    """
+    Yields the bytes from start to end, inclusive, without reading the whole file into memory.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, field_file):
+    """
+    Serves a stored file with ETag, If-None-Match and Range support.
+    In production the transfer is handed to nginx with X-Accel-Redirect, so that the worker is freed straight away;
+    otherwise Django streams the requested bytes itself.
+    """
+    path = field_file.path
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404("File not found.")
+    etag = quote_etag('%x-%x' % (int(stat.st_mtime), stat.st_size))
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        return response
+
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if settings.MEDIA_ACCEL_REDIRECT_URL:
+        # nginx handles Range and If-None-Match itself for internal locations
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_URL + field_file.name
+    else:
+        response = stream_range(request, path, stat.st_size, etag, content_type)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+
+def stream_range(request, path, size, etag, content_type):
+    """
+    Streams either the whole file or the single range asked for, as a 200 or 206 response.
+    """
+    # If-Range: only honour the range if the client's copy is still current
+    if_range = request.META.get('HTTP_IF_RANGE')
+    byte_range = None
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+
+    if byte_range is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+
+    response = StreamingHttpResponse(read_range(path, start, end), status=status, content_type=content_type)
+    response['Content-Length'] = str(end - start + 1)
+    if status == 206:
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    return response
@@ -0,0 +1,312 @@
+{% load l10n %}
+/**
+ * Keeps songs that have been played, and favourites, in Cache Storage, so that playing them again takes no
+ * download. Served by views.service_worker, which fills in the URLs and the size budget.
+ *
+ * Stream URLs include a version of the song's file (see models.stream_url), so a song whose file is replaced
+ * is downloaded again rather than played from here. Editing or deleting a song also drops its copies straight
+ * away, and syncing with the server drops those of songs changed elsewhere.
+ */
+const CACHE_NAME = "viberr-audio-v1";
+// Size, favourite flag and last use of every cached song, stored in the cache itself
+const INDEX_URL = "/offline-index.json";
+const CACHE_BYTES = {{ cache_bytes|unlocalize }};
+const SYNC_URL = "{% url 'music:offline-sync' %}";
+const LOGOUT_URL = "{% url 'music:logout' %}";
+// Syncing costs a request, so happens at most this often
+const SYNC_INTERVAL = 10 * 60 * 1000;
+
+/**
+ * Turn a URL reversed with placeholder IDs into a pattern that matches any IDs, capturing the song's.
+ * @param url           Reversed URL (string)
+ * @param songId        Placeholder for the song ID (number)
+ * @param otherIds      Placeholders for any other IDs (array)
+ */
+function urlPattern(url, songId, otherIds) {
+    let pattern = url.replace(/[.*+?^${}()|[\]\\]/g, "\\$&").replace("/" + songId + "/", "/(\\d+)/");
+    otherIds.forEach(function (id) {
+        pattern = pattern.replace("/" + id + "/", "/\\d+/");
+    });
+    return new RegExp("^" + pattern + "$");
+}
+
+const STREAM_PATTERN = urlPattern("{% url 'music:song-stream' 1 %}", 1, []);
+// Song pages that change or delete a song when posted to
+const CHANGE_PATTERNS = [
+    urlPattern("{% url 'music:song-update' 1 2 %}", 2, [1]),
+    urlPattern("{% url 'music:song-delete' 1 %}", 1, [])
+];
+
+let lastSync = 0;
+// Changes to the index are made one at a time
+let indexQueue = Promise.resolve();
+
+self.addEventListener("install", function () {
+    self.skipWaiting();
+});
+
+self.addEventListener("activate", function (event) {
+    event.waitUntil(caches.keys().then(function (names) {
+        return Promise.all(names.filter(function (name) {
+            return name.startsWith("viberr-audio-") && name !== CACHE_NAME;
+        }).map(function (name) {
+            return caches.delete(name);
+        }));
+    }).then(function () {
+        return self.clients.claim();
+    }));
+});
+
+self.addEventListener("fetch", function (event) {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) {
+        return;
+    }
+    if (url.pathname === LOGOUT_URL) {
+        // Someone else may use the browser next
+        event.waitUntil(caches.delete(CACHE_NAME));
+        return;
+    }
+    if (request.method === "POST") {
+        CHANGE_PATTERNS.forEach(function (pattern) {
+            const match = url.pathname.match(pattern);
+            if (match) {
+                event.waitUntil(forgetSong(match[1]));
+            }
+        });
+        return;
+    }
+    const match = request.method === "GET" && url.pathname.match(STREAM_PATTERN);
+    if (match && url.searchParams.has("v")) {
+        event.respondWith(playSong(event, request));
+    }
+});
+
+self.addEventListener("message", function (event) {
+    if (event.data && event.data.type === "sync" && Date.now() - lastSync > SYNC_INTERVAL) {
+        lastSync = Date.now();
+        event.waitUntil(sync(event.data.csrfToken).catch(function () {
+            lastSync = 0;
+        }));
+    }
+});
+
+/**
+ * Run a change to the index once every earlier change is done, and save the index afterwards.
+ * @param change    Function of the index, an object of {size, favourite, used} by URL (function)
+ */
+function updateIndex(change) {
+    const result = indexQueue.then(function () {
+        return caches.open(CACHE_NAME);
+    }).then(function (cache) {
+        return cache.match(INDEX_URL).then(function (response) {
+            return response ? response.json() : {};
+        }).then(function (index) {
+            return Promise.resolve(change(index, cache)).then(function (value) {
+                return cache.put(INDEX_URL, new Response(JSON.stringify(index), {
+                    headers: {"Content-Type": "application/json"}
+                })).then(function () {
+                    return value;
+                });
+            });
+        });
+    });
+    indexQueue = result.catch(function () {});
+    return result;
+}
+
+/**
+ * Serve a song from the cache, including just the range asked for, or else from the server, keeping a copy.
+ * @param event     Fetch event (FetchEvent)
+ * @param request   Request for the song (Request)
+ */
+function playSong(event, request) {
+    const range = request.headers.get("Range");
+    return caches.open(CACHE_NAME).then(function (cache) {
+        return cache.match(request.url, {ignoreVary: true});
+    }).then(function (cached) {
+        if (cached) {
+            event.waitUntil(updateIndex(function (index) {
+                if (index[request.url]) {
+                    index[request.url].used = Date.now();
+                }
+            }));
+            return rangeResponse(cached, range);
+        }
+        // Players ask for "bytes=0-" to start with. The whole file answers that and can be kept; later ranges,
+        // e.g. from seeking, go to the server as they are.
+        if (range && !/^bytes=0-$/.test(range)) {
+            return fetch(request);
+        }
+        return fetch(request.url, {credentials: "same-origin"}).then(function (response) {
+            if (response.status === 200) {
+                event.waitUntil(keepSong(request.url, response.clone(), false));
+            }
+            return response;
+        });
+    });
+}
+
+/**
+ * Build the response to a range request from a cached copy of the whole song.
+ * @param cached    Cached response (Response)
+ * @param range     Range header, if any (string)
+ */
+function rangeResponse(cached, range) {
+    const match = range && range.match(/^bytes=(\d*)-(\d*)$/);
+    if (!match || (!match[1] && !match[2])) {
+        return cached;
+    }
+    return cached.blob().then(function (blob) {
+        const size = blob.size;
+        let start, end;
+        if (!match[1]) {
+            start = Math.max(size - Number(match[2]), 0);
+            end = size - 1;
+        } else {
+            start = Number(match[1]);
+            end = match[2] ? Math.min(Number(match[2]), size - 1) : size - 1;
+        }
+        if (start > end || start >= size) {
+            return new Response(null, {status: 416, headers: {"Content-Range": "bytes */" + size}});
+        }
+        return new Response(blob.slice(start, end + 1), {
+            status: 206,
+            headers: {
+                "Content-Type": cached.headers.get("Content-Type") || "application/octet-stream",
+                "Content-Length": String(end - start + 1),
+                "Content-Range": "bytes " + start + "-" + end + "/" + size,
+                "Accept-Ranges": "bytes"
+            }
+        });
+    });
+}
+
+/**
+ * Keep a downloaded song, then drop the least recently used songs until the cache fits its budget again,
+ * songs that aren't favourites first. Returns whether it was kept.
+ * @param url           Stream URL (string)
+ * @param response      Whole song (Response)
+ * @param favourite     Whether the song is a favourite (boolean)
+ */
+function keepSong(url, response, favourite) {
+    const size = Number(response.headers.get("Content-Length"));
+    if (!size || size > CACHE_BYTES) {
+        return Promise.resolve(false);
+    }
+    return updateIndex(function (index, cache) {
+        return cache.put(url, response).then(function () {
+            index[url] = {size: size, favourite: favourite || Boolean(index[url] && index[url].favourite),
+                          used: Date.now()};
+            const urls = Object.keys(index).sort(function (a, b) {
+                return (index[a].favourite - index[b].favourite) || (index[a].used - index[b].used);
+            });
+            let total = urls.reduce(function (sum, key) {
+                return sum + index[key].size;
+            }, 0);
+            const evicted = [];
+            while (total > CACHE_BYTES && urls.length) {
+                const key = urls.shift();
+                total -= index[key].size;
+                evicted.push(key);
+                delete index[key];
+            }
+            return Promise.all(evicted.map(function (key) {
+                return cache.delete(key);
+            })).then(function () {
+                return Boolean(index[url]);
+            });
+        });
+    });
+}
+
+/**
+ * Drop every cached copy of a song, whatever its version.
+ * @param songId    ID of the song (string)
+ */
+function forgetSong(songId) {
+    return updateIndex(function (index, cache) {
+        const urls = Object.keys(index).filter(function (url) {
+            const match = new URL(url).pathname.match(STREAM_PATTERN);
+            return match && match[1] === songId;
+        });
+        urls.forEach(function (url) {
+            delete index[url];
+        });
+        return Promise.all(urls.map(function (url) {
+            return cache.delete(url);
+        }));
+    });
+}
+
+/**
+ * Ask the server which cached songs are out of date and drop them, then download favourites that aren't
+ * cached yet, as long as they fit in the budget alongside the favourites already cached.
+ * @param csrfToken     Token for posting to the server, from the page (string)
+ */
+function sync(csrfToken) {
+    return caches.open(CACHE_NAME).then(function (cache) {
+        return cache.match(INDEX_URL);
+    }).then(function (response) {
+        return response ? response.json() : {};
+    }).then(function (index) {
+        return fetch(SYNC_URL, {
+            method: "POST",
+            credentials: "same-origin",
+            headers: {"Content-Type": "application/json", "X-CSRFToken": csrfToken},
+            body: JSON.stringify({cached: Object.keys(index)})
+        });
+    }).then(function (response) {
+        if (!response.ok) {
+            throw new Error(response.statusText);
+        }
+        return response.json();
+    }).then(function (result) {
+        const favourites = new Set(result.favourites.map(function (url) {
+            return new URL(url, self.location.origin).href;
+        }));
+        return updateIndex(function (index, cache) {
+            result.stale.forEach(function (url) {
+                delete index[url];
+            });
+            Object.keys(index).forEach(function (url) {
+                index[url].favourite = favourites.has(url);
+            });
+            return Promise.all(result.stale.map(function (url) {
+                return cache.delete(url);
+            })).then(function () {
+                return index;
+            });
+        }).then(function (index) {
+            if (self.navigator.connection && self.navigator.connection.saveData) {
+                return;
+            }
+            return precache(Array.from(favourites).filter(function (url) {
+                return !index[url];
+            }), Object.keys(index).reduce(function (sum, url) {
+                return sum + (index[url].favourite ? index[url].size : 0);
+            }, 0));
+        });
+    });
+}
+
+/**
+ * Download favourites one at a time, in order, while they fit in the budget.
+ * @param urls      Stream URLs of favourites to keep (array)
+ * @param total     Bytes of favourites already kept (number)
+ */
+function precache(urls, total) {
+    if (!urls.length) {
+        return Promise.resolve();
+    }
+    return fetch(urls[0], {credentials: "same-origin"}).then(function (response) {
+        const size = Number(response.headers.get("Content-Length"));
+        if (response.status !== 200 || !size || total + size > CACHE_BYTES) {
+            return;
+        }
+        return keepSong(urls[0], response, true).then(function () {
+            return precache(urls.slice(1), total + size);
+        });
+    });
+}
@@ -0,0 +1,46 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from music.artwork import SIZES, thumbnail_name
+
+register = template.Library()
+
+
+def pick_size(width):
+    """
+    Returns the smallest thumbnail size at least width pixels wide, or the largest there is.
+    """
+    return next((size for size in SIZES if size >= width), SIZES[-1])
+
+
+def srcset(storage, name, size, extension):
+    """
+    Lists the thumbnail for normal screens and the one for high density (2x) screens.
+    """
+    return '%s 1x, %s 2x' % (
+        storage.url(thumbnail_name(name, pick_size(size), extension)),
+        storage.url(thumbnail_name(name, pick_size(size * 2), extension)),
+    )
+
+
+@register.simple_tag
+def artwork(album, size, **attrs):
+    """
+    Renders the album's logo, to be shown size pixels wide, as a <picture> of the WebP and JPEG thumbnails
+    that suit the screen. Extra arguments become attributes of the <img>, e.g. {% artwork album 40 alt="Logo" %}.
+    Until its thumbnails have been made, the original logo is used.
+    """
+    if not album.logo:
+        return ''
+    if not album.has_thumbnails:
+        return format_html('<img src="{}"{}>', album.logo.url, flatatt(attrs))
+
+    storage, name = album.logo.storage, album.logo.name
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}"><img src="{}" srcset="{}"{}></picture>',
+        srcset(storage, name, size, 'webp'),
+        storage.url(thumbnail_name(name, pick_size(size), 'jpg')),
+        srcset(storage, name, size, 'jpg'),
+        flatatt(attrs),
+    )
@@ -0,0 +1,37 @@
+from django import template
+
+from music.caching import get_or_render
+
+register = template.Library()
+
+
+class LibraryCacheNode(template.Node):
+
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        request = context.get('request')
+        if request is None or not request.user.is_authenticated:
+            return self.nodelist.render(context)
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        return get_or_render(request, self.name.resolve(context), lambda: self.nodelist.render(context), vary_on)
+
+
+@register.tag
+def librarycache(parser, token):
+    """
+    Caches the enclosed part of a page until the user's library changes (see caching.py), e.g.
+
+        {% librarycache "album-grid" %} ... {% endlibrarycache %}
+
+    Any further arguments are added to the key. Querysets only used inside the block aren't evaluated on a hit.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError("'%r' tag requires a fragment name." % bits[0])
+    nodelist = parser.parse(('endlibrarycache',))
+    parser.delete_first_token()
+    return LibraryCacheNode(nodelist, parser.compile_filter(bits[1]), [parser.compile_filter(bit) for bit in bits[2:]])
@@ -1,9 +1,61 @@
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import wave
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image
+
+from . import urls as music_urls
+from .artwork import SIZES, thumbnail_name
+from .asgi import StreamingASGIHandler
+from .audio import read_metadata, sniff
+from .auth import CACHED_AUTH_SETTINGS
+from .benchmarks import ROUTES, Size, run_benchmarks
+from .caching import cache_stats
+from .checks import check_static_references
+from .ingest import extract_metadata, generate_thumbnails, import_file, safe_read_metadata
+from .middleware import repeated_queries
+from .profiling import profile_names
+from .models import POSITION_GAP, Album, Playlist, PlaylistEntry, Song, Upload
+from .routers import REPLICA, is_pinned, read_from_replica, replica_reads
+from .search import search
+from .staticfiles import unhashed_assets
+from .storage import content_name, content_storage, store_file
+from .uploads import open_partial
+from .views import SongView
+
 
-from .models import Album, Song
+def wav_bytes(seconds=1, rate=8000, channels=2):
+    """
+    Returns a silent 16 bit WAV file.
+    """
+    f = BytesIO()
+    with wave.open(f, 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\0" * int(rate * seconds) * channels * 2)
+    return f.getvalue()
 
 
 class TestcaseUserBackend(object):
@@ -38,7 +90,68 @@ class AlbumModelTests(TestCase):
             i += 1
         self.assertEqual(album.get_number_of_songs(), 3)
 
+    def test_song_count_follows_moves_and_deletes(self):
+        """
+        The stored song count is updated when songs are moved between albums, deleted or bulk created.
+        """
+        user = User.objects.create(username="test")
+        album = Album.objects.create(title="1", user=user)
+        album1 = Album.objects.create(title="2", user=user)
+        song = Song.objects.create(album=album, title="Song")
+
+        song = Song.objects.get(pk=song.pk)
+        song.album = album1
+        song.save()
+        album.refresh_from_db()
+        album1.refresh_from_db()
+        self.assertEqual((album.song_count, album1.song_count), (0, 1))
+
+        Song.objects.bulk_create([Song(album=album, title=str(i)) for i in range(2)])
+        Song.objects.filter(album=album).update(album=album1)
+        album.refresh_from_db()
+        album1.refresh_from_db()
+        self.assertEqual((album.song_count, album1.song_count), (0, 3))
+
+        Song.objects.filter(title="0").delete()
+        song.delete()
+        album1.refresh_from_db()
+        self.assertEqual(album1.get_number_of_songs(), 1)
+
+    def test_album_delete_queries_independent_of_songs(self):
+        """
+        Deleting an album doesn't update it for each of its songs, and other albums' songs are still uncounted.
+        """
+        user = User.objects.create(username="test")
+        counts = []
+        for songs in [1, 5]:
+            album = Album.objects.create(title=str(songs), user=user)
+            Song.objects.bulk_create([Song(album=album, title=str(i)) for i in range(songs)])
+            with CaptureQueriesContext(connection) as queries:
+                album.delete()
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+        album = Album.objects.create(title="Kept", user=user)
+        Song.objects.bulk_create([Song(album=album, title=str(i)) for i in range(2)])
+        Song.objects.filter(title="0").delete()
+        album.refresh_from_db()
+        self.assertEqual(album.song_count, 1)
+
+    def test_recount_songs_command(self):
+        """
+        The recount_songs command repairs albums whose stored count has drifted.
+        """
+        user = User.objects.create(username="test")
+        album = Album.objects.create(title="1", user=user)
+        Song.objects.create(album=album, title="Song")
+        Album.objects.update(song_count=5)
+
+        call_command('recount_songs', stdout=StringIO())
+        album.refresh_from_db()
+        self.assertEqual(album.song_count, 1)
+
 
+@override_settings(**CACHED_AUTH_SETTINGS)
 class IndexViewTests(TestCase):
 
     def test_get_queryset(self):
@@ -64,6 +177,21 @@ class IndexViewTests(TestCase):
             ['<Album: 0 - >', '<Album: 2 - >', '<Album: 1 - >']
         )
 
+    def test_song_counts_query_count(self):
+        """
+        Rendering the song count of every album card does not add a query per album.
+        """
+        user = User.objects.create(username="test")
+        for i in range(5):
+            album = Album.objects.create(title=i, user=user, logo="test.png")
+            Song.objects.create(album=album, title="Song")
+
+        self.client.force_login(user)
+        # The user, who isn't cached yet after logging in, and albums. The session is.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('music:index'))
+        self.assertContains(response, "Songs: 1", count=5)
+
     def test_logged_out(self):
         """
         If the user is not logged in, they are redirected to the "music:login" page.
@@ -139,6 +267,53 @@ class DetailViewTests(TestCase):
         )
 
 
+@override_settings(**CACHED_AUTH_SETTINGS)
+class OwnershipTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="user")
+        user1 = User.objects.create(username="user1")
+        self.album = Album.objects.create(title="1", artist="user1", user=user1, logo="test.png")
+        self.song = Song.objects.create(album=self.album, title="Song", audio_file="test.mp3")
+        self.client.force_login(self.user)
+
+    def test_other_users_album_update_and_delete(self):
+        """
+        Another user's album can't be edited or deleted, and it is still there afterwards.
+        """
+        response = self.client.get(reverse('music:album-update', kwargs={'pk': self.album.pk}))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(reverse('music:album-delete', kwargs={'pk': self.album.pk}))
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(Album.objects.filter(pk=self.album.pk).exists())
+
+    def test_other_users_song_update_and_delete(self):
+        """
+        Another user's song can't be edited, deleted or added to.
+        """
+        response = self.client.get(
+            reverse('music:song-update', kwargs={'album_id': self.album.pk, 'pk': self.song.pk})
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(reverse('music:song-delete', kwargs={'pk': self.song.pk}))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(
+            reverse('music:song-add', kwargs={'album_id': self.album.pk}),
+            {'title': "Song", 'audio_file': SimpleUploadedFile("test.mp3", b"ID3")}
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Song.objects.count(), 1)
+
+    def test_detail_query_count(self):
+        """
+        The album detail page checks ownership in the same query that loads the album.
+        """
+        album = Album.objects.create(title="2", artist="user", user=self.user, logo="test.png")
+        # User, album, other albums by the artist and songs. The session is cached.
+        with self.assertNumQueries(4):
+            self.client.get(reverse('music:detail', kwargs={'pk': album.pk}))
+
+
 class AlbumCreateTests(TestCase):
 
     def test_form_valid_with_invalid_file_type(self):
@@ -220,3 +395,1239 @@ class FavouriteTests(TestCase):
         song = Song.objects.first()
         self.assertEqual(response.status_code, 302)
         self.assertEqual(song.is_favourite, True)
+
+    def test_favourite_json(self):
+        """
+        A POST flips the flag in place and returns the new value, and can't touch another user's album.
+        """
+        user = User.objects.create(username="user")
+        album = Album.objects.create(title="1", artist="user", logo="test.png", user=user)
+        url = reverse('music:album-favourite', kwargs={'album_id': album.id})
+        self.client.force_login(user)
+
+        self.assertEqual(self.client.post(url).json(), {'id': album.id, 'is_favourite': True})
+        self.assertEqual(self.client.post(url).json(), {'id': album.id, 'is_favourite': False})
+
+        self.client.force_login(User.objects.create(username="user1"))
+        self.assertEqual(self.client.post(url).status_code, 404)
+
+    def test_favourite_many(self):
+        """
+        Many songs are favourited with one request, leaving out any that belong to someone else.
+        """
+        user = User.objects.create(username="user")
+        album = Album.objects.create(title="1", artist="user", logo="test.png", user=user)
+        other_album = Album.objects.create(title="2", artist="user1", logo="test.png",
+                                           user=User.objects.create(username="user1"))
+        songs = [Song.objects.create(album=album, title=str(i)) for i in range(3)]
+        other_song = Song.objects.create(album=other_album, title="3")
+        self.client.force_login(user)
+
+        response = self.client.post(reverse('music:favourite-many'), {
+            'type': "song", 'is_favourite': "true", 'id': [songs[0].pk, songs[1].pk, other_song.pk]
+        })
+        self.assertEqual(response.json(), {'updated': 2, 'is_favourite': True})
+        self.assertEqual(list(Song.objects.filter(is_favourite=True).order_by('pk')), songs[:2])
+
+        response = self.client.post(reverse('music:favourite-many'), {'type': "artist", 'is_favourite': "true"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(**CACHED_AUTH_SETTINGS)
+class SongViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="user")
+        for i in range(3):
+            album = Album.objects.create(title=i, artist="Artist", user=self.user, logo="test.png")
+            for j in range(4):
+                Song.objects.create(
+                    album=album,
+                    title="Song " + str(i) + str(j),
+                    audio_file="test.mp3",
+                    is_favourite=(j == 0)
+                )
+
+    def test_get_queryset_query_count(self):
+        """
+        The songs page uses the same number of queries no matter how many albums the user has.
+        """
+        self.client.force_login(self.user)
+        # User and the joined song/album query. The session is cached.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('music:songs'))
+        self.assertEqual(len(response.context['all_songs']), 12)
+
+    def test_get_queryset_excludes_other_users_songs(self):
+        """
+        get_queryset() only returns songs from the user's own albums.
+        """
+        user1 = User.objects.create(username="user1")
+        album = Album.objects.create(title="Other", artist="Other", user=user1, logo="test.png")
+        Song.objects.create(album=album, title="Tightrope", audio_file="test.mp3")
+        Song.objects.create(album=Album.objects.first(), title="Tightrope", audio_file="test.mp3")
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('music:songs'), {'s': "tightrope"})
+        self.assertQuerysetEqual(response.context['all_songs'], ['<Song: Tightrope - Artist>'])
+
+    def test_keyset_pagination(self):
+        """
+        Following the "next" cursors visits every song once, favourites first and then by ID.
+        """
+        self.client.force_login(self.user)
+        expected = list(Song.objects.order_by('-is_favourite', 'id'))
+
+        songs = []
+        cursor = None
+        with mock.patch.object(SongView, 'paginate_by', 5):
+            while True:
+                params = {'cursor': cursor} if cursor else {}
+                response = self.client.get(reverse('music:songs'), params)
+                page = response.context['page_obj']
+                songs.extend(page.object_list)
+                if not page.has_next():
+                    break
+                cursor = page.next_cursor
+        self.assertEqual(songs, expected)
+
+    def test_invalid_cursor(self):
+        """
+        A tampered cursor returns a 404 rather than an error.
+        """
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('music:songs'), {'cursor': "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="user")
+        self.album = Album.objects.create(
+            title="Night Visions", artist="Imagine Dragons", genre="Rock", user=self.user, logo="test.png"
+        )
+        Album.objects.create(title="Talking is Hard", artist="Walk the Moon", genre="Pop", user=self.user, logo="test.png")
+        Song.objects.create(album=self.album, title="Radioactive", audio_file="test.mp3")
+        self.client.force_login(self.user)
+
+    def search_albums(self, query):
+        response = self.client.get(reverse('music:album-search'), {'q': query})
+        return [album.title for album in response.context['all_albums']]
+
+    def test_search_pagination_with_tied_ranks(self):
+        """
+        Following the "next" cursors of a search visits every match once, even when many share a rank.
+        """
+        Song.objects.bulk_create(
+            Song(album=self.album, title="Radio" if i % 3 else "Radio Gaga", audio_file="test.mp3") for i in range(12))
+        Song.objects.update_search_vectors()
+        expected = list(search(Song.objects.all(), "radio").order_by('-rank', 'id'))
+
+        songs, params = [], {'s': "radio"}
+        with mock.patch.object(SongView, 'paginate_by', 5):
+            while True:
+                page = self.client.get(reverse('music:songs'), params).context['page_obj']
+                songs.extend(page.object_list)
+                if not page.has_next():
+                    break
+                params['cursor'] = page.next_cursor
+        self.assertEqual(len(expected), 13)
+        self.assertEqual(songs, expected)
+
+    def test_search_albums_by_artist_genre_and_song(self):
+        """
+        Albums can be found by prefixes of their artist, genre or song titles, not just their title.
+        """
+        self.assertEqual(self.search_albums("imag drag"), ["Night Visions"])
+        self.assertEqual(self.search_albums("pop"), ["Talking is Hard"])
+        self.assertEqual(self.search_albums("radioactive"), ["Night Visions"])
+
+    def test_search_albums_with_typo(self):
+        """
+        A title with a typo in it still finds the album.
+        """
+        self.assertEqual(self.search_albums("Nigth Visions"), ["Night Visions"])
+
+    def test_search_vectors_follow_changes(self):
+        """
+        Renaming a song or an album's artist is reflected in the search results.
+        """
+        song = Song.objects.get(title="Radioactive")
+        song.title = "Demons"
+        song.save()
+        self.album.artist = "Dragons"
+        self.album.save()
+
+        self.assertEqual(self.search_albums("demons"), ["Night Visions"])
+        self.assertEqual(self.search_albums("radioactive"), [])
+
+        response = self.client.get(reverse('music:songs'), {'s': "dragons"})
+        self.assertQuerysetEqual(response.context['all_songs'], ['<Song: Demons - Dragons>'])
+
+
+class StreamSongTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        with open(os.path.join(self.media_root, "test.mp3"), "wb") as f:
+            f.write(bytes(range(100)))
+
+        self.user = User.objects.create(username="user")
+        album = Album.objects.create(title="1", artist="user", user=self.user, logo="test.png")
+        self.song = Song.objects.create(album=album, title="Song", audio_file="test.mp3")
+        self.url = reverse('music:song-stream', kwargs={'song_id': self.song.pk})
+        self.client.force_login(self.user)
+
+    def get(self, **headers):
+        with self.settings(MEDIA_ROOT=self.media_root, MEDIA_ACCEL_REDIRECT_URL=None):
+            response = self.client.get(self.url, **headers)
+            response.content_bytes = b"".join(response.streaming_content) if response.streaming else response.content
+        return response
+
+    def test_full_file(self):
+        """
+        Without a Range header the whole file is sent.
+        """
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_bytes, bytes(range(100)))
+        self.assertEqual(response['Accept-Ranges'], "bytes")
+
+    def test_range(self):
+        """
+        A byte range is answered with 206 and only those bytes, including suffix ranges.
+        """
+        response = self.get(HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content_bytes, bytes(range(10, 20)))
+        self.assertEqual(response['Content-Range'], "bytes 10-19/100")
+
+        response = self.get(HTTP_RANGE="bytes=-5")
+        self.assertEqual(response.content_bytes, bytes(range(95, 100)))
+
+        response = self.get(HTTP_RANGE="bytes=200-")
+        self.assertEqual(response.status_code, 416)
+
+    def test_if_none_match(self):
+        """
+        A matching ETag is answered with 304 and no body.
+        """
+        etag = self.get()['ETag']
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_accel_redirect(self):
+        """
+        When nginx is in front, the transfer is handed over with X-Accel-Redirect.
+        """
+        with self.settings(MEDIA_ROOT=self.media_root, MEDIA_ACCEL_REDIRECT_URL="/protected-media/"):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], "/protected-media/test.mp3")
+        self.assertEqual(response.content, b"")
+
+    def test_other_users_song(self):
+        """
+        Another user's song can't be streamed.
+        """
+        self.client.force_login(User.objects.create(username="user1"))
+        self.assertEqual(self.get().status_code, 404)
+
+
+class ChunkedUploadTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root, CHUNKED_UPLOAD_ROOT=os.path.join(media_root, 'partial'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create(username="user")
+        self.album = Album.objects.create(title="1", artist="user", user=self.user, logo="test.png")
+        self.client.force_login(self.user)
+        self.data = wav_bytes(seconds=0.1)
+
+    def start(self, filename="song.wav"):
+        return self.client.post(
+            reverse('music:upload-start', kwargs={'album_id': self.album.pk}),
+            {'title': "Song", 'filename': filename, 'size': len(self.data)}
+        )
+
+    def put(self, url, offset, data, **headers):
+        return self.client.put(url, data, content_type="application/octet-stream", HTTP_UPLOAD_OFFSET=str(offset), **headers)
+
+    def test_invalid_file_type(self):
+        """
+        The file type is rejected before any of the file is sent.
+        """
+        response = self.start(filename="song.exe")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Upload.objects.exists())
+
+    def test_upload_resume_and_finish(self):
+        """
+        Chunks are appended at the right offset, a wrong offset reports where to resume and finishing creates the song.
+        """
+        upload = self.start().json()
+        self.assertEqual(self.put(upload['url'], 0, self.data[:600]).json()['offset'], 600)
+
+        # Resending the first chunk, e.g. after a dropped connection, says where to carry on from
+        response = self.put(upload['url'], 0, self.data[:600])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get(upload['url']).json()['offset'], 600)
+
+        checksum = "sha256 " + base64.b64encode(hashlib.sha256(self.data[600:]).digest()).decode()
+        self.put(upload['url'], 600, self.data[600:], HTTP_UPLOAD_CHECKSUM=checksum)
+        response = self.client.post(
+            reverse('music:upload-finish', kwargs={'upload_id': upload['id']}),
+            {'sha256': hashlib.sha256(self.data).hexdigest()}
+        )
+        self.assertEqual(response.status_code, 201)
+
+        song = Song.objects.get()
+        self.assertEqual(song.audio_file.read(), self.data)
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(Album.objects.get().song_count, 1)
+
+    def test_chunk_checksum_mismatch(self):
+        """
+        A chunk that doesn't match its checksum is discarded.
+        """
+        upload = self.start().json()
+        checksum = "sha256 " + base64.b64encode(hashlib.sha256(b"other").digest()).decode()
+        response = self.put(upload['url'], 0, self.data, HTTP_UPLOAD_CHECKSUM=checksum)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Upload.objects.get().offset, 0)
+
+    def test_chunk_while_another_is_written(self):
+        """
+        A chunk sent while another request holds the partial file is refused without touching the file.
+        """
+        upload = self.start().json()
+        with open_partial(Upload.objects.get()):
+            response = self.put(upload['url'], 0, self.data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Upload.objects.get().offset, 0)
+        self.assertEqual(self.put(upload['url'], 0, self.data).json()['offset'], len(self.data))
+
+    def test_other_users_upload(self):
+        """
+        Another user can't add chunks to an upload.
+        """
+        upload = self.start().json()
+        self.client.force_login(User.objects.create(username="user1"))
+        self.assertEqual(self.put(upload['url'], 0, self.data).status_code, 404)
+
+
+class ContentStorageTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        user = User.objects.create(username="user")
+        self.album = Album.objects.create(title="1", artist="user", user=user, logo="test.png")
+        self.data = bytes(range(256))
+
+    def create_song(self, filename):
+        song = Song(album=self.album, title=filename)
+        song.audio_file.save(filename, ContentFile(self.data), save=False)
+        song.save()
+        return song
+
+    def test_identical_files_are_stored_once(self):
+        """
+        Identical uploads share one file named after its SHA-256, which is only deleted with its last reference.
+        """
+        song = self.create_song("a.MP3")
+        song1 = self.create_song("b.mp3")
+        name = content_name(hashlib.sha256(self.data).hexdigest(), "a.mp3")
+        self.assertEqual(song.audio_file.name, name)
+        self.assertEqual(song1.audio_file.name, name)
+
+        song.delete()
+        content_storage.delete(name)
+        self.assertTrue(content_storage.exists(name))
+        song1.delete()
+        content_storage.delete(name)
+        self.assertFalse(content_storage.exists(name))
+
+    def test_rehash_media_command(self):
+        """
+        rehash_media moves existing files under their content-addressed names and relinks their rows.
+        """
+        for filename in ["a.mp3", "b.mp3"]:
+            with open(content_storage.path(filename), "wb") as f:
+                f.write(self.data)
+            Song.objects.create(album=self.album, title=filename, audio_file=filename)
+
+        call_command('rehash_media', workers=2, stdout=StringIO(), stderr=StringIO())
+
+        name = content_name(hashlib.sha256(self.data).hexdigest(), "a.mp3")
+        self.assertEqual(set(Song.objects.values_list('audio_file', flat=True)), {name})
+        self.assertEqual(content_storage.open(name).read(), self.data)
+        self.assertFalse(content_storage.exists("a.mp3"))
+
+
+class AudioMetadataTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root, INGEST_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create(username="user")
+        self.album = Album.objects.create(title="1", artist="user", user=self.user, logo="test.png")
+        self.client.force_login(self.user)
+
+    def test_sniff(self):
+        """
+        File types are recognised by their first bytes, not their names.
+        """
+        self.assertEqual(sniff(wav_bytes()[:16]), "wav")
+        self.assertEqual(sniff(b"ID3\x04\x00"), "mp3")
+        self.assertEqual(sniff(b"\xff\xfb\x90\x64"), "mp3")
+        self.assertEqual(sniff(b"OggS\x00\x02"), "ogg")
+        self.assertEqual(sniff(b"\x89PNG\r\n\x1a\n"), "png")
+        self.assertIsNone(sniff(b"MZ\x90\x00"))
+
+    def test_read_mp3_metadata(self):
+        """
+        MP3 duration and bitrate come from the frame headers, and tags from the ID3 tag.
+        """
+        frame = b"TIT2" + (6).to_bytes(4, 'big') + b"\x00\x00" + b"\x03Hello"
+        id3 = b"ID3\x03\x00\x00" + bytes([0, 0, 0, len(frame)]) + frame
+        # MPEG 1 layer III, 128kbit/s, 44.1kHz, joint stereo: 417 bytes per frame
+        path = os.path.join(tempfile.mkdtemp(), "song.bin")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(id3 + (b"\xff\xfb\x90\x64" + b"\x00" * 413) * 100)
+
+        metadata = read_metadata(path)
+        self.assertEqual((metadata['sample_rate'], metadata['bitrate'], metadata['channels']), (44100, 128000, 2))
+        self.assertAlmostEqual(metadata['duration'], 417 * 100 * 8 / 128000)
+        self.assertEqual(metadata['tags'], {'title': "Hello"})
+
+    def test_read_truncated_ogg_metadata(self):
+        """
+        An Ogg file whose headers are cut short is reported as unreadable, not with a struct.error.
+        """
+        page = b"OggS\x00\x02" + b"\x00" * 20 + b"\x02" + b"\x0a\x01" + b"\x01vorbis\x00\x00\x00" + b"\x03"
+        path = os.path.join(tempfile.mkdtemp(), "song.ogg")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(page)
+
+        with self.assertRaisesMessage(ValueError, "Truncated OGG file"):
+            read_metadata(path)
+        with self.assertLogs('music.ingest', 'WARNING'):
+            self.assertIsNone(safe_read_metadata(path))
+
+    def test_extract_metadata(self):
+        """
+        The metadata of a song's audio file is stored on the song and shown as its length.
+        """
+        song = Song(album=self.album, title="Song")
+        song.audio_file.save("song.wav", ContentFile(wav_bytes(seconds=65)), save=False)
+        song.save()
+        extract_metadata(song)
+
+        song.refresh_from_db()
+        self.assertEqual((song.sample_rate, song.channels, song.bitrate), (8000, 2, 256000))
+        self.assertEqual(song.get_length(), "1:05")
+
+    def test_extract_metadata_with_nul_characters(self):
+        """
+        NUL characters in tags, which Postgres can't store, are dropped rather than failing to save the metadata.
+        """
+        info = b"INFO" + b"INAM" + (8).to_bytes(4, 'little') + b"One\x00Two\x00"
+        song = Song(album=self.album, title="Song")
+        song.audio_file.save("song.wav", ContentFile(wav_bytes() + b"LIST" + len(info).to_bytes(4, 'little') + info),
+                             save=False)
+        song.save()
+        extract_metadata(song)
+
+        song.refresh_from_db()
+        self.assertEqual(song.tags, {'title': "One Two"})
+
+    def test_song_create_with_renamed_file(self):
+        """
+        A file that isn't audio is rejected, even when it has an audio extension.
+        """
+        response = self.client.post(
+            reverse('music:song-add', kwargs={'album_id': self.album.pk}),
+            {'title': "Song", 'audio_file': SimpleUploadedFile("song.mp3", b"MZ\x90\x00 not audio")},
+            HTTP_REFERER="/"
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Song.objects.exists())
+
+
+class ArtworkTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root, INGEST_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        f = BytesIO()
+        Image.new('RGBA', (1000, 800), (255, 0, 0, 128)).save(f, 'PNG')
+        self.album = Album(title="1", artist="user", user=User.objects.create(username="user"))
+        self.album.logo.save("logo.png", ContentFile(f.getvalue()), save=False)
+        self.album.save()
+
+    def test_generate_thumbnails(self):
+        """
+        Every size is made in WebP and JPEG, keeping the logo's shape, and the album is marked as having them.
+        """
+        generate_thumbnails(self.album)
+
+        self.album.refresh_from_db()
+        self.assertTrue(self.album.has_thumbnails)
+        for size in SIZES:
+            for extension in ["webp", "jpg"]:
+                with Image.open(content_storage.path(thumbnail_name(self.album.logo.name, size, extension))) as image:
+                    self.assertEqual(image.size, (size, size * 4 // 5))
+
+    def test_artwork_tag(self):
+        """
+        The tag falls back to the original logo until the thumbnails are ready, then offers them in a srcset.
+        """
+        template = Template('{% load artwork %}{% artwork album 40 alt="Logo" %}')
+        html = template.render(Context({'album': self.album}))
+        self.assertEqual(html, '<img src="%s" alt="Logo">' % self.album.logo.url)
+
+        generate_thumbnails(self.album)
+        self.album.refresh_from_db()
+        html = template.render(Context({'album': self.album}))
+        self.assertIn('srcset="%s 1x, ' % content_storage.url(thumbnail_name(self.album.logo.name, 40, "webp")), html)
+        self.assertIn('/80.jpg 2x"', html)
+
+
+@override_settings(**CACHED_AUTH_SETTINGS)
+class LibraryCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="user")
+        self.album = Album.objects.create(title="1", artist="user", user=self.user, logo="test.png")
+        Song.objects.create(album=self.album, title="Song", audio_file="test.mp3")
+        self.client.force_login(self.user)
+        # Run the version bumps straight away, as there is no real commit inside a test case
+        patcher = mock.patch('music.caching.transaction.on_commit', lambda function: function())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_song_table_cached(self):
+        """
+        The second view of the songs page is rendered from the cache without querying for the songs.
+        """
+        # User and songs. The session is cached.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('music:songs'))
+        # Nothing, as the user is cached now too
+        with self.assertNumQueries(0):
+            response1 = self.client.get(reverse('music:songs'))
+        self.assertEqual(response.content, response1.content)
+        self.assertEqual(cache_stats(), (1, 1))
+
+    def test_invalidated_by_changes(self):
+        """
+        Favouriting, adding and deleting are shown straight away.
+        """
+        self.client.get(reverse('music:index'))
+        self.client.get(reverse('music:album-favourite', kwargs={'album_id': self.album.pk}), HTTP_REFERER='/')
+        self.assertContains(self.client.get(reverse('music:index')), 'alt="favourite"')
+
+        Song.objects.create(album=self.album, title="Another Song", audio_file="test.mp3")
+        self.assertContains(self.client.get(reverse('music:songs')), "Another Song")
+        Song.objects.filter(title="Another Song").delete()
+        self.assertNotContains(self.client.get(reverse('music:songs')), "Another Song")
+
+    def test_per_user(self):
+        """
+        Users never see each other's cached pages.
+        """
+        self.client.get(reverse('music:songs'))
+        self.client.force_login(User.objects.create(username="user1"))
+        song = Song.objects.get()
+        self.assertNotContains(self.client.get(reverse('music:songs')), reverse('music:song-stream', args=[song.pk]))
+
+
+@override_settings(**CACHED_AUTH_SETTINGS)
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="user")
+        self.album = Album.objects.create(title="1", artist="user", user=self.user, logo="test.png")
+        self.client.force_login(self.user)
+        patcher = mock.patch('music.caching.transaction.on_commit', lambda function: function())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_not_modified(self):
+        """
+        An unchanged page is answered with 304 without querying for its contents, for every library page.
+        """
+        for url in [reverse('music:index'), reverse('music:detail', kwargs={'pk': self.album.pk}), reverse('music:songs')]:
+            response = self.client.get(url)
+            self.assertIn("private", response['Cache-Control'])
+            # The first request cached the user, and the session is cached
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_modified_after_favourite(self):
+        """
+        Favouriting an album changes the ETag of the page it redirects back to.
+        """
+        etag = self.client.get(reverse('music:index'))['ETag']
+        self.client.get(reverse('music:album-favourite', kwargs={'album_id': self.album.pk}), HTTP_REFERER='/')
+        response = self.client.get(reverse('music:index'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ImportLibraryTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root, INGEST_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create(username="user")
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        album = os.path.join(self.directory, "Artist", "Album")
+        os.makedirs(album)
+        for filename, seconds in [("01 - First.wav", 1), ("02 - Second.wav", 2)]:
+            with open(os.path.join(album, filename), "wb") as f:
+                f.write(wav_bytes(seconds))
+        Image.new('RGB', (10, 10)).save(os.path.join(album, "cover.png"))
+        with open(os.path.join(album, "notes.txt"), "w") as f:
+            f.write("notes")
+
+    def test_import(self):
+        """
+        Each directory becomes an album with its cover, and its tracks become songs with their metadata.
+        """
+        call_command('import_library', "user", self.directory, workers=0, batch_size=1, stdout=StringIO())
+
+        album = Album.objects.get(user=self.user)
+        self.assertEqual((album.artist, album.title), ("Artist", "Album"))
+        self.assertTrue(content_storage.exists(album.logo.name))
+        songs = album.song_set.order_by('title')
+        self.assertEqual([(song.title, song.duration) for song in songs], [("First", 1.0), ("Second", 2.0)])
+        self.assertEqual(Album.objects.get().song_count, 2)
+
+    def test_unreadable_metadata(self):
+        """
+        An audio file whose metadata can't be read is still imported, with empty metadata.
+        """
+        with open(os.path.join(self.directory, "Artist", "Album", "03 - Third.ogg"), "wb") as f:
+            f.write(b"OggS\x00\x02" + b"\x00" * 20 + b"\x01" + b"\x08" + b"\x01vorbis\x00")
+        stdout = StringIO()
+        with self.assertLogs('music.ingest', 'WARNING'):
+            call_command('import_library', "user", self.directory, workers=0, stdout=stdout)
+        self.assertIn("Imported 3 song(s) and skipped 0 already imported and 1 other file(s)", stdout.getvalue())
+        song = Song.objects.get(title="Third")
+        self.assertEqual((song.duration, song.tags), (None, {}))
+        self.assertTrue(content_storage.exists(song.audio_file.name))
+
+    def test_unreadable_file(self):
+        """
+        A file that can't be copied into storage is counted as ignored, and the rest are still imported.
+        """
+        def store_readable_file(path):
+            if path.endswith("Second.wav"):
+                raise PermissionError("Permission denied: %r" % path)
+            return store_file(path)
+
+        stdout = StringIO()
+        with mock.patch('music.ingest.store_file', store_readable_file), self.assertLogs('music.ingest', 'WARNING'):
+            call_command('import_library', "user", self.directory, workers=0, stdout=stdout)
+        self.assertIn("Imported 1 song(s) and skipped 0 already imported and 2 other file(s)", stdout.getvalue())
+        self.assertEqual(list(Song.objects.values_list('title', flat=True)), ["First"])
+
+    def test_file_deleted_before_insert(self):
+        """
+        A stored file that a delete removes before its row is inserted, e.g. when the last song sharing it is
+        deleted meanwhile, is copied into storage again.
+        """
+        def import_and_delete(path):
+            kind, name, metadata = import_file(path)
+            if name:
+                os.remove(content_storage.path(name))
+            return kind, name, metadata
+
+        with mock.patch('music.management.commands.import_library.import_file', import_and_delete):
+            call_command('import_library', "user", self.directory, workers=0, stdout=StringIO())
+        album = Album.objects.get(user=self.user)
+        self.assertTrue(content_storage.exists(album.logo.name))
+        self.assertTrue(all(content_storage.exists(song.audio_file.name) for song in album.song_set.all()))
+        self.assertEqual(album.song_set.count(), 2)
+
+    def test_resume(self):
+        """
+        Importing again, as after an interruption, only adds the songs that are missing.
+        """
+        call_command('import_library', "user", self.directory, workers=0, stdout=StringIO())
+        Song.objects.filter(title="Second").delete()
+        call_command('import_library', "user", self.directory, workers=0, stdout=StringIO())
+        self.assertEqual(Album.objects.count(), 1)
+        self.assertEqual(sorted(Song.objects.values_list('title', flat=True)), ["First", "Second"])
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root, INGEST_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create(username="user")
+        self.album = Album.objects.create(title="Album", artist="Artist", user=self.user, logo="test.png")
+        self.data = wav_bytes()
+        for title in ["One", "One", "Two"]:
+            song = Song(album=self.album, title=title)
+            song.audio_file.save("song.wav", ContentFile(self.data), save=False)
+            song.save()
+        self.client.force_login(self.user)
+
+    def read_zip(self, response):
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], "application/zip")
+        return zipfile.ZipFile(BytesIO(b"".join(response.streaming_content)))
+
+    def test_album_export(self):
+        """
+        Songs are stored uncompressed under unique names, next to a manifest of the album.
+        """
+        archive = self.read_zip(self.client.get(reverse('music:album-export', kwargs={'album_id': self.album.pk})))
+        self.assertEqual(archive.namelist(), [
+            "manifest.csv", "Artist_-_Album/One.wav", "Artist_-_Album/One (2).wav", "Artist_-_Album/Two.wav"])
+        self.assertEqual(archive.read("Artist_-_Album/Two.wav"), self.data)
+        self.assertEqual(archive.getinfo("Artist_-_Album/Two.wav").compress_type, zipfile.ZIP_STORED)
+        manifest = archive.read("manifest.csv").decode().splitlines()
+        self.assertEqual(manifest[1], "Artist_-_Album/One.wav,Artist,Album,,False,One,False,")
+
+    def test_library_export(self):
+        Album.objects.create(title="Other", artist="Artist", user=User.objects.create(username="user1"), logo="test.png")
+        archive = self.read_zip(self.client.get(reverse('music:library-export')))
+        self.assertEqual(len(archive.namelist()), 4)
+
+    def test_other_users_album(self):
+        self.client.force_login(User.objects.create(username="user1"))
+        response = self.client.get(reverse('music:album-export', kwargs={'album_id': self.album.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_asgi_export(self):
+        """
+        Under ASGI, an export is zipped on a thread rather than on the event loop, which sends it.
+        """
+        response = self.client.get(reverse('music:album-export', kwargs={'album_id': self.album.pk}))
+        parts, zipping_threads, messages = response.streaming_content, set(), []
+
+        def zip_parts():
+            for part in parts:
+                zipping_threads.add(threading.get_ident())
+                yield part
+
+        async def send(message):
+            messages.append((threading.get_ident(), message))
+
+        response.streaming_content = zip_parts()
+        async_to_sync(StreamingASGIHandler().send_response)(response, send)
+        self.assertEqual(messages[0][1]['status'], 200)
+        self.assertNotIn(messages[0][0], zipping_threads)
+        archive = zipfile.ZipFile(BytesIO(b"".join(message.get('body', b"") for _, message in messages[1:])))
+        self.assertEqual(archive.read("Artist_-_Album/Two.wav"), self.data)
+
+
+@override_settings(**CACHED_AUTH_SETTINGS)
+class ReplicaRouterTests(TestCase):
+    # Only when a replica is configured, e.g. with POSTGRES_REPLICA_HOST pointing at the primary
+    databases = set(settings.DATABASES)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="user")
+        self.album = Album.objects.create(title="1", artist="user", user=self.user, logo="test.png")
+        patcher = mock.patch('music.caching.transaction.on_commit', lambda function: function())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_routing(self):
+        """
+        Reads go to the replica only while replica reads are on, and writes always go to the primary.
+        """
+        self.assertEqual(Album.objects.all().db, 'default')
+        with replica_reads():
+            self.assertEqual(Album.objects.all().db, REPLICA)
+            self.assertEqual(Album.objects.select_for_update().db, 'default')
+        self.assertEqual(Album.objects.all().db, 'default')
+
+    @mock.patch('music.routers.replica_configured', lambda: True)
+    def test_pinned_after_change(self):
+        """
+        A user who has just changed their library reads it from the primary.
+        """
+        def view(request):
+            return Album.objects.all().db
+
+        request = RequestFactory().get('/')
+        request.user = self.user
+        self.assertEqual(read_from_replica(view)(request), REPLICA)
+
+        self.client.force_login(self.user)
+        self.client.get(reverse('music:album-favourite', kwargs={'album_id': self.album.pk}), HTTP_REFERER='/')
+        self.assertTrue(is_pinned(self.user))
+        self.assertEqual(read_from_replica(view)(request), 'default')
+
+    @mock.patch('music.routers.replica_configured', lambda: True)
+    def test_pinned_after_playlist_change(self):
+        """
+        A user who has just changed a playlist reads it from the primary, whichever change it was.
+        """
+        def post(name, data, **kwargs):
+            cache.clear()
+            response = self.client.post(reverse(name, kwargs=kwargs), data)
+            self.assertTrue(is_pinned(self.user), name)
+            return response.json()
+
+        song = Song.objects.create(album=self.album, title="Song")
+        self.client.force_login(self.user)
+        playlist_id = post('music:playlists', {'name': "Playlist"})['id']
+        entry_id = post('music:playlist-add', {'id': [song.pk]}, playlist_id=playlist_id)['entries'][0]
+        post('music:playlist-move', {'after': ''}, entry_id=entry_id)
+        post('music:playlist-remove', {}, entry_id=entry_id)
+        self.assertFalse(PlaylistEntry.objects.exists())
+
+    @skipUnless(REPLICA in settings.DATABASES, "No replica is configured.")
+    def test_pages_read_from_replica(self):
+        """
+        The library pages only read the session and the user from the primary.
+        """
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connections[REPLICA]) as replica_queries:
+            # The user, who isn't cached yet after logging in. The session is.
+            with self.assertNumQueries(1):
+                self.client.get(reverse('music:songs'))
+        self.assertTrue(replica_queries)
+
+
+class StartupTests(TestCase):
+
+    def setUp(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        settings = self.settings(STATIC_ROOT=static_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_only_does_what_is_needed(self):
+        """
+        Static files are collected once, then left alone until they change, and applied migrations are skipped.
+        """
+        out = StringIO()
+        call_command('startup', verbosity=0, stdout=out)
+        self.assertIn("Applied 0 migration(s)", out.getvalue())
+        self.assertIn("Collected static files", out.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(settings.STATIC_ROOT, 'music', 'favourite.js')))
+
+        out = StringIO()
+        call_command('startup', verbosity=0, stdout=out)
+        self.assertIn("Static files unchanged", out.getvalue())
+
+    def test_hashed_and_compressed(self):
+        """
+        Templates link to hashed names, which have gzip and brotli copies next to them.
+        """
+        call_command('startup', verbosity=0, stdout=StringIO())
+        url = Template("{% load static %}{% static 'music/style.css' %}").render(Context())
+        self.assertRegex(url, r'^/static/music/style\.[0-9a-f]{12}\.css$')
+        path = os.path.join(settings.STATIC_ROOT, url[len('/static/'):])
+        with open(path, 'rb') as f:
+            # Its reference to the background image was rewritten too
+            self.assertRegex(f.read(), rb'background\.[0-9a-f]{12}\.png')
+        self.assertTrue(os.path.exists(path + '.gz'))
+        self.assertTrue(os.path.exists(path + '.br'))
+
+    def test_templates_only_link_hashed_assets(self):
+        self.assertEqual(check_static_references(None), [])
+        self.assertEqual(unhashed_assets(
+            '<link href="/static/music/style.css"> <script src="{% static \'music/playMusic.js\' %}"></script> '
+            '<img src="https://example.com/star.png">'), ['/static/music/style.css'])
+
+
+class BenchmarkTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root, INGEST_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_every_route_benchmarked(self):
+        names = {pattern.name for pattern in music_urls.urlpatterns}
+        self.assertEqual(names, {route.name for route in ROUTES})
+
+    def test_queries_independent_of_library_size(self):
+        """
+        No page takes more queries than its ceiling, or more queries for a bigger library.
+        """
+        results, failures = run_benchmarks([Size(1, 2, 2), Size(2, 5, 4)], repeat=1)
+        self.assertEqual(failures, [])
+        self.assertEqual(len(results), 2 * len(ROUTES))
+        self.assertTrue(all(result['status'] < 500 for result in results))
+
+
+class RequestTimingTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="user")
+        self.album = Album.objects.create(title="1", artist="user", user=self.user, logo="test.png")
+        self.client.force_login(self.user)
+
+    def test_off_by_default(self):
+        self.assertFalse(self.client.get(reverse('music:songs')).has_header('Server-Timing'))
+
+    def test_server_timing_and_slow_log(self):
+        with self.settings(REQUEST_TIMING=True, REQUEST_TIMING_SLOW_MS=0):
+            with self.assertLogs('music.middleware', 'WARNING') as logs:
+                response = self.client.get(reverse('music:index'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", render;dur=[\d.]+, total;dur=')
+        self.assertIn('"view": "music.views.IndexView"', logs.output[0])
+
+    def test_repeated_queries(self):
+        queries = [('SELECT * FROM "song" WHERE "album_id" = %s', 0.001)] * 5 + [
+            ('SELECT * FROM "song" WHERE "id" IN (%s, %s)', 0.001), ('SELECT * FROM "song" WHERE "id" IN (%s)', 0.001)]
+        self.assertEqual(repeated_queries(queries, 2), [
+            ('SELECT * FROM "song" WHERE "album_id" = %s', 5), ('SELECT * FROM "song" WHERE "id" IN (%s...)', 2)])
+
+
+@override_settings(**CACHED_AUTH_SETTINGS)
+class SessionCacheTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="user", first_name="Old")
+        self.user.set_password("old password")
+        self.user.save()
+        self.client.force_login(self.user)
+        # Caches the user
+        self.client.get(reverse('music:songs'))
+
+    def test_session_and_user_cached(self):
+        """
+        A logged in user's page reads neither the session nor the user from the database, nor saves the session.
+        """
+        self.assertEqual(self.session_and_user_queries(), [])
+
+    def test_changed_user_forgotten(self):
+        User.objects.get(pk=self.user.pk).save()
+        self.assertEqual(len(self.session_and_user_queries()), 1)
+
+    def session_and_user_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('music:songs'))
+        tables = ['"%s"' % User._meta.db_table, '"django_session"']
+        return [query['sql'] for query in queries if any(table in query['sql'] for table in tables)]
+
+    def test_model_backend_session_kept(self):
+        """
+        Sessions logged in through ModelBackend, before users were cached, stay logged in.
+        """
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        response = self.client.get(reverse('music:songs'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['user'], self.user)
+
+    def test_password_change_keeps_user_logged_in(self):
+        response = self.client.post(reverse('music:user-edit', args=[self.user.pk]), {
+            'username': "user", 'first_name': "New", 'last_name': "", 'email': "user@example.com",
+            'password': "new password"}, HTTP_REFERER=reverse('music:songs'))
+        self.assertRedirects(response, reverse('music:songs'))
+        response = self.client.get(reverse('music:songs'))
+        self.assertEqual(response.context['user'].first_name, "New")
+        self.assertTrue(response.context['user'].check_password("new password"))
+
+
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        profile_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_root)
+        settings = self.settings(PROFILE_ROOT=profile_root, PROFILE_KEEP=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.staff = User.objects.create(username="staff", is_staff=True)
+        self.user = User.objects.create(username="user")
+
+    def test_staff_request_profiled(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('music:index'), {'_profile': 1})
+        self.assertEqual(profile_names(), [response['X-Profile-Name']])
+        response = self.client.get(reverse('music:profile-download', args=[response['X-Profile-Name'] + '.json']))
+        self.assertIn(b'"queries"', b''.join(response.streaming_content))
+
+    def test_admin_profiled_with_header(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('admin:index'), HTTP_X_PROFILE='1')
+        self.assertTrue(response.has_header('X-Profile-Name'))
+
+    def test_non_staff_not_profiled(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('music:index'), {'_profile': 1}, HTTP_X_PROFILE='1')
+        self.assertFalse(response.has_header('X-Profile-Name'))
+        self.assertEqual(profile_names(), [])
+        self.assertRedirects(self.client.get(reverse('music:profiles')),
+                             reverse('admin:login') + '?next=' + reverse('music:profiles'))
+
+    def test_only_latest_kept(self):
+        """
+        Only the latest PROFILE_KEEP profiles are kept, and listed newest first.
+        """
+        self.client.force_login(self.staff)
+        names = [self.client.get(reverse('music:songs'), HTTP_X_PROFILE='1')['X-Profile-Name'] for _ in range(3)]
+        self.assertEqual(set(profile_names()), set(names[1:]))
+        self.assertEqual(len(os.listdir(settings.PROFILE_ROOT)), 4)
+        response = self.client.get(reverse('music:profiles'))
+        self.assertContains(response, names[2] + '.prof')
+        self.assertNotContains(response, names[0])
+
+    def test_download_only_profiles(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('music:profile-download', args=['..settings.py']))
+        self.assertEqual(response.status_code, 404)
+
+
+class PlaylistTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="user")
+        self.album = Album.objects.create(title="1", artist="user", user=self.user, logo="test.png")
+        self.songs = [Song.objects.create(album=self.album, title=str(i), audio_file="%d.wav" % i) for i in range(4)]
+        self.playlist = Playlist.objects.create(user=self.user, name="Playlist")
+        self.entries = self.playlist.append(self.songs)
+        self.client.force_login(self.user)
+
+    def order(self):
+        return list(self.playlist.entries.order_by('position', 'id').values_list('pk', flat=True))
+
+    def test_move_updates_one_row(self):
+        first, second, third, fourth = self.entries
+        # The lock, the entry moved after, the entry that follows it and the update, in a savepoint
+        with CaptureQueriesContext(connection) as queries, self.assertNumQueries(6):
+            self.playlist.move(fourth, after=first)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(self.order(), [first.pk, fourth.pk, second.pk, third.pk])
+        self.playlist.move(second)
+        self.assertEqual(self.order(), [second.pk, first.pk, fourth.pk, third.pk])
+
+    def test_renumbered_once_gap_used_up(self):
+        """
+        Moving entries to the same place over and over eventually runs out of room there, and renumbers them.
+        """
+        first = self.entries[0]
+        expected = self.order()
+        with mock.patch.object(Playlist, 'renumber', autospec=True, side_effect=Playlist.renumber) as renumber:
+            for _ in range(40):
+                last = PlaylistEntry.objects.get(pk=expected[-1])
+                self.playlist.move(last, after=first)
+                expected.insert(1, expected.pop())
+        self.assertEqual(renumber.call_count, 2)
+        self.assertEqual(self.order(), expected)
+        # The entries and one update of them all, however many entries there are
+        with self.assertNumQueries(2):
+            self.playlist.renumber()
+
+    def test_views(self):
+        response = self.client.post(reverse('music:playlist-add', args=[self.playlist.pk]), {
+            'id': [self.songs[0].pk, self.songs[0].pk]})
+        added = response.json()['entries']
+        self.client.post(reverse('music:playlist-move', args=[added[1]]), {'after': ''})
+        self.client.post(reverse('music:playlist-remove', args=[self.entries[0].pk]))
+        songs = self.client.get(reverse('music:playlist', args=[self.playlist.pk])).json()['songs']
+        self.assertEqual([song['entry'] for song in songs], [added[1]] + [entry.pk for entry in self.entries[1:]] + [
+            added[0]])
+        self.assertEqual(songs[0]['url'], self.songs[0].get_stream_url())
+
+    def test_other_users_playlists(self):
+        other = User.objects.create(username="other")
+        playlist = Playlist.objects.create(user=other, name="Other")
+        self.assertEqual(self.client.get(reverse('music:playlist', args=[playlist.pk])).status_code, 404)
+        response = self.client.post(reverse('music:playlist-add', args=[self.playlist.pk]), {'id': [0]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('music:playlists')).json()['playlists'][0]['name'], "Playlist")
+
+    def test_queue(self):
+        Song.objects.filter(pk=self.songs[2].pk).update(is_favourite=True)
+        Song.objects.create(album=self.album, title="No file")
+        songs = self.client.get(reverse('music:queue'), {'album': self.album.pk}).json()['songs']
+        self.assertEqual([song['id'] for song in songs], [self.songs[i].pk for i in (2, 0, 1, 3)])
+
+    def test_gap(self):
+        self.assertEqual([entry.position for entry in self.entries], [POSITION_GAP * i for i in range(1, 5)])
+        self.assertEqual(PlaylistEntry.objects.owned_by(self.user).count(), 4)
+
+
+class OfflineCacheTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="user")
+        self.album = Album.objects.create(title="1", artist="user", user=self.user, logo="test.png")
+        self.song = Song.objects.create(album=self.album, title="1", audio_file="1.wav", is_favourite=True)
+        self.client.force_login(self.user)
+
+    def test_stream_url_versioned(self):
+        """
+        A song's stream URL changes with its file, so that the browser never plays an old copy of it.
+        """
+        url = self.song.get_stream_url()
+        self.assertTrue(url.startswith(reverse('music:song-stream', args=[self.song.pk]) + '?v='))
+        self.song.audio_file = "2.wav"
+        self.assertNotEqual(self.song.get_stream_url(), url)
+        self.assertContains(self.client.get(reverse('music:detail', args=[self.album.pk])), url)
+
+    def test_service_worker(self):
+        response = self.client.get(reverse('music:service-worker'))
+        self.assertEqual(response['Content-Type'], 'application/javascript')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertContains(response, 'const CACHE_BYTES = %d;' % settings.OFFLINE_CACHE_BYTES)
+        self.assertContains(response, reverse('music:song-delete', args=[1]))
+
+    def test_sync(self):
+        """
+        Copies of songs that have been deleted or given a new file are out of date, and favourites are listed.
+        """
+        current = 'http://testserver' + self.song.get_stream_url()
+        deleted = Song.objects.create(album=self.album, title="2", audio_file="2.wav")
+        replaced = Song.objects.create(album=self.album, title="3", audio_file="3.wav")
+        cached = [current, deleted.get_stream_url(), replaced.get_stream_url(), '/elsewhere/']
+        deleted.delete()
+        replaced.audio_file = "4.wav"
+        replaced.save()
+
+        response = self.client.post(reverse('music:offline-sync'), {'cached': cached},
+                                    content_type='application/json')
+        self.assertEqual(response.json(), {'stale': cached[1:], 'favourites': [self.song.get_stream_url()]})
+
+    def test_sync_other_users_songs_stale(self):
+        self.client.force_login(User.objects.create(username="other"))
+        response = self.client.post(reverse('music:offline-sync'), {'url': [self.song.get_stream_url()]})
+        self.assertEqual(response.json(), {'stale': [self.song.get_stream_url()], 'favourites': []})
+
+
+@override_settings(**CACHED_AUTH_SETTINGS)
+class ApiTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="user")
+        self.album = Album.objects.create(title="1", artist="user", genre="Rock", user=self.user, logo="test.png")
+        for i in range(5):
+            Song.objects.create(album=self.album, title="Song %d" % i, audio_file="test.mp3")
+        self.client.force_login(self.user)
+
+    def test_list_queries(self):
+        """
+        Every list and detail endpoint takes a fixed number of queries, however many objects it returns.
+        """
+        song = Song.objects.first()
+        # Caches the user
+        self.client.get(reverse('api:album-list'))
+        for url in [reverse('api:album-list'), reverse('api:song-list'),
+                    reverse('api:album-detail', kwargs={'pk': self.album.pk}),
+                    reverse('api:song-detail', kwargs={'pk': song.pk})]:
+            # The objects, with the albums of songs joined in. The session and the user are cached.
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_song_embeds_album(self):
+        response = self.client.get(reverse('api:song-list'))
+        song = response.json()['results'][0]
+        self.assertEqual(song['title'], "Song 0")
+        self.assertEqual(song['album'], {'id': self.album.pk, 'artist': "user", 'title': "1", 'genre': "Rock"})
+
+    def test_sparse_fields(self):
+        """
+        Only the requested fields are returned, and only their columns are selected.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api:album-list'), {'fields': 'id,title'})
+        self.assertEqual(response.json()['results'], [{'id': self.album.pk, 'title': "1"}])
+        self.assertNotIn('"genre"', queries[-1]['sql'])
+        response = self.client.get(reverse('api:album-list'), {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_pagination(self):
+        """
+        Following the next links visits every song once.
+        """
+        url, titles = reverse('api:song-list') + '?limit=2&fields=title', []
+        while url:
+            response = self.client.get(url).json()
+            titles += [song['title'] for song in response['results']]
+            url = response['next']
+        self.assertEqual(titles, ["Song %d" % i for i in range(5)])
+
+    def test_search_pagination(self):
+        """
+        Following the next links of a search visits every match once, in rank order, even when ranks are tied.
+        """
+        Song.objects.bulk_create(
+            Song(album=self.album, title="Song" if i % 2 else "Song Song", audio_file="test.mp3") for i in range(6))
+        Song.objects.update_search_vectors()
+        expected = list(search(Song.objects.all(), "song").order_by('-rank', 'id').values_list('id', flat=True))
+
+        url, ids = reverse('api:song-list') + '?q=song&limit=2&fields=id', []
+        while url:
+            response = self.client.get(url).json()
+            ids += [song['id'] for song in response['results']]
+            url = response['next']
+        self.assertEqual(len(expected), 11)
+        self.assertEqual(ids, expected)
+
+    def test_update_and_delete(self):
+        url = reverse('api:album-detail', kwargs={'pk': self.album.pk})
+        response = self.client.patch(url, {'genre': "Jazz"}, content_type='application/json')
+        self.assertEqual(response.json()['genre'], "Jazz")
+        self.assertEqual(Album.objects.get().title, "1")
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(Album.objects.exists())
+
+    def test_update_with_form_data(self):
+        """
+        PATCH bodies are read as forms too, and any other kind of body is refused rather than ignored.
+        """
+        url = reverse('api:album-detail', kwargs={'pk': self.album.pk})
+        response = self.client.patch(url, encode_multipart(BOUNDARY, {'genre': "Jazz"}), content_type=MULTIPART_CONTENT)
+        self.assertEqual(response.json()['genre'], "Jazz")
+        response = self.client.patch(url, "genre=Pop", content_type='application/x-www-form-urlencoded')
+        self.assertEqual(response.json()['genre'], "Pop")
+        response = self.client.patch(url, "genre: Folk", content_type='text/yaml')
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(Album.objects.get().genre, "Pop")
+
+    def test_other_users_objects(self):
+        self.client.force_login(User.objects.create(username="user1"))
+        self.assertEqual(self.client.get(reverse('api:album-list')).json()['results'], [])
+        url = reverse('api:album-detail', kwargs={'pk': self.album.pk})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 401)
@@ -0,0 +1,130 @@
+import base64
+import binascii
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from .models import Song
+
+BUFFER_SIZE = 64 * 1024
+
+
+class PartialFile(File):
+    """
+    A finished upload. Having a temporary_file_path() makes FileSystemStorage move it into place instead of copying it.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def partial_path(upload):
+    return os.path.join(settings.CHUNKED_UPLOAD_ROOT, str(upload.pk) + '.part')
+
+
+def parse_checksum(header):
+    """
+    Parses an "Upload-Checksum: sha256 <base64 digest>" header into the raw digest.
+    """
+    if not header:
+        return None
+    algorithm, _, value = header.partition(' ')
+    if algorithm.lower() != 'sha256':
+        raise ValueError("Only sha256 checksums are supported.")
+    try:
+        return base64.b64decode(value, validate=True)
+    except binascii.Error:
+        raise ValueError("The checksum is not valid base64.")
+
+
+class UploadBusy(Exception):
+    """
+    Raised when another request is already writing a chunk of the same upload.
+    """
+
+
+@contextmanager
+def open_partial(upload):
+    """
+    Opens the upload's partial file with an exclusive lock, so that only one request at a time writes to it. The lock
+    is on the file rather than the Upload row, so no transaction is held open while a chunk arrives from a slow client.
+    Raises UploadBusy straight away if another request holds the lock.
+    """
+    os.makedirs(settings.CHUNKED_UPLOAD_ROOT, exist_ok=True)
+    fd = os.open(partial_path(upload), os.O_RDWR | os.O_CREAT, 0o600)
+    with os.fdopen(fd, 'r+b') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadBusy("Another chunk of this upload is being sent.")
+        yield f
+
+
+def append_chunk(upload, f, stream, length, checksum=None):
+    """
+    Streams a chunk from the request straight into the locked partial file at the upload's offset, a buffer at a
+    time. Returns the new offset. If the chunk is cut short or doesn't match its checksum, it is discarded and
+    ValueError is raised, so the client can resend it from the same offset.
+    """
+    digest = hashlib.sha256()
+    written = 0
+    # Anything past the offset is left over from a chunk that failed part way through
+    f.truncate(upload.offset)
+    f.seek(upload.offset)
+    while written < length:
+        data = stream.read(min(BUFFER_SIZE, length - written))
+        if not data:
+            break
+        f.write(data)
+        digest.update(data)
+        written += len(data)
+
+    if written != length:
+        f.truncate(upload.offset)
+        raise ValueError("The chunk was incomplete.")
+    if checksum is not None and digest.digest() != checksum:
+        f.truncate(upload.offset)
+        raise ValueError("The chunk does not match its checksum.")
+    return upload.offset + written
+
+
+def file_sha256(path):
+    """
+    Returns the hex SHA-256 digest of a file, reading it a buffer at a time.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(BUFFER_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def finish_upload(upload):
+    """
+    Moves the completed file into media storage and creates its Song, then deletes the upload.
+    """
+    # One transaction, so that an identical file already in storage can't be deleted before the song is saved
+    with transaction.atomic():
+        with open(partial_path(upload), 'rb') as f:
+            song = Song(album=upload.album, title=upload.title)
+            song.audio_file.save(upload.filename, PartialFile(f), save=False)
+        song.save()
+    # Content storage leaves the partial file where it is when an identical file is already stored
+    discard_upload(upload)
+    return song
+
+
+def discard_upload(upload):
+    """
+    Deletes an abandoned upload and its partial file.
+    """
+    try:
+        os.remove(partial_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
@@ -16,6 +16,42 @@ urlpatterns = [
     # /music/register/
     path('register/', views.UserFormView.as_view(), name='register'),
 
+    # /music/favourites/
+    path('favourites/', views.favourite_many, name='favourite-many'),
+
+    # /music/export/
+    path('export/', views.export_library, name='library-export'),
+
+    # /music/profiles/
+    path('profiles/', views.profiles, name='profiles'),
+
+    # /music/profiles/20200412T181502123456-3fa2b1c0.prof
+    path('profiles/<str:filename>', views.profile_download, name='profile-download'),
+
+    # /music/queue/?album=71
+    path('queue/', views.play_queue, name='queue'),
+
+    # /music/playlists/
+    path('playlists/', views.playlists, name='playlists'),
+
+    # /music/playlists/3/
+    path('playlists/<int:playlist_id>/', views.playlist, name='playlist'),
+
+    # /music/playlists/3/add/
+    path('playlists/<int:playlist_id>/add/', views.playlist_add, name='playlist-add'),
+
+    # /music/playlists/entries/12/move/
+    path('playlists/entries/<int:entry_id>/move/', views.playlist_move, name='playlist-move'),
+
+    # /music/playlists/entries/12/remove/
+    path('playlists/entries/<int:entry_id>/remove/', views.playlist_remove, name='playlist-remove'),
+
+    # /music/service-worker.js
+    path('service-worker.js', views.service_worker, name='service-worker'),
+
+    # /music/offline/sync/
+    path('offline/sync/', views.offline_sync, name='offline-sync'),
+
     # /music/71/
     path('<pk>/', views.DetailView.as_view(), name='detail'),
 
@@ -31,15 +67,30 @@ urlpatterns = [
     # /music/71/favourite/
     path('<album_id>/favourite/', views.favourite_album, name='album-favourite'),
 
+    # /music/71/export/
+    path('<album_id>/export/', views.export_library, name='album-export'),
+
     # /music/songs/2/favourite/
     path('songs/<song_id>/favourite/', views.favourite_song, name='favourite-song'),
 
+    # /music/songs/2/stream/
+    path('songs/<song_id>/stream/', views.stream_song, name='song-stream'),
+
     # /music/search/
     path('search/results/', views.search_albums, name='album-search'),
 
     # /music/71/add/
     path('<album_id>/add/', views.SongCreate.as_view(), name='song-add'),
 
+    # /music/71/upload/
+    path('<album_id>/upload/', views.upload_start, name='upload-start'),
+
+    # /music/uploads/0b8e.../
+    path('uploads/<uuid:upload_id>/', views.upload_chunk, name='upload-chunk'),
+
+    # /music/uploads/0b8e.../finish/
+    path('uploads/<uuid:upload_id>/finish/', views.upload_finish, name='upload-finish'),
+
     # /music/71/2/edit
     path('<album_id>/<pk>/edit/', views.SongUpdate.as_view(), name='song-update'),
 
@@ -1,21 +1,52 @@
+import json
+import os
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login, update_session_auth_hash
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
 from django.contrib.auth.views import LoginView, LogoutView
-from django.db.models import Q
-from django.shortcuts import redirect, render
+from django.db import transaction
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.decorators import method_decorator
 from django.views import generic
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import require_http_methods, require_POST
 from django.views.generic import View
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
-from django.urls import reverse_lazy
+from django.urls import Resolver404, resolve, reverse, reverse_lazy
+from .audio import AUDIO_TYPES, IMAGE_TYPES, sniff_file
+from .caching import library_condition
+from .export import library_entries, zip_library
 from .forms import UserForm
-from .models import Album, Song
-
+from .models import Album, Playlist, PlaylistEntry, Song, Upload, audio_version, stream_url
+from .pagination import KeysetPaginationMixin
+from .profiling import load_trace, profile_names, profile_path
+from .routers import pin_to_primary, read_from_replica
+from .search import search
+from .streaming import serve_file
+from .uploads import (
+    UploadBusy, append_chunk, discard_upload, file_sha256, finish_upload, open_partial, parse_checksum, partial_path
+)
+
+# Checked against the filename before a chunked upload starts, the file's header is checked once it's finished
 AUDIO_FILE_TYPES = ['wav', 'mp3', 'ogg']
-IMAGE_FILE_TYPES = ['png', 'jpg', 'jpeg']
 
 
+class OwnedObjectMixin(object):
+    """
+    Limits a view's queryset to the current user's objects, so a single query both fetches and authorises them.
+    """
+
+    def get_queryset(self):
+        return self.model.objects.owned_by(self.request.user)
+
+
+@method_decorator([library_condition, ensure_csrf_cookie, read_from_replica], name='get')
 class IndexView(LoginRequiredMixin, generic.ListView):
     """Album index view."""
     template_name = 'music/index.html'
@@ -26,7 +57,7 @@ class IndexView(LoginRequiredMixin, generic.ListView):
         """
         Returns the user's albums, ordered by favourites and then IDs.
         """
-        return Album.objects.filter(user=self.request.user).order_by('-is_favourite', 'id')
+        return Album.objects.owned_by(self.request.user).order_by('-is_favourite', 'id')
 
     def get_context_data(self):
         """
@@ -46,24 +77,22 @@ class IndexView(LoginRequiredMixin, generic.ListView):
         return context
 
 
-class DetailView(LoginRequiredMixin, generic.DetailView):
+@method_decorator([library_condition, ensure_csrf_cookie, read_from_replica], name='get')
+class DetailView(LoginRequiredMixin, OwnedObjectMixin, generic.DetailView):
     """Album detail view."""
     template_name = 'music/detail.html'
     model = Album
 
-    def dispatch(self, request, *args, **kwargs):
+    def get(self, request, *args, **kwargs):
         """
         If the album does not belong to this user, redirect them away.
         """
-        album = Album.objects.get(id=self.kwargs['pk'])
-        user_albums = Album.objects.filter(user=self.request.user)
-        album_id_list = []
-        for user_album in user_albums:
-            album_id_list.append(user_album.id)
-
-        if album.id not in album_id_list:
+        try:
+            self.object = self.get_object()
+        except Http404:
             return redirect("music:index")
-        return super(DetailView, self).dispatch(request, *args, **kwargs)
+        context = self.get_context_data(object=self.object)
+        return self.render_to_response(context)
 
     def get_context_data(self, **kwargs):
         """
@@ -71,7 +100,7 @@ class DetailView(LoginRequiredMixin, generic.DetailView):
         """
         context = super(DetailView, self).get_context_data(**kwargs)
         album = self.object
-        user_albums = Album.objects.filter(user=self.request.user)
+        user_albums = Album.objects.owned_by(self.request.user)
         context["all_albums"] = user_albums.filter(artist=album.artist).exclude(title=album.title).order_by("id")
         return context
 
@@ -84,61 +113,333 @@ class AlbumCreate(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         """
         Gets the current user and assigns the album to them.
-        Checks if the logo's file type is invalid - if so, refresh and display a blank form.
+        Checks if the logo is really an image, whatever it's called - if not, refresh and display a blank form.
         """
         user = self.request.user
         form.instance.user = user
 
-        file_type = form.instance.logo.url.split('.')[-1]
-        file_type = file_type.lower()
-        if file_type not in IMAGE_FILE_TYPES:
+        if sniff_file(form.cleaned_data['logo']) not in IMAGE_TYPES:
             messages.add_message(self.request, messages.INFO, "Invalid file type. Please try again.")
             return redirect(self.request.META.get('HTTP_REFERER'))
         return super(AlbumCreate, self).form_valid(form)
 
 
-class AlbumUpdate(LoginRequiredMixin, UpdateView):
+class AlbumUpdate(LoginRequiredMixin, OwnedObjectMixin, UpdateView):
     """Edit album view."""
     model = Album
     fields = ['artist', 'title', 'genre', 'logo']
 
 
-class AlbumDelete(LoginRequiredMixin, DeleteView):
+class AlbumDelete(LoginRequiredMixin, OwnedObjectMixin, DeleteView):
     """Delete album view."""
     model = Album
     success_url = reverse_lazy('music:index')
 
 
-def favourite_album(request, album_id):
+def toggle_favourite(request, queryset, pk):
     """
-    Flips the given album's "is_favourite" field and returns the user to the previous page.
+    Flips the favourite flag of one of the user's albums or songs.
+    POST (from the pages' scripts) returns the new value as JSON, GET returns the user to the previous page.
     """
     if not request.user.is_authenticated:
+        if request.method == "POST":
+            return JsonResponse({'error': "Please log in."}, status=401)
         return redirect("music:login")
-    album = Album.objects.get(pk=album_id)
-    album.is_favourite = not album.is_favourite
-    album.save()
+    is_favourite = queryset.owned_by(request.user).toggle_favourite(pk)
+    if is_favourite is None:
+        raise Http404("No such album or song.")
+    if request.method == "POST":
+        return JsonResponse({'id': int(pk), 'is_favourite': is_favourite})
     return redirect(request.META.get('HTTP_REFERER'))
 
 
+@require_http_methods(["GET", "POST"])
+def favourite_album(request, album_id):
+    """
+    Flips the given album's "is_favourite" field.
+    """
+    return toggle_favourite(request, Album.objects, album_id)
+
+
+@require_http_methods(["GET", "POST"])
 def favourite_song(request, song_id):
     """
     Same as above.
     """
+    return toggle_favourite(request, Song.objects, song_id)
+
+
+@require_POST
+def favourite_many(request):
+    """
+    Favourites (is_favourite=true) or unfavourites (is_favourite=false) many of the user's albums or songs
+    (type=album or type=song, one id parameter each) with a single UPDATE. Returns how many were changed.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Please log in."}, status=401)
+    model = {'album': Album, 'song': Song}.get(request.POST.get("type"))
+    is_favourite = {'true': True, 'false': False}.get(request.POST.get("is_favourite"))
+    try:
+        ids = [int(pk) for pk in request.POST.getlist("id")]
+    except ValueError:
+        ids = []
+    if model is None or is_favourite is None or not ids:
+        return JsonResponse({'error': "Expected a type, is_favourite and at least one id."}, status=400)
+
+    updated = model.objects.owned_by(request.user).filter(pk__in=ids).update(is_favourite=is_favourite)
+    return JsonResponse({'updated': updated, 'is_favourite': is_favourite})
+
+
+def stream_song(request, song_id):
+    """
+    Streams the song's audio file to the player, as long as the song belongs to the user.
+    """
     if not request.user.is_authenticated:
         return redirect("music:login")
-    song = Song.objects.get(pk=song_id)
-    song.is_favourite = not song.is_favourite
-    song.save()
-    return redirect(request.META.get('HTTP_REFERER'))
+    song = get_object_or_404(Song.objects.owned_by(request.user), pk=song_id)
+    if not song.audio_file:
+        raise Http404("This song has no audio file.")
+    return serve_file(request, song.audio_file)
+
+
+def queue_song(song_id, title, artist, duration, audio_file, **extra):
+    """
+    A song as the player's queue needs it (see playMusic.js).
+    """
+    return dict(extra, id=song_id, title=title, artist=artist, duration=duration, url=stream_url(song_id, audio_file))
+
+
+@read_from_replica
+def play_queue(request):
+    """
+    Returns the user's songs in the order of the songs list, or an album's (album=ID) in the order of its page,
+    for the player to queue. Songs without an audio file are left out.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Please log in."}, status=401)
+    songs = Song.objects.owned_by(request.user).exclude(audio_file='')
+    if request.GET.get('album'):
+        try:
+            songs = songs.filter(album_id=int(request.GET['album']))
+        except ValueError:
+            return JsonResponse({'error': "Expected an album ID."}, status=400)
+    rows = songs.order_by('-is_favourite', 'id').values_list(
+        'id', 'title', 'album__artist', 'duration', 'audio_file')
+    return JsonResponse({'songs': [queue_song(*row) for row in rows]})
+
+
+def playlist_changed(request):
+    """
+    Reads the user's playlists from the primary once the change commits, as library_changed() does for their albums,
+    so that the playlist view, which reads from the replica, doesn't miss it.
+    """
+    user_id = request.user.pk
+    transaction.on_commit(lambda: pin_to_primary([user_id]))
+
+
+@require_http_methods(['GET', 'POST'])
+def playlists(request):
+    """
+    Lists the user's playlists, or makes a new one from a name.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Please log in."}, status=401)
+    if request.method == 'POST':
+        name = request.POST.get('name', '').strip()
+        if not name or len(name) > Playlist._meta.get_field('name').max_length:
+            return JsonResponse({'error': "Expected a name of up to 250 characters."}, status=400)
+        playlist = Playlist.objects.create(user=request.user, name=name)
+        playlist_changed(request)
+        return JsonResponse({'id': playlist.pk, 'name': playlist.name,
+                             'url': reverse('music:playlist', kwargs={'playlist_id': playlist.pk})}, status=201)
+    rows = Playlist.objects.owned_by(request.user).order_by('name', 'id').values_list('id', 'name')
+    return JsonResponse({'playlists': [
+        {'id': pk, 'name': name, 'url': reverse('music:playlist', kwargs={'playlist_id': pk})} for pk, name in rows]})
+
+
+@read_from_replica
+def playlist(request, playlist_id):
+    """
+    Returns a playlist's songs in order, each with the ID of its entry, for moving or removing it.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Please log in."}, status=401)
+    playlist = get_object_or_404(Playlist.objects.owned_by(request.user), pk=playlist_id)
+    rows = playlist.entries.order_by('position', 'id').values_list(
+        'id', 'song_id', 'song__title', 'song__album__artist', 'song__duration', 'song__audio_file')
+    return JsonResponse({'id': playlist.pk, 'name': playlist.name, 'songs': [
+        queue_song(song_id, title, artist, duration, audio_file, entry=entry_id)
+        for entry_id, song_id, title, artist, duration, audio_file in rows]})
+
+
+@require_POST
+def playlist_add(request, playlist_id):
+    """
+    Adds the user's songs (one id parameter each) to the end of a playlist, in the order given.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Please log in."}, status=401)
+    playlist = get_object_or_404(Playlist.objects.owned_by(request.user), pk=playlist_id)
+    try:
+        ids = [int(pk) for pk in request.POST.getlist("id")]
+    except ValueError:
+        ids = []
+    songs = Song.objects.owned_by(request.user).only('id').in_bulk(ids)
+    if not ids or set(ids) - set(songs):
+        return JsonResponse({'error': "Expected the IDs of one or more of your songs."}, status=400)
+    entries = playlist.append(songs[pk] for pk in ids)
+    playlist_changed(request)
+    return JsonResponse({'entries': [entry.pk for entry in entries]})
+
+
+@require_POST
+def playlist_move(request, entry_id):
+    """
+    Moves a playlist entry to just after another entry (after=ID), or to the start if after is empty.
+    Only the moved entry's row is updated, see Playlist.move().
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Please log in."}, status=401)
+    entry = get_object_or_404(PlaylistEntry.objects.owned_by(request.user).select_related('playlist'), pk=entry_id)
+    after = None
+    if request.POST.get('after'):
+        try:
+            after = entry.playlist.entries.get(pk=int(request.POST['after']))
+        except (ValueError, PlaylistEntry.DoesNotExist):
+            return JsonResponse({'error': "Expected the ID of an entry in the same playlist."}, status=400)
+    entry.playlist.move(entry, after)
+    playlist_changed(request)
+    return JsonResponse({'position': entry.position})
+
+
+@require_POST
+def playlist_remove(request, entry_id):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Please log in."}, status=401)
+    deleted, _ = PlaylistEntry.objects.owned_by(request.user).filter(pk=entry_id).delete()
+    if not deleted:
+        raise Http404("No such playlist entry.")
+    playlist_changed(request)
+    return JsonResponse({'removed': entry_id})
+
+
+def service_worker(request):
+    """
+    The service worker that keeps songs in the browser for playing offline. It's served from the root, rather than
+    with the static files, so that it can handle requests for the whole site, and never cached, so that browsers
+    notice new versions.
+    """
+    response = render(request, 'music/service-worker.js', {
+        'cache_bytes': settings.OFFLINE_CACHE_BYTES,
+    }, content_type='application/javascript')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def parse_stream_url(url):
+    """
+    Returns the song ID and the version of a stream URL, or None if it isn't one.
+    """
+    parts = urlsplit(url)
+    try:
+        match = resolve(parts.path)
+    except Resolver404:
+        return None
+    if match.view_name != 'music:song-stream' or not match.kwargs['song_id'].isdigit():
+        return None
+    return int(match.kwargs['song_id']), parse_qs(parts.query).get('v', [None])[0]
+
+
+@require_POST
+def offline_sync(request):
+    """
+    Tells the service worker which of the songs it keeps (a JSON list of their stream URLs as "cached", or one url
+    parameter each) are out of date, having been deleted or given a new file, and which favourites it could keep,
+    up to OFFLINE_FAVOURITES of them.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': "Please log in."}, status=401)
+    if request.content_type == 'application/json':
+        try:
+            cached = [str(url) for url in json.loads(request.body)['cached']]
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': "Expected a list of cached URLs."}, status=400)
+    else:
+        cached = request.POST.getlist('url')
+
+    versions = {url: parse_stream_url(url) for url in cached}
+    songs = Song.objects.owned_by(request.user).exclude(audio_file='').filter(
+        pk__in={version[0] for version in versions.values() if version}).values_list('id', 'audio_file')
+    current = {(song_id, audio_version(audio_file)) for song_id, audio_file in songs}
+
+    favourites = Song.objects.owned_by(request.user).exclude(audio_file='').filter(is_favourite=True).order_by(
+        '-id').values_list('id', 'audio_file')[:settings.OFFLINE_FAVOURITES]
+    return JsonResponse({
+        'stale': [url for url in cached if versions[url] not in current],
+        'favourites': [stream_url(song_id, audio_file) for song_id, audio_file in favourites],
+    })
+
+
+def export_library(request, album_id=None):
+    """
+    Downloads the user's library, or one of their albums, as a ZIP of the songs and a manifest.
+    The archive is streamed as it's built, so its size makes no difference to the memory it takes.
+    """
+    if not request.user.is_authenticated:
+        return redirect("music:login")
+    songs = Song.objects.owned_by(request.user)
+    filename = "library.zip"
+    if album_id is not None:
+        album = get_object_or_404(Album.objects.owned_by(request.user), pk=album_id)
+        songs = songs.filter(album=album)
+        filename = "album-%d.zip" % album.pk
+
+    # Read before streaming starts: under ASGI, streaming responses are iterated where queries aren't allowed
+    rows = songs.order_by('album__artist', 'album__title', 'album_id', 'id').values_list(
+        'album__artist', 'album__title', 'album__genre', 'album__is_favourite', 'title', 'is_favourite', 'duration',
+        'audio_file')
+    manifest, files = library_entries(rows, Song.audio_file.field.storage)
+    response = StreamingHttpResponse(zip_library(manifest, files), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    # Stop nginx spooling the whole archive to disk before sending it on
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@staff_member_required
+def profiles(request):
+    """
+    Lists the saved request profiles, newest first, for staff to download.
+    """
+    saved = []
+    for name in profile_names():
+        trace = load_trace(name)
+        if trace is not None:
+            saved.append(dict(trace, name=name, query_count=len(trace['queries'])))
+    return render(request, 'music/profiles.html', {'profiles': saved, 'keep': settings.PROFILE_KEEP})
 
 
+@staff_member_required
+def profile_download(request, filename):
+    """
+    Downloads a saved profile's cProfile stats, for snakeviz or flameprof, or its SQL trace.
+    """
+    path = profile_path(filename)
+    if path is None or not os.path.exists(path):
+        raise Http404("No such profile.")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
+
+
+@library_condition
+@read_from_replica
 def search_albums(request):
     """
-    Gets the query, filters the Album table from the database and sends them to the main page.
+    Gets the query, searches the user's albums and sends the best matches to the main page.
     """
-    query = request.GET.get("q")
-    album_list = Album.objects.filter(user=request.user).filter(Q(title__contains=query))
+    query = request.GET.get("q", "")
+    album_list = Album.objects.owned_by(request.user)
+    if query:
+        album_list = search(album_list, query).order_by('-rank', 'id')
     return render(request, 'music/index.html', {
         'all_albums': album_list,
         'search': True,
@@ -152,27 +453,119 @@ class SongCreate(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         """
-        Assigns the song to the album from the previous page.
-        Gets the extension of the audio file's url and redirects to previous page if invalid.
+        Assigns the song to the album from the previous page, as long as the album belongs to the user.
+        Checks the header of the audio file and redirects to previous page if it isn't audio.
         """
-        album = Album.objects.get(pk=self.kwargs['album_id'])
+        album = get_object_or_404(Album.objects.owned_by(self.request.user), pk=self.kwargs['album_id'])
         form.instance.album = album
 
-        file_type = form.instance.audio_file.url.split('.')[-1]
-        file_type = file_type.lower()
-        if file_type not in AUDIO_FILE_TYPES:
+        if sniff_file(form.cleaned_data['audio_file']) not in AUDIO_TYPES:
             messages.add_message(self.request, messages.INFO, "Invalid file type. Please try again.")
             return redirect(self.request.META.get('HTTP_REFERER'))
         return super(SongCreate, self).form_valid(form)
 
 
-class SongUpdate(LoginRequiredMixin, UpdateView):
+@require_POST
+def upload_start(request, album_id):
+    """
+    Starts a chunked song upload, checking the album and the file type before any of the file has been sent.
+    """
+    if not request.user.is_authenticated:
+        return redirect("music:login")
+    album = get_object_or_404(Album.objects.owned_by(request.user), pk=album_id)
+
+    title = request.POST.get("title", "")
+    filename = os.path.basename(request.POST.get("filename", ""))
+    try:
+        size = int(request.POST.get("size", ""))
+    except ValueError:
+        return JsonResponse({'error': "Missing file size."}, status=400)
+
+    if not title or filename.split('.')[-1].lower() not in AUDIO_FILE_TYPES:
+        return JsonResponse({'error': "Invalid file type. Please try again."}, status=400)
+    if not 0 < size <= settings.MAX_UPLOAD_SIZE:
+        return JsonResponse({'error': "The file is too large."}, status=413)
+
+    upload = Upload.objects.create(user=request.user, album=album, title=title, filename=filename, size=size)
+    return JsonResponse({
+        'id': str(upload.pk),
+        'url': reverse('music:upload-chunk', kwargs={'upload_id': upload.pk}),
+        'offset': upload.offset,
+        'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+    }, status=201)
+
+
+@require_http_methods(["GET", "PUT"])
+def upload_chunk(request, upload_id):
+    """
+    GET returns how much of the upload the server has, so that the client can resume from there.
+    PUT appends the request body at the "Upload-Offset" header, which must match what the server has.
+    """
+    if not request.user.is_authenticated:
+        return redirect("music:login")
+    upload = get_object_or_404(Upload, pk=upload_id, user=request.user)
+    if request.method == "GET":
+        return JsonResponse({'offset': upload.offset, 'size': upload.size})
+
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+        checksum = parse_checksum(request.headers.get("Upload-Checksum"))
+    except ValueError:
+        return JsonResponse({'error': "Invalid Upload-Offset or Upload-Checksum header."}, status=400)
+    length = int(request.META.get("CONTENT_LENGTH") or 0)
+
+    # Lock the partial file, so that two requests can't write the same chunk at once. The offset is read again once
+    # the lock is held, and the chunk is streamed in without a transaction open.
+    try:
+        with open_partial(upload) as f:
+            upload.refresh_from_db(fields=['offset'])
+            if offset != upload.offset:
+                return JsonResponse({'error': "Wrong offset.", 'offset': upload.offset}, status=409)
+            if upload.offset + length > upload.size:
+                return JsonResponse(
+                    {'error': "The chunk is past the end of the file.", 'offset': upload.offset}, status=413
+                )
+            try:
+                upload.offset = append_chunk(upload, f, request, length, checksum)
+            except ValueError as e:
+                return JsonResponse({'error': str(e), 'offset': upload.offset}, status=400)
+            upload.save(update_fields=['offset'])
+    except UploadBusy as e:
+        return JsonResponse({'error': str(e), 'offset': upload.offset}, status=409)
+    return JsonResponse({'offset': upload.offset, 'size': upload.size})
+
+
+@require_POST
+def upload_finish(request, upload_id):
+    """
+    Checks the upload is complete and, if one is given, that the whole file matches its SHA-256, then creates the song.
+    """
+    if not request.user.is_authenticated:
+        return redirect("music:login")
+    upload = get_object_or_404(Upload, pk=upload_id, user=request.user)
+    if upload.offset != upload.size:
+        return JsonResponse({'error': "The upload is incomplete.", 'offset': upload.offset}, status=409)
+
+    checksum = request.POST.get("sha256")
+    if checksum and checksum.lower() != file_sha256(partial_path(upload)):
+        discard_upload(upload)
+        return JsonResponse({'error': "The file does not match its checksum. Please try again."}, status=400)
+    with open(partial_path(upload), 'rb') as f:
+        if sniff_file(f) not in AUDIO_TYPES:
+            discard_upload(upload)
+            return JsonResponse({'error': "Invalid file type. Please try again."}, status=400)
+
+    song = finish_upload(upload)
+    return JsonResponse({'id': song.pk, 'url': song.get_absolute_url()}, status=201)
+
+
+class SongUpdate(LoginRequiredMixin, OwnedObjectMixin, UpdateView):
     """Song edit view."""
     model = Song
     fields = ['title', 'audio_file']
 
 
-class SongDelete(LoginRequiredMixin, DeleteView):
+class SongDelete(LoginRequiredMixin, OwnedObjectMixin, DeleteView):
     """Song delete view."""
     model = Song
 
@@ -184,33 +577,33 @@ class SongDelete(LoginRequiredMixin, DeleteView):
         return reverse_lazy('music:detail', kwargs={'pk': album.id})
 
 
-class SongView(LoginRequiredMixin, generic.ListView):
+@method_decorator([library_condition, ensure_csrf_cookie, read_from_replica], name='get')
+class SongView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     """Song list view."""
     template_name = 'music/songs.html'
     context_object_name = 'all_songs'
+    paginate_by = 50
+    keyset_ordering = ('-is_favourite', 'id')
 
-    def get_queryset(self):
+    def get_keyset_ordering(self):
         """
-        Get the user's songs from the database, then filter if there is a search.
+        Search results are ordered by how well they match instead.
         """
-        # Searches through the database's Album table for the user's albums.
-        song_ids = []
-        for album in Album.objects.filter(user=self.request.user):
-            for song in album.song_set.all():
-                # Adds the ID of each song to a list.
-                song_ids.append(song.pk)
+        if self.request.GET.get("s"):
+            return ('-rank', 'id')
+        return self.keyset_ordering
 
-        # Filters the database for all songs in the above list.
-        song_list = Song.objects.filter(pk__in=song_ids)
+    def get_queryset(self):
+        """
+        Get the user's songs (and their albums) in a single query, then filter if there is a search.
+        """
+        song_list = Song.objects.owned_by(self.request.user).select_related('album')
 
         # Check the page request for a search query.
-        try:
-            query = self.request.GET.get("s")
-            return song_list.filter(Q(title__icontains=query)).order_by('-is_favourite', 'id')
-
-        # An error is returned if there is no search, so display all songs.
-        except ValueError:
-            return song_list.order_by('-is_favourite', 'id')
+        query = self.request.GET.get("s")
+        if query:
+            song_list = search(song_list, query)
+        return song_list
 
 
 class UserFormView(View):
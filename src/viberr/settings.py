@@ -23,7 +23,7 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SECRET_KEY = os.environ.get("SECRET_KEY")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = os.environ.get("DEBUG", default=0)
+DEBUG = os.environ.get("DEBUG", "0").lower() in ("1", "true", "yes")
 
 ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS").split(" ")
 
@@ -37,19 +37,26 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'music.apps.MusicConfig',
-    
+
     'django_cleanup',
-    'django_extensions',
 ]
+# Development tools (e.g. shell_plus) are kept out of production, where they'd only slow down startup
+if DEBUG:
+    INSTALLED_APPS.append('django_extensions')
 
 MIDDLEWARE = [
+    # First, so that it times everything else. Does nothing unless REQUEST_TIMING is on.
+    'music.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # After authentication, which tells it who's staff. Only profiles the requests of staff who ask.
+    'music.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -88,8 +95,63 @@ DATABASES = {
         'PASSWORD': os.environ.get("POSTGRES_PASSWORD"),
         'HOST': 'postgres',
         'PORT': 5432,
+        # Keep connections open between requests rather than connecting for every one
+        'CONN_MAX_AGE': int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+    }
+}
+
+# Optional read replica of the primary, which the read-only library pages query (see music/routers.py).
+# To try it locally, point POSTGRES_REPLICA_HOST at the primary itself: tests then use it as a mirror.
+if os.environ.get("POSTGRES_REPLICA_HOST"):
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        HOST=os.environ["POSTGRES_REPLICA_HOST"],
+        PORT=int(os.environ.get("POSTGRES_REPLICA_PORT", 5432)),
+        TEST={'MIRROR': 'default'},
+    )
+DATABASE_ROUTERS = ['music.routers.ReplicaRouter']
+# How long a user's reads stay on the primary after they change their library, which should be longer than
+# the replica ever lags behind
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", 5))
+# Check that persistent connections still work before each request (see music/signals.py)
+DB_HEALTH_CHECKS = bool(int(os.environ.get("DB_HEALTH_CHECKS", 1)))
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# Holds the rendered parts of library pages (see music/caching.py). Local memory is only shared by the threads
+# of one process, so anything with several processes, including manage.py commands, needs a file-based or
+# shared cache, e.g. CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache and a directory as
+# CACHE_LOCATION.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get("CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get("CACHE_LOCATION", 'viberr'),
     }
 }
+LIBRARY_CACHE_TIMEOUT = 60 * 60
+
+# Local memory, like no cache at all, is private to each process
+SHARED_CACHE = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+# With a shared cache, sessions are read from the cache, and written to both the cache and the database, so that
+# they outlive the cache. The logged in user is cached too (see music/auth.py). With a cache private to each
+# process, a process could keep using a session or user another has since changed, e.g. after a logout, so both
+# come from the database instead.
+SESSION_ENGINE = os.environ.get(
+    "SESSION_ENGINE",
+    'django.contrib.sessions.backends.cached_db' if SHARED_CACHE else 'django.contrib.sessions.backends.db')
+# Sessions are only saved when a request changes them
+SESSION_SAVE_EVERY_REQUEST = False
+# ModelBackend stays, so that sessions it logged in carry on working
+AUTHENTICATION_BACKENDS = (['music.auth.CachedModelBackend'] if SHARED_CACHE else []) + [
+    'django.contrib.auth.backends.ModelBackend']
+AUTH_USER_CACHE_TIMEOUT = 60 * 60
+# Messages travel in a cookie, rather than being saved to the session by the request that adds them and
+# again by the one that shows them
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
 
 
 # Password validation
@@ -130,9 +192,56 @@ USE_TZ = True
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 STATIC_URL = '/static/'
+# Hashed names and precompressed copies, which nginx serves itself (see nginx.conf)
+STATICFILES_STORAGE = 'music.staticfiles.CompressedManifestStaticFilesStorage'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+# Internal nginx location that serves MEDIA_ROOT (see nginx.conf), e.g. "/protected-media/".
+# When unset, audio is streamed by Django itself.
+MEDIA_ACCEL_REDIRECT_URL = os.environ.get("MEDIA_ACCEL_REDIRECT_URL")
+
+# Chunked song uploads (see music/uploads.py). Partial files must be on the same filesystem as MEDIA_ROOT,
+# so that finished uploads can be moved into place rather than copied.
+CHUNKED_UPLOAD_ROOT = os.path.join(MEDIA_ROOT, 'partial')
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024
+# Worker processes that read the duration and tags of new songs and make thumbnails of new album logos
+# (see music/ingest.py). 0 does the work in the request instead.
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 2))
+
+
+# Set by entrypoint.sh as the container starts, so that each worker can log how long it took until it served
+# its first request (see music/signals.py)
+CONTAINER_STARTED_AT = float(os.environ.get("CONTAINER_STARTED_AT", 0)) or None
+
+# Server-Timing headers and logs of slow requests (see music/middleware.py). Requests slower than
+# REQUEST_TIMING_SLOW_MS, or that run one query REQUEST_TIMING_REPEATED_QUERIES times or more, are logged.
+REQUEST_TIMING = bool(int(os.environ.get("REQUEST_TIMING", 0)))
+REQUEST_TIMING_SLOW_MS = int(os.environ.get("REQUEST_TIMING_SLOW_MS", 500))
+REQUEST_TIMING_REPEATED_QUERIES = int(os.environ.get("REQUEST_TIMING_REPEATED_QUERIES", 10))
+
+# Profiles of single requests, asked for by staff with an "X-Profile" header or a "_profile" query parameter
+# (see music/profiling.py). The latest PROFILE_KEEP are kept in PROFILE_ROOT and listed at /profiles/.
+# 0 turns profiling off.
+PROFILE_ROOT = os.environ.get("PROFILE_ROOT", os.path.join(BASE_DIR, 'profiles'))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 50))
+
+# Songs kept in the browser by the service worker (see music/templates/music/service-worker.js), up to
+# OFFLINE_CACHE_BYTES of them, as many as OFFLINE_FAVOURITES of which are favourites kept before they're played.
+OFFLINE_CACHE_BYTES = int(os.environ.get("OFFLINE_CACHE_BYTES", 512 * 1024 * 1024))
+OFFLINE_FAVOURITES = int(os.environ.get("OFFLINE_FAVOURITES", 100))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'music': {'handlers': ['console'], 'level': os.environ.get("MUSIC_LOG_LEVEL", 'INFO')},
+    },
+}
 
 
 LOGIN_REDIRECT_URL = 'music:index'